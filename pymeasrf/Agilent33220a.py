@@ -5,58 +5,17 @@ ander906@purdue.edu
 HybridMEMS
 '''
 
-import visa
+from pymeasrf.instrument import Instrument
+from pymeasrf.scpiBatch import ScpiBatch
 import numpy as np
 
-class Agilent33220a:
+class Agilent33220a(Instrument):
     '''
     A class for controlling the Agilent 33220a Arbitrary Waveform Generator 
     using VISA commands. This class should also work for other AWGs that 
     implement the same syntax as no spec limits are currently implemented in the code.
     For detailed specifications, see page 336 of the 33220a User's Guide.  
     '''
-    
-    
-    def __init__(self, resource, label = None):
-        '''
-        Creates a new instrument instance and attempts connection. 
-        
-        Parameters:
-        -----------
-        resource : str
-            A string containing the VISA address of the device.
-        label : str
-            The name of the device that will be used to label data uniquely.
-        
-        Returns:
-        ----------
-        N/A
-        '''
-        self.connect(resource, label) 
-    
-    def connect(self, resource, label = None):
-        '''
-        Connect to the instrument. 
-        
-        Parameters:
-        -----------
-        resource : str
-            A string containing the VISA address of the device.
-        label : str
-            The name of the device that will be used to label data uniquely.
-        Returns:
-        ----------
-        N/A
-        '''
-        rm = visa.ResourceManager()
-        self.label = label
-        
-        # VisaIOError VI_ERROR_RSRC_NFOUND
-        try:
-          self.visaobj = rm.open_resource(resource)
-        except visa.VisaIOError as e:
-          print(e.args)
-          raise SystemExit(1)
 
     def basicOutput(self, wform, freq, ampl, offset = 0):
         '''
@@ -136,15 +95,16 @@ class Agilent33220a:
         ----------
         N/A
         '''
-        self.visaobj.write('FUNCtion {}'.format(wform))
-        self.visaobj.write('FREQuency:STARt {} KHZ'.format(freqStart))
-        self.visaobj.write('FREQuency:STOP {} KHZ'.format(freqStop))
-        self.visaobj.write('VOLTage {} VPP'.format(ampl))
-        self.visaobj.write('VOLTage:OFFSet {} V'.format(offset))
-        self.visaobj.write('SWEep:SPACing {}'.format(sweepType))
-        self.visaobj.write('SWEep:TIME {} S'.format(sweepTime))
-        self.visaobj.write('TRIGger:SOURce {}'.format(trig))
-        self.visaobj.write('SWEep:STATe ON')
+        with ScpiBatch(self) as awg:
+            awg.write('FUNCtion {}'.format(wform))
+            awg.write('FREQuency:STARt {} KHZ'.format(freqStart))
+            awg.write('FREQuency:STOP {} KHZ'.format(freqStop))
+            awg.write('VOLTage {} VPP'.format(ampl))
+            awg.write('VOLTage:OFFSet {} V'.format(offset))
+            awg.write('SWEep:SPACing {}'.format(sweepType))
+            awg.write('SWEep:TIME {} S'.format(sweepTime))
+            awg.write('TRIGger:SOURce {}'.format(trig))
+            awg.write('SWEep:STATe ON')
 
     def trigger(self):
         '''
@@ -159,47 +119,3 @@ class Agilent33220a:
         N/A
         '''
         self.visaobj.assert_trigger()
-          
-    def readError(self):
-        '''
-        Prints the most recent error and clears it from the error register on the SMU. 
-        
-        Parameters:
-        -----------
-        N/A
-        
-        Returns:
-        ----------
-        N/A
-        '''
-        print(self.visaobj.query('SYSTem:ERRor?'))
-        
-    def outputOff(self):
-        '''
-        Turns off output. 
-        
-        Parameters:
-        -----------
-        N/A
-        
-        Returns:
-        ----------
-        N/A
-        '''
-        self.visaobj.write(':OUTPut OFF')        
-        
-    def disconnect(self):
-        '''
-        Turns off output and disconnects from the SMU. 
-        
-        Parameters:
-        -----------
-        N/A
-        
-        Returns:
-        ----------
-        N/A
-        '''
-        self.outputOff()
-        self.visaobj.control_ren(6) # sends GTL (Go To Local) command
-        self.visaobj.close()
\ No newline at end of file
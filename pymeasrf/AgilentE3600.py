@@ -5,10 +5,13 @@ ander906@purdue.edu
 HybridMEMS
 '''
 
-import visa
+import pymeasrf.visaPool as visaPool
+from pymeasrf.instrument import Instrument
 import numpy as np
 
-class Keithley2400:
+class Keithley2400(Instrument):
+    errorQuery = 'SYSTem:ERRor:NEXT?'
+
     def __init__(self, resource, label = None, voltages = None):
         '''
         Creates a new Keithley 2400 SMU instance and attempts connection. 
@@ -27,7 +30,8 @@ class Keithley2400:
         ----------
         N/A
         '''
-        self.connect(resource, label, voltages) 
+        self.voltages = np.asarray(voltages)
+        Instrument.__init__(self, resource, label)
         self.voltageLimits = [20,40,60,80,120,160,210]
     
     def connect(self, resource, label = None, voltages = None):
@@ -43,20 +47,14 @@ class Keithley2400:
         voltages : list or array-like
             A list of voltages the user would like forced. 
             Used for stepping through voltage settings during measurements.
+            The current voltage list is kept if None.
         Returns:
         ----------
         N/A
         '''
-        rm = visa.ResourceManager()
-        self.label = label
-        self.voltages = np.asarray(voltages)
-        
-        # VisaIOError VI_ERROR_RSRC_NFOUND
-        try:
-          self.visaobj = rm.open_resource(resource)
-        except visa.VisaIOError as e:
-          print(e.args)
-          raise SystemExit(1)
+        if voltages is not None:
+            self.voltages = np.asarray(voltages)
+        Instrument.connect(self, resource, label)
 
     def smuSetup(self, maxVolt = 20, comp = 0.000105):
         '''
@@ -113,20 +111,6 @@ class Keithley2400:
         self.visaobj.query('*OPC?')
         self.visaobj.write(':SENSe:FUNCtion:ON "CURRent"')
 
-    def readError(self):
-        '''
-        Prints the most recent error and clears it from the error register on the SMU. 
-        
-        Parameters:
-        -----------
-        N/A
-        
-        Returns:
-        ----------
-        N/A
-        '''
-        print(self.visaobj.query('SYSTem:ERRor:NEXT?'))
-    
     def resetTime(self):
         '''
         Sets the internal timer to zero.
@@ -243,4 +227,4 @@ class Keithley2400:
   #      self.outputOff()
   #      self.visaobj.write(':SYSTem:KEY 23') # return to local
    #     self.visaobj.close()
-        
\ No newline at end of file
+        visaPool.release(self.resource)
@@ -5,56 +5,14 @@ ander906@purdue.edu
 HybridMEMS
 '''
 
-import visa
+from pymeasrf.instrument import Instrument
 import numpy as np
 
-class AgilentN9030A:
+class AgilentN9030A(Instrument):
     '''
     A class for controlling the Agilent N9030A PXA Signal Analyzer 
     using VISA commands. 
     '''
-    
-    
-    def __init__(self, resource, label = None):
-        '''
-        Creates a new instrument instance and attempts connection. 
-        
-        Parameters:
-        -----------
-        resource : str
-            A string containing the VISA address of the device.
-        label : str
-            The name of the device that will be used to label data uniquely.
-        
-        Returns:
-        ----------
-        N/A
-        '''
-        self.connect(resource, label) 
-    
-    def connect(self, resource, label = None):
-        '''
-        Connect to the instrument. 
-        
-        Parameters:
-        -----------
-        resource : str
-            A string containing the VISA address of the device.
-        label : str
-            The name of the device that will be used to label data uniquely.
-        Returns:
-        ----------
-        N/A
-        '''
-        rm = visa.ResourceManager()
-        self.label = label
-        
-        # VisaIOError VI_ERROR_RSRC_NFOUND
-        try:
-          self.visaobj = rm.open_resource(resource)
-        except visa.VisaIOError as e:
-          print(e.args)
-          raise SystemExit(1)
 
     def read(self, mode):
         '''
@@ -77,11 +35,11 @@ class AgilentN9030A:
         self.visaobj.timeout = 60000 # set timeout to 60s for measurement
         data = self.visaobj.query(':READ:{}?'.format(mode))
         self.visaobj.timeout = 2000 # set timeout back to 2s
-        return data  
-        
-    def disconnect(self):
+        return data
+
+    def outputOff(self):
         '''
-        Turns off output and disconnects from the SMU. 
+        The signal analyzer has no output to turn off; disconnect() only returns it to local control.
         
         Parameters:
         -----------
@@ -91,5 +49,4 @@ class AgilentN9030A:
         ----------
         N/A
         '''
-        self.visaobj.control_ren(6) # sends GTL (Go To Local) command
-        self.visaobj.close()
\ No newline at end of file
+        pass
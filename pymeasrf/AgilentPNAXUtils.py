@@ -5,12 +5,17 @@ ander906@purdue.edu
 HybridMEMS
 '''
 
-import visa
+from pymeasrf.instrument import Instrument
+from pymeasrf.scpiBatch import ScpiBatch
+from pymeasrf.buffers import RingBuffer
 import numpy as np
 import re as re
+import time
+import visa
+from pyvisa import constants
 import warnings
 
-class AgilentPNAx:
+class AgilentPNAx(Instrument):
     def __init__(self, resource):
         '''
         Create a new PNAx instance.
@@ -24,35 +29,21 @@ class AgilentPNAx:
         ----------
         N/A
         '''
-        self.connect(resource)
-        # socket communication slow - add delay between write and read
-        # to prevent "103 - invalid separator" errors
+        Instrument.__init__(self, resource, 'PNA')
+        self.sweepTimeout = 9000 # s, upper limit of the per-sweep timeout
+        # a sweep is considered stalled after timeoutFactor*expectedSweepTime() + timeoutMargin seconds
+        self.timeoutFactor = 3
+        self.timeoutMargin = 10 # s
+        self.saveTimeout = 600 # s, limit for saving an snp file on the PNA
+        self.fetchTimeout = 120 # s, limit for transferring snp data to the PC
+        self.templates = {} # prepared PnaMeasurement per channel
+        # SOCKET sessions need a bare linefeed termination - the VISA default
+        # of CR+LF causes "-103 invalid separator" errors. Sessions from the
+        # pool's ScpiSocket transport already terminate with LF.
         if re.search(r'.*SOCKET.*', resource):
-            self.visaobj.query_delay = 1 
             self.visaobj.read_termination = '\n'
+            self.visaobj.write_termination = '\n'
     
-    def connect(self, resource):
-        '''
-        Connect to the PNA. 
-        
-        Parameters:
-        -----------
-        resource : str
-            A string containing the VISA address of the device.
-        
-        Returns:
-        ----------
-        N/A
-        '''
-        rm = visa.ResourceManager()
-        
-        # VisaIOError VI_ERROR_RSRC_NFOUND
-        try:
-          self.visaobj = rm.open_resource(resource)
-        except visa.VisaIOError as e:
-          print(e.args)
-          raise SystemExit(1)
-
     def pnaInitSetup(self):
         '''
         Perform initial setup of the PNA after connecting.
@@ -74,8 +65,7 @@ class AgilentPNAx:
         pna.write('CALCulate:PARameter:DELete:ALL')
         pna.write('SENSe1:SWEep:MODE HOLD')
         pna.write('DISPlay:ENABLE ON') # set to OFF to speed up measurement
-        
-       
+        self.invalidateCache()
 
     def clearWindow(self,winNum):
         '''
@@ -97,30 +87,18 @@ class AgilentPNAx:
             traces = traces.split(',')
             for trace in traces:
                 self.visaobj.write("DISPlay:WINDow{}:{}:DELete".format(winNum,trace)) 
-            
-    def disconnect(self):
-        '''
-        Turns output off and disconnects from PNA.
-        
-        Parameters:
-        -----------
-        N/A
-        
-        Returns:
-        ----------
-        N/A
-        '''
-        self.outputOff()
-#        self.clearWindows()
-        self.visaobj.close()
-        
-        
+
+
     def pnaSetup(self, portNums, ifBandwidth = None, startFreq = None, stopFreq = None,
                  centFreq = None, spanFreq = None, srcPower = None, nPoints = None, 
-                 avgMode = None, nAvg = None):
+                 avgMode = None, nAvg = None, segments = None, channel = 1, clear = True):
         '''
         PNA measurement setup. Unpacks a dict of setup 
         
+        Settings already held by the PNA are not sent again (see Instrument.cachedWrite()).
+        All measurements, traces and windows are deleted first unless clear is False;
+        PnaMeasurement.setup() only clears when the measurement layout changes.
+        
         Parameters:
         -----------
         ifBandwidth: int
@@ -145,50 +123,369 @@ class AgilentPNAx:
             SWEEP : averages the results of n sweeps 
         nAvg : int
             number of averages to take
+        segments : list
+            Segmented sweep plan replacing the linear sweep, see setSegments().
+            ifBandwidth and srcPower are used for segments that do not set their own.
+        channel : int
+            The PNA channel to set up. Other channels keep their settings, but
+            their measurements are deleted along with this channel's if clear
+            is set.
+        clear : bool
+            Delete all measurements and set up the windows of portNums.
     
         Returns:
         ----------
         N/A
         '''
         #set up channel here: power, cal, if bandwidth, # pts, sweep settings, avg, trigger
-        pna = self.visaobj
-        pna.write('CALCulate:PARameter:DELete:ALL')
-        
-        # TODO: Fix window creation. Currently, error caused if quad windows not specified on PNA.
-        for n in portNums: 
-          pna.write('DISPlay:WINDow{}:STATE ON'.format(n))
-          self.clearWindow(n)
-    
-        if nPoints: pna.write('SENSe1:SWEep:POINts '+str(nPoints))
-        pna.write('SENSe1:SWEep:GENeration ANALog')
-        pna.write('SENSe1:SWEep:TIME:AUTO ON')
-        # Frequencies shouldn't be changed outside callibrated range
-        if startFreq and stopFreq: 
-          pna.write('SENSe1:FREQuency:STARt {}'.format(startFreq)) 
-          pna.write('SENSe1:FREQuency:STOP {}'.format(stopFreq))
-        if centFreq and spanFreq: 
-          pna.write('SENSe1:FREQuency:CENTer {}'.format(centFreq))
-          pna.write('SENSe1:FREQuency:SPAN {}'.format(spanFreq))
-        if srcPower:
-          for i in [1,2,3,4]:
-              maxPower = pna.query('SOURce{}:POWer? MAX'.format(i))
-              minPower = pna.query('SOURce1:POWer? MIN')
-              if srcPower >= minPower and srcPower <= maxPower:
-                  pna.write('SOURce{}:POWer1 {}'.format(i,srcPower))
+        sense = 'SENSe{}'.format(channel)
+        # a prepared PnaMeasurement must set up the channel again
+        self.invalidateCache('template{}'.format(channel), 'sweepTime{}'.format(channel))
+        with ScpiBatch(self) as pna:
+            if clear:
+                pna.write('CALCulate:PARameter:DELete:ALL')
+                self.forgetMeasurements()
+            
+                # TODO: Fix window creation. Currently, error caused if quad windows not specified on PNA.
+                for n in portNums: 
+                  pna.write('DISPlay:WINDow{}:STATE ON'.format(n))
+                  self.clearWindow(n)
+    
+            # limits are read from the capability cache, without bus traffic after the first use
+            limits = self.limits()
+            if nPoints:
+              if nPoints <= limits['points']:
+                  self.cachedWrite(sense + ':SWEep:POINts', nPoints)
+              else:
+                  warnings.warn('Specified number of points {} larger than the maximum of {}.'
+                                .format(nPoints,limits['points']))
+            self.cachedWrite(sense + ':SWEep:GENeration', 'ANALog')
+            self.cachedWrite(sense + ':SWEep:TIME:AUTO', 'ON')
+            if segments:
+                self.setSegments(segments, ifBandwidth, srcPower, channel)
+            elif startFreq or centFreq or nPoints:
+                self.cachedWrite(sense + ':SWEep:TYPE', 'LINear')
+            # Frequencies shouldn't be changed outside callibrated range
+            minFreq, maxFreq = limits['frequency']
+            if startFreq and stopFreq: 
+              if startFreq >= minFreq and stopFreq <= maxFreq:
+                  self.cachedWrite(sense + ':FREQuency:STARt', startFreq)
+                  self.cachedWrite(sense + ':FREQuency:STOP', stopFreq)
+                  self.invalidateCache(sense + ':FREQuency:CENTer', sense + ':FREQuency:SPAN')
+              else:
+                  warnings.warn('Specified frequency range {} to {} Hz not within the allowed range of {} to {} Hz.'
+                                .format(startFreq,stopFreq,minFreq,maxFreq))
+            if centFreq and spanFreq: 
+              if centFreq - spanFreq/2 >= minFreq and centFreq + spanFreq/2 <= maxFreq:
+                  self.cachedWrite(sense + ':FREQuency:CENTer', centFreq)
+                  self.cachedWrite(sense + ':FREQuency:SPAN', spanFreq)
+                  self.invalidateCache(sense + ':FREQuency:STARt', sense + ':FREQuency:STOP')
               else:
-                  warnings.warn('Specified source power of {} for port {} not\
-                                within the allowed range of {} to {} dBm.'
-                                .format(srcPower,i,minPower,maxPower))
-        ###
-        if avgMode: pna.write('SENSe1:AVERage:MODE {}'.format(avgMode))
-        if nAvg: pna.write('SENSe1:AVERage:COUNt {}'.format(nAvg))
-        if ifBandwidth: pna.write('SENSe1:BANDwidth {}'.format(ifBandwidth))
+                  warnings.warn('Specified frequency range {} +- {} Hz not within the allowed range of {} to {} Hz.'
+                                .format(centFreq,spanFreq/2,minFreq,maxFreq))
+            if srcPower and not all(self.isCached('SOURce{}:POWer{}'.format(channel,i), srcPower) for i in [1,2,3,4]):
+              for i in [1,2,3,4]:
+                  minPower, maxPower = limits['power'][i-1]
+                  if srcPower >= minPower and srcPower <= maxPower:
+                      self.cachedWrite('SOURce{}:POWer{}'.format(channel,i), srcPower)
+                      # sMeas() sets the same port powers by port name
+                      self.invalidateCache('SOURce{}:POWer Port {}'.format(channel,i),
+                                           'SOURce{}:POWer Bal Port {}'.format(channel,(i+1)//2))
+                  else:
+                      warnings.warn('Specified source power of {} for port {} not\
+                                    within the allowed range of {} to {} dBm.'
+                                    .format(srcPower,i,minPower,maxPower))
+            ###
+            if avgMode: self.cachedWrite(sense + ':AVERage:MODE', avgMode)
+            if nAvg: self.cachedWrite(sense + ':AVERage:COUNt', nAvg)
+            if ifBandwidth:
+              if ifBandwidth >= limits['ifBandwidth'][0] and ifBandwidth <= limits['ifBandwidth'][1]:
+                  self.cachedWrite(sense + ':BANDwidth', ifBandwidth)
+              else:
+                  warnings.warn('Specified IF bandwidth of {} Hz not within the allowed range of {} to {} Hz.'
+                                .format(ifBandwidth,limits['ifBandwidth'][0],limits['ifBandwidth'][1]))
+
+    def setSegments(self, segments, ifBandwidth = None, srcPower = None, channel = 1):
+        '''
+        Loads a segment table and switches the channel to a segmented sweep.
+        
+        Each segment is a dict with the keys startFreq, stopFreq (Hz) and nPoints,
+        and optionally ifBandwidth (Hz) and srcPower (dBm), e.g. dense points
+        around a resonance and sparse points elsewhere:
+        
+            [{'startFreq' : 1e9, 'stopFreq' : 9e9, 'nPoints' : 81, 'ifBandwidth' : 10e3},
+             {'startFreq' : 9e9, 'stopFreq' : 11e9, 'nPoints' : 801, 'ifBandwidth' : 1e3},
+             {'startFreq' : 11e9, 'stopFreq' : 20e9, 'nPoints' : 91, 'ifBandwidth' : 10e3}]
+        
+        The table is sent in one SENSe:SEGMent:LIST command, and not again while
+        the PNA holds it. A plan outside the PNA limits is not loaded.
+        
+        Parameters:
+        -----------
+        segments : list
+            The segments as dicts, in order of frequency.
+        ifBandwidth : float
+            IF bandwidth for segments without their own. Per-segment IF bandwidth
+            is only enabled if every segment has a value.
+        srcPower : float
+            Source power for segments without their own, enabled like ifBandwidth.
+        channel : int
+            The PNA channel.
+        
+        Returns:
+        ----------
+        N/A
+        '''
+        sense = 'SENSe{}'.format(channel)
+        limits = self.limits()
+        minFreq, maxFreq = limits['frequency']
+        minIf, maxIf = limits['ifBandwidth']
+        minPower = max(p[0] for p in limits['power'])
+        maxPower = min(p[1] for p in limits['power'])
+        ifbws = [seg.get('ifBandwidth', ifBandwidth) for seg in segments]
+        powers = [seg.get('srcPower', srcPower) for seg in segments]
+        ifControl = all(x is not None for x in ifbws)
+        powerControl = all(x is not None for x in powers)
+        nPoints = sum(seg['nPoints'] for seg in segments)
+        if nPoints > limits['points']:
+            warnings.warn('Segment table has {} points, more than the maximum of {}. Segments not set.'
+                          .format(nPoints,limits['points']))
+            return
+        data = []
+        for n, seg in enumerate(segments):
+            if seg['startFreq'] < minFreq or seg['stopFreq'] > maxFreq or seg['startFreq'] > seg['stopFreq']:
+                warnings.warn('Segment {} from {} to {} Hz not within the allowed range of {} to {} Hz. Segments not set.'
+                              .format(n+1,seg['startFreq'],seg['stopFreq'],minFreq,maxFreq))
+                return
+            if ifControl and not minIf <= ifbws[n] <= maxIf:
+                warnings.warn('Segment {} IF bandwidth of {} Hz not within the allowed range of {} to {} Hz. Segments not set.'
+                              .format(n+1,ifbws[n],minIf,maxIf))
+                return
+            if powerControl and not minPower <= powers[n] <= maxPower:
+                warnings.warn('Segment {} source power of {} dBm not within the allowed range of {} to {} dBm. Segments not set.'
+                              .format(n+1,powers[n],minPower,maxPower))
+                return
+            # state, points, start, stop, IF bandwidth, dwell time, power
+            data += [1, seg['nPoints'], seg['startFreq'], seg['stopFreq'],
+                     ifbws[n] if ifControl else 0, 0, powers[n] if powerControl else 0]
+        self.cachedWrite(sense + ':SEGMent:BWIDth:CONTrol', 'ON' if ifControl else 'OFF')
+        self.cachedWrite(sense + ':SEGMent:POWer:CONTrol', 'ON' if powerControl else 'OFF')
+        self.cachedWrite(sense + ':SEGMent:LIST', 'SSTOP,{},{}'.format(len(segments),','.join(str(x) for x in data)))
+        self.cachedWrite(sense + ':SWEep:TYPE', 'SEGMent')
+
+    def forgetMeasurements(self):
+        '''
+        Forgets the cached measurement layouts and templates of all channels,
+        since deleting the measurements removes them on every channel.
+        
+        Parameters:
+        -----------
+        N/A
+        
+        Returns:
+        ----------
+        N/A
+        '''
+        keys = [k for k in self.stateCache if k.startswith(('template', 'measurements'))]
+        if keys:
+            self.invalidateCache(*keys)
+
+    def expectedSweepTime(self, refresh = False, channel = 1):
+        '''
+        Returns the expected duration of one measurement trigger on a channel.
+        
+        The sweep time reported by the PNA for the current points, IF bandwidth
+        and sweep settings is multiplied by the number of measured ports (one
+        sweep per source port) and by the averaging count when sweep averaging
+        is on. The result is cached until the channel is set up again.
+        
+        Parameters:
+        -----------
+        refresh : bool
+            Query the PNA again even if a value is cached.
+        channel : int
+            The PNA channel.
+        
+        Returns:
+        ----------
+        sweepTime : float
+            Expected time in seconds.
+        '''
+        key = 'sweepTime{}'.format(channel)
+        if not refresh and key in self.stateCache:
+            return float(self.stateCache[key])
+        sense = 'SENSe{}'.format(channel)
+        sweep, avgState, avgMode, avgCount = self.visaobj.queryMany([sense + ':SWEep:TIME?', sense + ':AVERage:STATe?',
+                                                                    sense + ':AVERage:MODE?', sense + ':AVERage:COUNt?'])
+        measurement = self.templates.get(channel)
+        nPorts = len(measurement.nums) if measurement is not None else 1
+        nAvg = 1
+        if avgState.strip() in ['1', 'ON'] and avgMode.strip().upper().startswith('SWE'):
+            nAvg = int(float(avgCount))
+        sweepTime = float(sweep)*nPorts*nAvg
+        self.stateCache[key] = str(sweepTime)
+        return sweepTime
+
+    def expectedTimeout(self, channels = (1,)):
+        '''
+        Returns the time in seconds after which a sweep is considered stalled.
+        
+        Parameters:
+        -----------
+        channels : list
+            The channels swept by one trigger.
+        
+        Returns:
+        ----------
+        timeout : float
+            timeoutFactor times the expected sweep time plus timeoutMargin, at most sweepTimeout.
+        '''
+        sweepTime = sum(self.expectedSweepTime(channel = c) for c in channels)
+        return min(self.sweepTimeout, self.timeoutFactor*sweepTime + self.timeoutMargin)
 
+    def startSweep(self, timeout = None, channels = (1,)):
+        '''
+        Triggers a single sweep on one or more channels and returns without waiting for it.
+        
+        The channels are triggered with one command and sweep one after the
+        other; the returned operation completes when all of them are done.
+        
+        Parameters:
+        -----------
+        timeout : float
+            Stall limit in seconds. Defaults to expectedTimeout().
+        channels : list
+            The channels to sweep.
         
-    def sMeas(self, sPorts, savedir, localsavedir, testname, power = None, pnaparms = None, bal = False, phase = 0):
+        Returns:
+        ----------
+        operation : Operation
+            Use operation.done() or operation.wait() to check for or wait for the end of the sweep.
+        '''
+        if timeout is None:
+            timeout = self.expectedTimeout(channels)
+        command = ';:'.join('SENSe{}:SWEep:MODE SINGle'.format(c) for c in channels)
+        return self.startOperation(command, timeout, 'sweep')
+
+    def fetchSnp(self, sPorts, channel = 1):
+        '''
+        Reads the N-port data of the last sweep over the bus as a binary REAL,64 block.
+        
+        No file is written on the PNA. The result can be used directly, e.g. with
+        skrf.Network(frequency = freq, s = s, f_unit = 'Hz'), or saved with saveSnp().
+        The SNP and data format settings are restored after the transfer, so snp
+        files saved on the PNA and ASCII queries are not affected.
+        
+        Parameters:
+        -----------
+        sPorts : string
+            Comma seperated list of the measured ports.
+        channel : int
+            The PNA channel holding the measurement.
+        
+        Returns:
+        ----------
+        freq : np.ndarray
+            Frequencies in Hz, shape (nPoints,).
+        s : np.ndarray
+            Complex S-parameters, shape (nPoints, nPorts, nPorts); s[:,i,j] is S(i+1)(j+1).
+        '''
+        n = len(sPorts.split(','))
+        # the SNP and data formats are global PNA settings, used by saved snp files and ASCII queries too
+        previous = self.setFormats({'MMEMory:STORe:TRACe:FORMat:SNP' : 'RI', 'FORMat:DATA' : 'REAL,64', 'FORMat:BORDer' : 'SWAPped'})
+        timeout = self.visaobj.timeout
+        self.visaobj.timeout = self.fetchTimeout*1000
+        try:
+            values = self.visaobj.query_binary_values("CALCulate{}:DATA:SNP:PORTs? \'{}\'".format(channel,sPorts),
+                                                      datatype = 'd', is_big_endian = False, container = np.array)
+        finally:
+            self.visaobj.timeout = timeout
+            self.restoreFormats(previous)
+        # one frequency column, then a real and an imaginary column per S-parameter
+        nPoints = len(values) // (1 + 2*n*n)
+        data = np.asarray(values[:nPoints*(1 + 2*n*n)]).reshape(1 + 2*n*n, nPoints)
+        s = (data[1::2] + 1j*data[2::2]).reshape(n, n, nPoints)
+        if n == 2:
+            # 2-port data follow the Touchstone order S11, S21, S12, S22
+            s = s.transpose(1, 0, 2)
+        return data[0], np.moveaxis(s, 2, 0)
+
+    def setFormats(self, settings):
+        '''
+        Changes data format (or trigger) settings for a transfer and returns their previous values.
+        
+        The settings are written directly, not through the state cache, and their
+        cache entries are invalidated. Pass the result to restoreFormats() afterwards.
+        
+        Parameters:
+        -----------
+        settings : dict
+            Values by SCPI header, e.g. {'FORMat:DATA' : 'REAL,64'}.
+        
+        Returns:
+        ----------
+        previous : dict
+            The values held by the PNA before, by header.
+        '''
+        headers = list(settings)
+        responses = self.visaobj.queryMany([h + '?' for h in headers])
+        previous = {h : r.strip() for h, r in zip(headers, responses)}
+        self.visaobj.write(';:'.join('{} {}'.format(h, v) for h, v in settings.items()))
+        self.invalidateCache(*headers)
+        return previous
+    
+    def restoreFormats(self, previous):
+        '''
+        Writes back the settings returned by setFormats().
+        
+        Parameters:
+        -----------
+        previous : dict
+            Values by SCPI header.
+        
+        Returns:
+        ----------
+        N/A
+        '''
+        if previous:
+            self.visaobj.write(';:'.join('{} {}'.format(h, v) for h, v in previous.items()))
+            self.invalidateCache(*previous)
+    
+    def limits(self, refresh = False):
+        '''
+        Returns the setting limits of the PNA from the capability cache (see Instrument.capability()).
+        
+        Parameters:
+        -----------
+        refresh : bool
+            Query the limits from the PNA again.
+        
+        Returns:
+        ----------
+        limits : dict
+            'power' : [min, max] source power in dBm for ports 1 to 4
+            'ifBandwidth' : [min, max] IF bandwidth in Hz
+            'points' : maximum number of points
+            'frequency' : [min, max] frequency in Hz
+        '''
+        def query():
+            # port power limits of channel 1; read in one pipelined round trip where the transport allows it
+            q = ['SOURce1:POWer{}? {}'.format(i,m) for i in [1,2,3,4] for m in ['MIN','MAX']]
+            q += ['SENSe1:BANDwidth? MIN', 'SENSe1:BANDwidth? MAX', 'SENSe1:SWEep:POINts? MAX',
+                  'SENSe1:FREQuency:STARt? MIN', 'SENSe1:FREQuency:STOP? MAX']
+            r = [float(x) for x in self.visaobj.queryMany(q)]
+            return {'power' : [r[2*i:2*i+2] for i in range(4)], 'ifBandwidth' : r[8:10],
+                    'points' : int(r[10]), 'frequency' : r[11:13]}
+        return self.capability('limits', query, refresh)
+
+    def sMeas(self, sPorts, savedir, localsavedir, testname, power = None, pnaparms = None, bal = False, phase = 0,
+              callback = None, fetch = False):
         '''
         Perform and save an s-parameter measurement.
         
+        The measurement setup is prepared once (see prepareMeasurement()) and only
+        sent to the PNA again when the ports, power, pnaparms, bal or phase change.
+        
         Parameters:
         -----------
         sPorts : string
@@ -205,10 +502,16 @@ class AgilentPNAx:
             Toggles Balanced-Balanced measurements with integrated true mode stimulus on/off.
         phase : float
             Phase offset in degrees to be applied to balanced port 1.
+        callback : callable
+            Called repeatedly while the sweep runs (see Operation.wait()).
+        fetch : bool
+            Transfer the data to the PC with fetchSnp() instead of saving an snp file on the PNA.
+            The data are saved with saveSnp() in localsavedir unless localsavedir is None.
             
         Returns:
         ----------
-        N/A
+        data : tuple or None
+            (freq, s) as returned by fetchSnp() if fetch is set, otherwise None.
         
         Raises
         ------
@@ -216,80 +519,120 @@ class AgilentPNAx:
             Number of ports doesn't match physically available port numbers.
         '''
         
-        sParmsBBal = np.array([['SDD11','SDD12','SDC11','SDC12'],
-                               ['SDD21','SDD22','SDC21','SDC22'],
-                               ['SCD11','SCD12','SCC11','SCC12'],
-                               ['SCD21','SCD22','SCC21','SCC22']])
+        nums = sPorts.split(',')
+        filename = '{}.s{}p'.format(testname,str(len(nums)))
+        measurement = self.prepareMeasurement(sPorts, power, pnaparms, bal, phase)
+        if fetch:
+            freq, s = measurement.triggerAndFetch(callback)
+            self.outputOff()
+            if localsavedir is not None:
+                filename = '{}\\{}.npz'.format(localsavedir,testname)
+                print('Saving snp data on local PC in {}'.format(filename))
+                saveSnp(filename, freq, s, sPorts)
+            return freq, s
+        measurement.triggerAndSave(savedir, filename, callback)
+        self.outputOff()
+
+    def stream(self, sPorts, nSweeps = None, power = None, pnaparms = None, bal = False, phase = 0):
+        '''
+        Sweeps continuously and returns a SweepStream that reads the results from the PNA's data FIFO.
         
-        pna = self.visaobj
+        Parameters:
+        -----------
+        sPorts : string
+            Comma seperated list of ports to be used in S-parameter measurement.
+        nSweeps : int
+            Number of sweeps to stream. Streams until stopped if None.
+        power, pnaparms, bal, phase
+            See sMeas().
         
-        sParms = []
-        nums = sPorts.split(',')
+        Returns:
+        ----------
+        stream : SweepStream
+            Iterate over it to get (time, s) for each sweep.
+        '''
+        return SweepStream(self, self.prepareMeasurement(sPorts, power, pnaparms, bal, phase), nSweeps)
+
+    def groupMeas(self, channels, savedir, localsavedir, testname, callback = None, fetch = False):
+        '''
+        Perform and save s-parameter measurements on several channels with one trigger.
         
-        if len(nums) < 1 or len(nums) > 4:
-            raise ValueError('Please Specify a number of ports between 1 and 4. '
-                             'Currently, {} ports are specified.'.format(str(len(nums))))
-        if bal and len(nums) != 4:
-            raise ValueError('Bal-Bal measurement selected but number of ports does not equal 4.')
+        Each channel can have its own ports, power and pnaparms, e.g. a coarse
+        wideband channel and a dense narrowband channel. The channels are set
+        up in one pass (see PnaChannelGroup) and swept one after the other.
+        
+        Parameters:
+        -----------
+        channels : list
+            One dict per channel with the keys 'sPorts' and optionally 'power',
+            'pnaparms', 'bal', 'phase' (see sMeas()) and 'channel'. Channels are
+            numbered from 1 in list order unless 'channel' is given.
+        savedir, localsavedir, testname, callback, fetch
+            See sMeas(). Files are named '<testname>_ch<channel>'.
             
-        filename = '{}.s{}p'.format(testname,str(len(nums)))
-        if pnaparms:
-            self.pnaSetup(nums, **pnaparms)
-        else:
-            self.pnaSetup(nums)
-        self.checkCal()
-        
-        for i in nums:
-            for j in nums:
-                s = 'S{}_{}'.format(i,j)
-                sParms.append('S{}_{}'.format(i,j))
-                measName = 'meas'+s 
-                pna.write("CALCulate:PARameter:DEFine:EXTended \'{}\',{}".format(measName,s))
-                if bal:
-                    pna.write("CALCulate:PARameter:SELect \'{}\'".format(measName))
-                    pna.write("CALCulate:FSIMulator:BALun:PARameter:STATe ON")
-                    pna.write("CALCulate:FSIMulator:BALun:PARameter:BBALanced:DEFine {}".format(sParmsBBal[int(i)-1,int(j)-1]))
-                pna.write("DISPlay:WINDow{}:TRACe{}:FEED \'{}\'".format(i,j,measName))
-        
-        
-        if bal: 
-            pna.write("CALCulate1:FSIMulator:BALun:STIMulus:MODE TM")
-            pna.write("CALCulate:FSIMulator:BALun:DEVice BBALanced")
-            pna.write("CALCulate:FSIMulator:BALun:TOPology:BBALanced:PPORts 1,3,2,4")
-  #          pna.write("CALCulate:FSIMulator:BALun:FIXTure:OFFSet:PHASe 0")
-  #          pna.write("CALCulate:FSIMulator:BALun:BPORt1:OFFSet:PHASe {}".format(phase))
-        else:
-            pna.write("CALCulate1:FSIMulator:BALun:STIMulus:MODE SE")
-
-        if power != None:
-            if bal:
-                portnames = ['Bal Port 1','Bal Port 2']
-            else:
-                portnames = ['Port 1', 'Port 2', 'Port 3', 'Port 4']
-            for p in portnames:
-#                maxPower = pna.query('SOURce1:POWer? MAX,\"{}\"'.format(p))
-#                minPower = pna.query('SOURce1:POWer? MIN,\"{}\"'.format(p))
-#                if power >= minPower and power <= maxPower:
-                    print('Setting {} power to {} dbm.'.format(p,power))
-                    pna.write('SOURce1:POWer {},\"{}\"'.format(power,p))
-#                else:
-#                    warnings.warn('Specified source power of {} for {} not\
-#                                    within the allowed range of {} to {} dBm.'
-#                                    .format(power,p,minPower,maxPower)) 
-#                            
-        pna.timeout = 9000000
-        pna.write("SENSe1:SWEep:MODE SINGle") 
-        pna.query('*OPC?')
-#            pna.write("DISPlay:WINDow1:TRACe1:DELete")    
-        print('Saving snp data on PNA in {}\\{}'.format(savedir,filename)) # query unterminated, also need to insert quotes around directory name
-        pna.write(':CALCulate1:DATA:SNP:PORTs:SAVE \'{}\',\'{}\\{}\''.format(sPorts,savedir,filename)) #read 16 S parms in SNP format
-        pna.query('*OPC?') 
-        pna.timeout = 2000
+        Returns:
+        ----------
+        data : dict or None
+            {channel : (freq, s)} if fetch is set, otherwise None.
+        '''
+        group = self.prepareGroup(channels)
+        if fetch:
+            data = group.triggerAndFetch(callback)
+            self.outputOff()
+            if localsavedir is not None:
+                for c, (freq, s) in data.items():
+                    filename = '{}\\{}_ch{}.npz'.format(localsavedir,testname,c)
+                    print('Saving snp data on local PC in {}'.format(filename))
+                    saveSnp(filename, freq, s, group.members[c].sPorts)
+            return data
+        group.triggerAndSave(savedir, testname, callback)
         self.outputOff()
 
+    def prepareMeasurement(self, sPorts, power = None, pnaparms = None, bal = False, phase = 0, channel = 1):
+        '''
+        Returns a PnaMeasurement for the given settings, reusing the current one if nothing changed.
+        
+        Parameters:
+        -----------
+        sPorts, power, pnaparms, bal, phase
+            See sMeas().
+        channel : int
+            The PNA channel used for the measurement.
+        
+        Returns:
+        ----------
+        measurement : PnaMeasurement
+            The prepared measurement. It is set up on the PNA when first triggered.
+        '''
+        measurement = self.templates.get(channel)
+        if measurement is None or not measurement.matches(sPorts, power, pnaparms, bal, phase):
+            measurement = PnaMeasurement(self, sPorts, power, pnaparms, bal, phase, channel)
+            self.templates[channel] = measurement
+        return measurement
+
+    def prepareGroup(self, channels):
+        '''
+        Returns a PnaChannelGroup for several channels (see groupMeas()).
+        
+        Parameters:
+        -----------
+        channels : list
+            One dict of settings per channel, see groupMeas().
+        
+        Returns:
+        ----------
+        group : PnaChannelGroup
+            The prepared group. It is set up on the PNA when first triggered.
+        '''
+        measurements = []
+        for n, c in enumerate(channels):
+            c = dict(c)
+            measurements.append(self.prepareMeasurement(c.pop('sPorts'), channel = c.pop('channel', n + 1), **c))
+        return PnaChannelGroup(self, measurements)
+
     def outputOff(self):
         '''
-        Turns PNA output off by putting trigger in hold.
+        Turns PNA output off by putting trigger in hold on all channels in use.
         
         Parameters:
         -----------
@@ -299,7 +642,8 @@ class AgilentPNAx:
         ----------
         N/A
         '''
-        self.visaobj.write('SENSe1:SWEep:MODE HOLD') 
+        channels = sorted(set([1]) | set(c for c, m in self.templates.items() if m.isSetUp()))
+        self.visaobj.write(';:'.join('SENSe{}:SWEep:MODE HOLD'.format(c) for c in channels))
 
 
     ###############################
@@ -307,13 +651,14 @@ class AgilentPNAx:
     # CalSet_###
     ##########################
     
-    def checkCal(self):
+    def checkCal(self, channel = 1):
         '''
         Fetches active calibration set and prints the name, throwing an error if none is selected.
         
         Parameters:
         -----------
-        N/A
+        channel : int
+            The PNA channel to check.
         
         Returns:
         ----------
@@ -324,40 +669,48 @@ class AgilentPNAx:
         ValueError
             No active calset.
         '''
-        calname = self.visaobj.query('SENSe1:CORRection:CSET:ACTivate? NAME')
+        calname = self.visaobj.query('SENSe{}:CORRection:CSET:ACTivate? NAME'.format(channel))
         if calname == "No Calset Selected":
             raise ValueError('No active calset for the measurement. Aborting')
         else:
             print('Current calibration: {}'.format(calname))
             
-    def getCalInfo(self):
+    def getCalInfo(self, refresh = False):
         '''
         Prints active calibration set as well as all cal sets present on PNA.
         
+        The calset catalog is kept in the capability cache; pass refresh = True
+        after adding or deleting calsets.
+        
         Parameters:
         -----------
-        N/A
+        refresh : bool
+            Read the catalog from the PNA again.
         
         Returns:
         ----------
         N/A
         '''
         print(self.visaobj.query('SENSe1:CORRection:CSET:ACTivate? NAME'))
-        print(self.visaobj.query('SENSe1:CORRection:CSET:TYPE:CATalog? NAME'))
+        print(self.capability('calsetTypes', 'SENSe1:CORRection:CSET:TYPE:CATalog? NAME', refresh))
         
-    def getAvailCals(self):
+    def getAvailCals(self, refresh = False):
         '''
         Prints all available cal sets present on PNA.
         
+        The calset catalog is kept in the capability cache; pass refresh = True
+        after adding or deleting calsets.
+        
         Parameters:
         -----------
-        N/A
+        refresh : bool
+            Read the catalog from the PNA again.
         
         Returns:
         ----------
         N/A
         '''
-        print(self.visaobj.query('CSET:CATalog?'))
+        print(self.capability('calsets', 'CSET:CATalog?', refresh))
         
     def saveState(self, filename):
         '''
@@ -399,4 +752,608 @@ class AgilentPNAx:
         -----------
         N/A
         '''
-        self.visaobj.write('MMEMory:STORe:CSARchive {}'.format(filename))
\ No newline at end of file
+        self.visaobj.write('MMEMory:STORe:CSARchive {}'.format(filename))
+
+
+class PnaMeasurement:
+    '''
+    A prepared S-parameter measurement: channel settings, traces and balanced
+    configuration are set up on the PNA once and then triggered many times.
+    
+    setup() runs when the measurement is first triggered, and again only if
+    the PNA settings were invalidated since (see Instrument.invalidateCache()),
+    e.g. by a different measurement being set up in between.
+    AgilentPNAx.prepareMeasurement() returns a new object when the ports,
+    balanced mode, power or pnaparms change.
+    
+    Parameters:
+    -----------
+    pna : AgilentPNAx
+        The connected PNA.
+    sPorts : string
+        Comma seperated list of ports to be used in S-parameter measurement.
+    power : float
+        Source power in dBm for all (balanced) ports. Left unchanged if None.
+    pnaparms : dict
+        A dictionary containing test parameters to set on the pna (see AgilentPNAx.pnaSetup()).
+    bal : bool
+        Toggles Balanced-Balanced measurements with integrated true mode stimulus on/off.
+    phase : float
+        Phase offset in degrees to be applied to balanced port 1.
+    channel : int
+        The PNA channel used for the measurement.
+    
+    Raises
+    ------
+    ValueError
+        Number of ports doesn't match physically available port numbers.
+    '''
+    
+    def __init__(self, pna, sPorts, power = None, pnaparms = None, bal = False, phase = 0, channel = 1):
+        nums = sPorts.split(',')
+        if len(nums) < 1 or len(nums) > 4:
+            raise ValueError('Please Specify a number of ports between 1 and 4. '
+                             'Currently, {} ports are specified.'.format(str(len(nums))))
+        if bal and len(nums) != 4:
+            raise ValueError('Bal-Bal measurement selected but number of ports does not equal 4.')
+        self.pna = pna
+        self.sPorts = sPorts
+        self.nums = nums
+        self.power = power
+        self.pnaparms = dict(pnaparms) if pnaparms else None
+        self.bal = bal
+        self.phase = phase
+        self.channel = channel
+        self.key = self.settingsKey(sPorts, power, pnaparms, bal, phase)
+    
+    @staticmethod
+    def settingsKey(sPorts, power, pnaparms, bal, phase):
+        '''
+        Returns a string identifying a set of measurement settings.
+        '''
+        parms = sorted(pnaparms.items()) if pnaparms else None
+        return '{}|{}|{}|{}|{}'.format(sPorts, power, parms, bal, phase)
+    
+    def matches(self, sPorts, power = None, pnaparms = None, bal = False, phase = 0):
+        '''
+        Checks whether this measurement was prepared with the given settings.
+        
+        Parameters:
+        -----------
+        sPorts, power, pnaparms, bal, phase
+            See PnaMeasurement.
+        
+        Returns:
+        ----------
+        matches : bool
+            True if the settings are the same.
+        '''
+        return self.key == self.settingsKey(sPorts, power, pnaparms, bal, phase)
+    
+    def isSetUp(self):
+        '''
+        Checks whether the PNA still holds this measurement\'s setup.
+        '''
+        return self.pna.isCached('template{}'.format(self.channel), self.key)
+    
+    def setup(self, clear = True):
+        '''
+        Sets up the channel, defines the measurements and their traces, and sets
+        the balanced configuration and port powers.
+        
+        Parameters:
+        -----------
+        clear : bool
+            Delete all measurements on the PNA first if the port layout changed.
+            PnaChannelGroup deletes once for all its channels instead.
+        
+        Returns:
+        ----------
+        N/A
+        '''
+        sParmsBBal = np.array([['SDD11','SDD12','SDC11','SDC12'],
+                               ['SDD21','SDD22','SDC21','SDC22'],
+                               ['SCD11','SCD12','SCC11','SCC12'],
+                               ['SCD21','SCD22','SCC21','SCC22']])
+        
+        pna = self.pna
+        nums, bal, power, ch = self.nums, self.bal, self.power, self.channel
+        calc = 'CALCulate{}'.format(ch)
+        # measurements are only deleted and redefined when the port layout changes
+        layout = '{} bal={}'.format(','.join(nums),bal)
+        layoutKey = 'measurements{}'.format(ch)
+        clear = clear and not pna.isCached(layoutKey, layout)
+        with ScpiBatch(pna) as b:
+            if self.pnaparms:
+                pna.pnaSetup(nums, channel = ch, clear = clear, **self.pnaparms)
+            else:
+                pna.pnaSetup(nums, channel = ch, clear = clear)
+            pna.checkCal(ch)
+        
+            for i in nums:
+                for j in nums:
+                    s = 'S{}_{}'.format(i,j)
+                    if pna.isCached(layoutKey, layout):
+                        continue
+                    # names and trace numbers must be unique across channels
+                    measName = 'meas'+s if ch == 1 else 'ch{}_meas{}'.format(ch,s)
+                    b.write("{}:PARameter:DEFine:EXTended \'{}\',{}".format(calc,measName,s))
+                    if bal:
+                        b.write("{}:PARameter:SELect \'{}\'".format(calc,measName))
+                        b.write("{}:FSIMulator:BALun:PARameter:STATe ON".format(calc))
+                        b.write("{}:FSIMulator:BALun:PARameter:BBALanced:DEFine {}".format(calc,sParmsBBal[int(i)-1,int(j)-1]))
+                    b.write("DISPlay:WINDow{}:TRACe{}:FEED \'{}\'".format(i,4*(ch-1)+int(j),measName))
+            pna.stateCache[layoutKey] = layout
+        
+            if bal: 
+                pna.cachedWrite(calc + ":FSIMulator:BALun:STIMulus:MODE", 'TM')
+                pna.cachedWrite(calc + ":FSIMulator:BALun:DEVice", 'BBALanced')
+                pna.cachedWrite(calc + ":FSIMulator:BALun:TOPology:BBALanced:PPORts", '1,3,2,4')
+      #          b.write("CALCulate:FSIMulator:BALun:FIXTure:OFFSet:PHASe 0")
+      #          b.write("CALCulate:FSIMulator:BALun:BPORt1:OFFSet:PHASe {}".format(phase))
+            else:
+                pna.cachedWrite(calc + ":FSIMulator:BALun:STIMulus:MODE", 'SE')
+
+            if power != None:
+                if bal:
+                    portnames = ['Bal Port 1','Bal Port 2']
+                else:
+                    portnames = ['Port 1', 'Port 2', 'Port 3', 'Port 4']
+                for p in portnames:
+#                maxPower = pna.query('SOURce1:POWer? MAX,\"{}\"'.format(p))
+#                minPower = pna.query('SOURce1:POWer? MIN,\"{}\"'.format(p))
+#                if power >= minPower and power <= maxPower:
+                        if pna.cachedWrite('SOURce{}:POWer'.format(ch), '{},\"{}\"'.format(power,p), key = 'SOURce{}:POWer {}'.format(ch,p)):
+                            print('Setting {} power to {} dbm.'.format(p,power))
+                            pna.invalidateCache(*['SOURce{}:POWer{}'.format(ch,i) for i in [1,2,3,4]])
+#                else:
+#                    warnings.warn('Specified source power of {} for {} not\
+#                                    within the allowed range of {} to {} dBm.'
+#                                    .format(power,p,minPower,maxPower)) 
+#
+            # a newly created channel sweeps continuously until put in hold
+            pna.cachedWrite('SENSe{}:SWEep:MODE'.format(ch), 'HOLD')
+        pna.stateCache['template{}'.format(ch)] = self.key
+
+    def trigger(self, callback = None):
+        '''
+        Sets up the measurement if needed and runs one sweep.
+        
+        Parameters:
+        -----------
+        callback : callable
+            Called repeatedly while the sweep runs (see Operation.wait()).
+        
+        Returns:
+        ----------
+        N/A
+        '''
+        if not self.isSetUp():
+            self.setup()
+        self.pna.startSweep(channels = (self.channel,)).wait(callback)
+    
+    def triggerAndFetch(self, callback = None):
+        '''
+        Runs one sweep and transfers the data to the PC (see AgilentPNAx.fetchSnp()).
+        
+        Parameters:
+        -----------
+        callback : callable
+            Called repeatedly while the sweep runs.
+        
+        Returns:
+        ----------
+        freq : np.ndarray
+            Frequencies in Hz.
+        s : np.ndarray
+            Complex S-parameters, shape (nPoints, nPorts, nPorts).
+        '''
+        self.trigger(callback)
+        return self.pna.fetchSnp(self.sPorts, self.channel)
+    
+    def triggerAndSave(self, savedir, filename, callback = None):
+        '''
+        Runs one sweep and saves the data as an snp file on the PNA.
+        
+        Parameters:
+        -----------
+        savedir : string
+            The directory on the PNA in which to save the snp file.
+        filename : string
+            Name of the snp file.
+        callback : callable
+            Called repeatedly while the sweep runs.
+        
+        Returns:
+        ----------
+        N/A
+        '''
+        self.trigger(callback)
+        self.save(savedir, filename)
+    
+    def save(self, savedir, filename):
+        '''
+        Saves the data of the last sweep as an snp file on the PNA.
+        
+        Parameters:
+        -----------
+        savedir : string
+            The directory on the PNA in which to save the snp file.
+        filename : string
+            Name of the snp file.
+        
+        Returns:
+        ----------
+        N/A
+        '''
+        pna = self.pna
+        print('Saving snp data on PNA in {}\\{}'.format(savedir,filename)) # query unterminated, also need to insert quotes around directory name
+        pna.waitForOpc(':CALCulate{}:DATA:SNP:PORTs:SAVE \'{}\',\'{}\\{}\''.format(self.channel,self.sPorts,savedir,filename), pna.saveTimeout) #read 16 S parms in SNP format
+
+
+class PnaChannelGroup:
+    '''
+    Several PnaMeasurement objects on different channels, set up in one pass
+    and swept with a single trigger.
+
+    All measurements on the PNA are deleted once when any channel's port
+    layout changes, then every channel defines its own measurements; channel
+    settings that did not change are not sent again. On a trigger the PNA
+    sweeps the channels one after the other and signals completion once.
+
+    Parameters:
+    -----------
+    pna : AgilentPNAx
+        The connected PNA.
+    measurements : list
+        PnaMeasurement objects, each on a different channel.
+
+    Raises
+    ------
+    ValueError
+        Two measurements use the same channel.
+    '''
+
+    def __init__(self, pna, measurements):
+        channels = [m.channel for m in measurements]
+        if len(set(channels)) != len(channels):
+            raise ValueError('Each measurement of a channel group needs its own channel. '
+                             'Channels specified: {}.'.format(channels))
+        self.pna = pna
+        self.members = {m.channel : m for m in measurements}
+        self.channels = tuple(channels)
+
+    def isSetUp(self):
+        '''
+        Checks whether the PNA still holds the setup of all channels.
+        '''
+        return all(m.isSetUp() for m in self.members.values())
+
+    def setup(self):
+        '''
+        Sets up all channels of the group.
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        N/A
+        '''
+        pna = self.pna
+        layouts = ['{} bal={}'.format(','.join(m.nums),m.bal) for m in self.members.values()]
+        if not all(pna.isCached('measurements{}'.format(c), l) for c, l in zip(self.members, layouts)):
+            # one delete for the whole group, then windows for all ports in use
+            pna.visaobj.write('CALCulate:PARameter:DELete:ALL')
+            pna.forgetMeasurements()
+            for n in sorted(set(n for m in self.members.values() for n in m.nums)):
+                pna.visaobj.write('DISPlay:WINDow{}:STATE ON'.format(n))
+        for m in self.members.values():
+            if not m.isSetUp():
+                m.setup(clear = False)
+
+    def trigger(self, callback = None):
+        '''
+        Sets up the group if needed and sweeps all its channels once.
+
+        Parameters:
+        -----------
+        callback : callable
+            Called repeatedly while the sweeps run (see Operation.wait()).
+
+        Returns:
+        ----------
+        N/A
+        '''
+        if not self.isSetUp():
+            self.setup()
+        self.pna.startSweep(channels = self.channels).wait(callback)
+
+    def triggerAndFetch(self, callback = None):
+        '''
+        Sweeps all channels and transfers their data to the PC (see AgilentPNAx.fetchSnp()).
+
+        Parameters:
+        -----------
+        callback : callable
+            Called repeatedly while the sweeps run.
+
+        Returns:
+        ----------
+        data : dict
+            {channel : (freq, s)} for each channel of the group.
+        '''
+        self.trigger(callback)
+        return {c : self.pna.fetchSnp(m.sPorts, c) for c, m in self.members.items()}
+
+    def triggerAndSave(self, savedir, testname, callback = None):
+        '''
+        Sweeps all channels and saves one snp file per channel on the PNA.
+
+        Parameters:
+        -----------
+        savedir : string
+            The directory on the PNA in which to save the snp files.
+        testname : string
+            Identifier for the test; files are named '<testname>_ch<channel>.s<n>p'.
+        callback : callable
+            Called repeatedly while the sweeps run.
+
+        Returns:
+        ----------
+        N/A
+        '''
+        self.trigger(callback)
+        for c, m in self.members.items():
+            m.save(savedir, '{}_ch{}.s{}p'.format(testname,c,len(m.nums)))
+
+
+class SweepStream:
+    '''
+    Streams sweep results from the PNA data FIFO while the PNA sweeps continuously.
+    
+    The PNA places the unformatted (real, imaginary) data of every sweep in
+    its FIFO; the stream reads all complete sweeps in one binary REAL,64
+    block whenever new ones are available. There is no per-sweep trigger,
+    completion wait or file save, so the sweep rate is limited by the PNA.
+    
+    The FIFO collects the data of every measurement on the PNA, so the
+    stream's measurement must be the only one defined: start() refuses to
+    start otherwise. The trigger source and data format are restored when
+    the stream stops.
+    
+        stream = pna.stream('1,2', nSweeps = 100)
+        for t, s in stream:
+            ...
+    
+    or, filling a ring buffer that can be read from another thread:
+    
+        buffer = stream.ringBuffer(1000)
+        stream.fill(buffer)
+    
+    Parameters:
+    -----------
+    pna : AgilentPNAx
+        The connected PNA.
+    measurement : PnaMeasurement
+        The prepared measurement to stream.
+    nSweeps : int
+        Number of sweeps to stream. Streams until stop() is called if None.
+    
+    Raises
+    ------
+    ValueError
+        Measurements of other channels are defined on the PNA (raised by start()).
+    '''
+    
+    def __init__(self, pna, measurement, nSweeps = None):
+        self.pna = pna
+        self.measurement = measurement
+        self.nSweeps = nSweeps
+        self.n = len(measurement.nums)
+        self.nRead = 0
+        self.running = False
+        self.iterating = False
+        self.stopRequested = False
+        self.freq = None
+        self.nPoints = None
+        self.previousSettings = None # PNA data format and trigger source before start(), restored by halt()
+    
+    def start(self):
+        '''
+        Sets up the measurement, enables the FIFO and starts continuous sweeping.
+        
+        Parameters:
+        -----------
+        N/A
+        
+        Returns:
+        ----------
+        N/A
+        '''
+        pna = self.pna
+        ch = self.measurement.channel
+        if not self.measurement.isSetUp():
+            self.measurement.setup()
+        # the FIFO holds the data of all measurements, interleaved
+        catalog = lambda q : [m for m in pna.visaobj.query(q).strip().strip('"').split(',') if m.strip()]
+        others = set(catalog('SYSTem:MEASurement:CATalog?')) - set(catalog('SYSTem:MEASurement:CATalog? {}'.format(ch)))
+        if others:
+            raise ValueError('The data FIFO would interleave {} measurement(s) of other channels with channel {}. '
+                             'Delete them before streaming.'.format(len(others), ch))
+        self.previousSettings = pna.setFormats({'FORMat:DATA' : 'REAL,64', 'FORMat:BORDer' : 'SWAPped',
+                                                'TRIGger:SOURce' : 'IMMediate'})
+        sense = 'SENSe{}'.format(ch)
+        self.nPoints = int(pna.visaobj.query(sense + ':SWEep:POINts?'))
+        self.freq = pna.visaobj.query_binary_values(sense + ':X?', datatype = 'd', container = np.array)
+        pna.cachedWrite('SYSTem:FIFO:STATe', 'ON')
+        pna.visaobj.write('SYSTem:FIFO:DATA:CLEar')
+        pna.visaobj.write(sense + ':SWEep:MODE CONTinuous')
+        pna.invalidateCache(sense + ':SWEep:MODE')
+        self.nRead = 0
+        self.running = True
+        self.stopRequested = False
+    
+    def stop(self):
+        '''
+        Stops the stream. May be called from another thread while the stream is
+        being iterated; the iterating thread then ends the sweeps.
+        
+        Parameters:
+        -----------
+        N/A
+        
+        Returns:
+        ----------
+        N/A
+        '''
+        self.stopRequested = True
+        if not self.iterating:
+            self.halt()
+    
+    def halt(self):
+        '''
+        Stops sweeping (trigger hold), disables the FIFO and restores the data format and trigger source.
+        '''
+        if self.running:
+            self.running = False
+            self.pna.outputOff()
+            self.pna.cachedWrite('SYSTem:FIFO:STATe', 'OFF')
+            self.pna.restoreFormats(self.previousSettings)
+            self.previousSettings = None
+    
+    def read(self):
+        '''
+        Reads all complete sweeps currently in the FIFO.
+        
+        Parameters:
+        -----------
+        N/A
+        
+        Returns:
+        ----------
+        t : float
+            Time (time.time()) at which the data were read.
+        s : np.ndarray
+            Complex S-parameters, shape (nSweeps, nPoints, nPorts, nPorts). May be empty.
+        '''
+        n, nPoints = self.n, self.nPoints
+        perSweep = 2*n*n*nPoints
+        available = int(self.pna.visaobj.query('SYSTem:FIFO:DATA:COUNt?')) // perSweep
+        if self.nSweeps is not None:
+            available = min(available, self.nSweeps - self.nRead)
+        if available <= 0:
+            return time.time(), np.zeros((0, nPoints, n, n), dtype = complex)
+        values = self.pna.visaobj.query_binary_values('SYSTem:FIFO:DATA? {}'.format(available*perSweep),
+                                                      datatype = 'd', container = np.array)
+        t = time.time()
+        # measurements are defined row by row (S11, S12, ...), points as (re, im) pairs
+        data = np.asarray(values[:available*perSweep]).reshape(available, n, n, nPoints, 2)
+        self.nRead += available
+        return t, np.moveaxis(data[...,0] + 1j*data[...,1], 3, 1)
+    
+    def __iter__(self):
+        '''
+        Yields (t, s) for each sweep, s having the shape (nPoints, nPorts, nPorts).
+        
+        Raises visa.VisaIOError if no sweep arrives within the PNA\'s expectedTimeout().
+        '''
+        if not self.running:
+            self.start()
+        timeout = self.pna.expectedTimeout((self.measurement.channel,))
+        self.iterating = True
+        try:
+            interval = 0.001
+            last = time.perf_counter()
+            while not self.stopRequested and (self.nSweeps is None or self.nRead < self.nSweeps):
+                t, s = self.read()
+                if len(s):
+                    interval = 0.001
+                    last = time.perf_counter()
+                    for sweep in s:
+                        yield t, sweep
+                    continue
+                if time.perf_counter() - last > timeout:
+                    print('PNA: no sweep received within {:.1f} s.'.format(timeout))
+                    raise visa.VisaIOError(constants.StatusCode.error_timeout)
+                time.sleep(interval)
+                interval = min(interval*1.5, 0.1)
+        finally:
+            self.iterating = False
+            self.halt()
+    
+    def ringBuffer(self, capacity):
+        '''
+        Creates a RingBuffer sized for the sweeps of this stream.
+        
+        Parameters:
+        -----------
+        capacity : int
+            Number of sweeps kept.
+        
+        Returns:
+        ----------
+        buffer : RingBuffer
+            Buffer with one (nPoints, nPorts, nPorts) complex item per sweep.
+        '''
+        if self.nPoints is None:
+            self.start()
+        return RingBuffer(capacity, (self.nPoints, self.n, self.n), complex)
+    
+    def fill(self, buffer):
+        '''
+        Streams into a RingBuffer until nSweeps are read or stop() is called (e.g. from another thread).
+        
+        Parameters:
+        -----------
+        buffer : RingBuffer
+            Buffer created with ringBuffer().
+        
+        Returns:
+        ----------
+        N/A
+        '''
+        for t, s in self:
+            buffer.append(s, t)
+
+
+def saveSnp(filename, freq, s, sPorts = None):
+    '''
+    Saves N-port data in a compressed NumPy (.npz) file.
+    
+    Parameters:
+    -----------
+    filename : str
+        The output file (including path).
+    freq : np.ndarray
+        Frequencies in Hz.
+    s : np.ndarray
+        Complex S-parameters, shape (nPoints, nPorts, nPorts).
+    sPorts : string
+        Comma seperated list of the measured ports, stored with the data.
+    
+    Returns:
+    ----------
+    N/A
+    '''
+    np.savez_compressed(filename, freq = freq, s = s, ports = sPorts or '')
+
+def loadSnp(filename):
+    '''
+    Loads N-port data saved by saveSnp().
+    
+    Parameters:
+    -----------
+    filename : str
+        The .npz file (including path).
+    
+    Returns:
+    ----------
+    freq : np.ndarray
+        Frequencies in Hz.
+    s : np.ndarray
+        Complex S-parameters, shape (nPoints, nPorts, nPorts).
+    '''
+    with np.load(filename) as data:
+        return data['freq'], data['s']
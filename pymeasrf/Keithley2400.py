@@ -5,10 +5,14 @@ ander906@purdue.edu
 HybridMEMS
 '''
 
-import visa
+import pymeasrf.visaPool as visaPool
+from pymeasrf.instrument import Instrument
+from pymeasrf.scpiBatch import ScpiBatch
 import numpy as np
 
-class Keithley2400:
+class Keithley2400(Instrument):
+    errorQuery = 'SYSTem:ERRor:NEXT?'
+
     def __init__(self, resource, label = None, voltages = None):
         '''
         Creates a new Keithley 2400 SMU instance and attempts connection. 
@@ -27,8 +31,14 @@ class Keithley2400:
         ----------
         N/A
         '''
-        self.connect(resource, label, voltages) 
+        self.voltages = np.asarray(voltages)
+        Instrument.__init__(self, resource, label)
         self.voltageLimits = [20,40,60,80,120,160,210]
+        self.elements = ['VOLTage', 'CURRent', 'RESistance', 'TIME', 'STATus']
+        self.dataFormat = 'ASCii'
+        self.byteOrder = 'SWAPped'
+        self.fetchTimeout = 60 # s, limit for stopping a measurement and reading its buffer
+        self.maxListPoints = 2500 # size of the source list and reading buffer
     
     def connect(self, resource, label = None, voltages = None):
         '''
@@ -43,20 +53,14 @@ class Keithley2400:
         voltages : list or array-like
             A list of voltages the user would like forced. 
             Used for stepping through voltage settings during measurements.
+            The current voltage list is kept if None.
         Returns:
         ----------
         N/A
         '''
-        rm = visa.ResourceManager()
-        self.label = label
-        self.voltages = np.asarray(voltages)
-        
-        # VisaIOError VI_ERROR_RSRC_NFOUND
-        try:
-          self.visaobj = rm.open_resource(resource)
-        except visa.VisaIOError as e:
-          print(e.args)
-          raise SystemExit(1)
+        if voltages is not None:
+            self.voltages = np.asarray(voltages)
+        Instrument.connect(self, resource, label)
 
     def smuSetup(self, maxVolt = 20, comp = 0.000105):
         '''
@@ -77,21 +81,33 @@ class Keithley2400:
         '''
        # smu.write(':DISPlay:ENABle 1; CNDisplay')
 
-        self.visaobj.write('SOURce:FUNCtion:MODE VOLTage')
-        self.visaobj.write('SOURce:VOLTage:RANGe:AUTO 1')
-        self.visaobj.write('SENSe:CURRent:DC:RANGe:AUTO 1')
-        self.visaobj.write('SOURce:VOLTage 0')        
-        if maxVolt >160:
-            print('Specified voltage larger than 160 V. Setting limit to 210 V.')
-            self.visaobj.write('SOURce:VOLTage:PROTection:LEVel NONE')
-        else:
-            for i in self.voltageLimits:
-                if maxVolt > i:
-                    next
-                else:
-                    self.visaobj.write('SOURce:VOLTage:PROTection:LEVel ' + str(i))
-                    break
-        self.visaobj.write(':SENSe:CURRent:PROTection:LEVel ' + str(comp))
+        # source range of this model (210 V on a 2400), from the capability cache
+        try:
+            maxRange = float(self.capability('voltageRangeMax', 'SOURce:VOLTage:RANGe? MAX'))
+        except ValueError:
+            maxRange = 0
+        if maxRange <= 0:
+            maxRange = self.voltageLimits[-1]
+        if maxVolt > maxRange:
+            print('Specified voltage larger than the {} V source range of the SMU.'.format(maxRange))
+        # protection levels below the source range; above them protection is off (NONE)
+        limits = [i for i in self.voltageLimits if i < maxRange]
+        with ScpiBatch(self) as smu:
+            smu.write('SOURce:FUNCtion:MODE VOLTage')
+            smu.write('SOURce:VOLTage:RANGe:AUTO 1')
+            smu.write('SENSe:CURRent:DC:RANGe:AUTO 1')
+            self.cachedWrite('SOURce:VOLTage', 0)
+            if not limits or maxVolt > limits[-1]:
+                print('Specified voltage larger than {} V. Setting limit to {} V.'.format(limits[-1] if limits else 0, maxRange))
+                self.cachedWrite('SOURce:VOLTage:PROTection:LEVel', 'NONE')
+            else:
+                for i in limits:
+                    if maxVolt > i:
+                        next
+                    else:
+                        self.cachedWrite('SOURce:VOLTage:PROTection:LEVel', i)
+                        break
+            self.cachedWrite(':SENSe:CURRent:PROTection:LEVel', comp)
 #        self.visaobj.write('SOURce:FUNCtion:MODE VOLTage')
 #        self.visaobj.write('SOURce:VOLTage:LEVel 0')
 
@@ -99,6 +115,8 @@ class Keithley2400:
         '''
         Configures the SMU for sensing current while acting as a voltage source at the given voltage.
         
+        Only the source level is sent if the SMU is already configured (see Instrument.cachedWrite()).
+        
         Parameters:
         -----------
         voltage : double
@@ -108,25 +126,123 @@ class Keithley2400:
         ----------
         N/A
         '''
-        self.visaobj.write('SOURce:VOLTage {}'.format(str(voltage)))
-        self.visaobj.write(':CONFigure:VOLTage:DC')
-        self.visaobj.query('*OPC?')
-        self.visaobj.write(':SENSe:FUNCtion:ON "CURRent"')
+        self.cachedWrite(':SOURce:VOLTage:MODE', 'FIXed') # after a listSweep()
+        self.cachedWrite('SOURce:VOLTage', voltage)
+        if self.cachedWrite(':CONFigure:VOLTage:DC'):
+            # CONFigure resets the sense functions
+            self.invalidateCache(':SENSe:FUNCtion:ON')
+            self.visaobj.query('*OPC?')
+        self.cachedWrite(':SENSe:FUNCtion:ON', '"CURRent"')
 
-    def readError(self):
+    def setElements(self, elements = None):
         '''
-        Prints the most recent error and clears it from the error register on the SMU. 
+        Selects which data elements are returned for each reading.
         
         Parameters:
         -----------
+        elements : list
+            Any of 'VOLTage', 'CURRent', 'RESistance', 'TIME', 'STATus', in that order.
+            Defaults to all five.
+        
+        Returns:
+        ----------
         N/A
+        '''
+        if elements:
+            self.elements = list(elements)
+        self.cachedWrite(':FORMat:ELEMents', ', '.join(self.elements))
+
+    def setDataFormat(self, dataFormat = 'ASCii', byteOrder = 'SWAPped'):
+        '''
+        Selects the format used to transfer readings from the SMU.
+        
+        Binary transfers are several times smaller than ASCII and are returned
+        by meas() and stopMeas() as a NumPy structured array instead of a string.
+        
+        Parameters:
+        -----------
+        dataFormat : str
+            'ASCii' : comma seperated text (default)
+            'SREal' or 'REAL' : IEEE-754 single precision binary block
+        byteOrder : str
+            Byte order of binary data. 'SWAPped' (little endian, native on PCs) or 'NORMal' (big endian).
         
         Returns:
         ----------
         N/A
+        
+        Raises
+        ------
+        ValueError
+            Unknown data format or byte order.
         '''
-        print(self.visaobj.query('SYSTem:ERRor:NEXT?'))
-    
+        if dataFormat.upper().startswith('ASC'):
+            dataFormat = 'ASCii'
+        elif dataFormat.upper().startswith('SRE'):
+            dataFormat = 'SREal'
+        elif dataFormat.upper().startswith('REAL'):
+            dataFormat = 'REAL,32'
+        else:
+            raise ValueError('Unknown data format \'{}\'. Use ASCii, SREal or REAL.'.format(dataFormat))
+        if byteOrder.upper().startswith('SWAP'):
+            byteOrder = 'SWAPped'
+        elif byteOrder.upper().startswith('NORM'):
+            byteOrder = 'NORMal'
+        else:
+            raise ValueError('Unknown byte order \'{}\'. Use SWAPped or NORMal.'.format(byteOrder))
+        self.dataFormat = dataFormat
+        self.byteOrder = byteOrder
+        self.cachedWrite(':FORMat:DATA', self.dataFormat)
+        if self.dataFormat != 'ASCii':
+            self.cachedWrite(':FORMat:BORDer', self.byteOrder)
+
+    def dataType(self):
+        '''
+        Returns the NumPy structured dtype of binary readings for the current elements.
+        
+        Parameters:
+        -----------
+        N/A
+        
+        Returns:
+        ----------
+        dtype : np.dtype
+            One float32 field per element, named V, I, R, t, and status.
+        '''
+        names = {'VOLT' : 'V', 'CURR' : 'I', 'RES' : 'R', 'TIME' : 't', 'STAT' : 'status'}
+        fields = []
+        for e in self.elements:
+            for k,v in names.items():
+                if e.upper().startswith(k):
+                    fields.append((v, np.float32))
+        return np.dtype(fields)
+
+    def readData(self, command):
+        '''
+        Sends a data query (READ? or FETCh?) and reads the result in the current data format.
+        
+        Parameters:
+        -----------
+        command : str
+            The query to send.
+        
+        Returns:
+        ----------
+        data : str or np.ndarray
+            ASCII format: comma seperated list of data from the SMU.
+            Binary formats: structured array with one record per reading (see dataType()).
+        '''
+        if self.dataFormat == 'ASCii':
+            return self.visaobj.query(command)
+        values = self.visaobj.query_binary_values(command, datatype = 'f',
+                                                  is_big_endian = self.byteOrder == 'NORMal',
+                                                  container = np.array)
+        dtype = self.dataType()
+        n = len(values) // len(dtype)
+        if n*len(dtype) != len(values):
+            print('Warning! SMU data doesn\'t have expected number of columns.')
+        return np.ascontiguousarray(values[:n*len(dtype)], dtype = np.float32).view(dtype)
+
     def resetTime(self):
         '''
         Sets the internal timer to zero.
@@ -156,17 +272,38 @@ class Keithley2400:
             1 to 2500
         Returns:
         ----------
-        data : str
-            Comma seperated list of data from the SMU. 
+        data : str or np.ndarray
+            Comma seperated list of data from the SMU, or a structured array
+            if a binary format was selected with setDataFormat().
             Returned data controlled by ':FORMat:ELEMents' command. 
             Default format is 'VOLTage, CURRent, RESistance, TIME, STATus'
             Unavailable data returned as 10^37 value.
         '''
-        self.visaobj.write(':ARM:COUNt 1')
-        self.visaobj.write(':TRIGger:COUNt {}'.format(n))
-        data = self.visaobj.query('READ?')
+        self.cachedWrite(':ARM:COUNt', 1)
+        self.cachedWrite(':TRIGger:COUNt', n)
+        data = self.readData('READ?')
         return data
-    
+
+    def readCurrent(self):
+        '''
+        Takes a single reading without trigger delay and returns its current.
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        current : float
+            The measured current in amps.
+        '''
+        self.cachedWrite(':TRIGger:DELay', 0)
+        data = self.meas(1)
+        if isinstance(data, np.ndarray):
+            return float(data['I'][0])
+        i = [e.upper().startswith('CURR') for e in self.elements].index(True)
+        return float(data.split(',')[i])
+
     def startMeas(self, n = 2500, tmeas = 1):
         '''
         Initiates an ongoing measurement on the SMU. 
@@ -185,9 +322,9 @@ class Keithley2400:
         ----------
         N/A
         '''
-        self.visaobj.write(':ARM:COUNt 1')
-        self.visaobj.write(':TRIGger:COUNt {}'.format(n))
-        self.visaobj.write(':TRIGger:DELay {}'.format(tmeas))
+        self.cachedWrite(':ARM:COUNt', 1)
+        self.cachedWrite(':TRIGger:COUNt', n)
+        self.cachedWrite(':TRIGger:DELay', tmeas)
         self.visaobj.write(':INITiate')
 
     def stopMeas(self):
@@ -200,14 +337,82 @@ class Keithley2400:
         
         Returns:
         ----------
-        data : str
-            Comma seperated list of data from the SMU. 
+        data : str or np.ndarray
+            Comma seperated list of data from the SMU, or a structured array
+            if a binary format was selected with setDataFormat().
             Returned data controlled by ':FORMat:ELEMents' command. 
             Default format is 'VOLTage, CURRent, RESistance, TIME, STATus'
             Unavailable data returned as 10^37 value.
         '''
-        self.visaobj.write(':ABORt')
-        data = self.visaobj.query('FETCh?')
+        self.waitForOpc(':ABORt', self.fetchTimeout)
+        timeout = self.visaobj.timeout
+        self.visaobj.timeout = self.fetchTimeout*1000 # up to 2500 buffered readings
+        try:
+            data = self.readData('FETCh?')
+        finally:
+            # the pooled session must not keep the long timeout
+            self.visaobj.timeout = timeout
+        return data
+
+    def listSweep(self, voltages, delay = 0, binary = True):
+        '''
+        Sweeps through a list of voltages from the SMU's trigger model and reads
+        all readings in one transfer.
+        
+        The list is uploaded with SOURce:LIST:VOLTage (skipped if the SMU already
+        holds it) and each point is sourced, settled for delay seconds and
+        measured by the SMU itself, so a sweep of any length takes a few bus
+        transactions instead of several per point. setVoltage() returns the
+        SMU to fixed voltage mode.
+        
+        Parameters:
+        -----------
+        voltages : list or array-like
+            The voltages to force, in order. At most maxListPoints values.
+        delay : float
+            Source delay in seconds between setting each voltage and measuring.
+        binary : bool
+            Read the readings as a binary (SREal) block even if ASCII is selected
+            with setDataFormat(). The selected format is restored afterwards.
+        
+        Returns:
+        ----------
+        data : str or np.ndarray
+            One reading per voltage, see readData().
+        
+        Raises
+        ------
+        ValueError
+            The list is empty or longer than maxListPoints.
+        '''
+        voltages = np.asarray(voltages, dtype = float).ravel()
+        if len(voltages) < 1 or len(voltages) > self.maxListPoints:
+            raise ValueError('A list sweep needs 1 to {} voltages. {} voltages specified.'
+                             .format(self.maxListPoints,len(voltages)))
+        dataFormat = self.dataFormat
+        if binary and dataFormat == 'ASCii':
+            self.setDataFormat('SREal', self.byteOrder)
+        values = ['{:.6g}'.format(v) for v in voltages] # well beyond the 2400 source resolution
+        with ScpiBatch(self) as smu:
+            self.cachedWrite(':SOURce:VOLTage:MODE', 'LIST')
+            if not self.isCached(':SOURce:LIST:VOLTage', ','.join(values)):
+                # the list is sent in chunks of 100 values, the longest accepted in one command
+                smu.write(':SOURce:LIST:VOLTage {}'.format(','.join(values[:100])))
+                for i in range(100, len(values), 100):
+                    smu.write(':SOURce:LIST:VOLTage:APPend {}'.format(','.join(values[i:i+100])))
+                self.stateCache[':SOURce:LIST:VOLTage'] = ','.join(values)
+            self.cachedWrite(':SOURce:DELay', delay)
+            self.cachedWrite(':TRIGger:DELay', 0)
+            self.cachedWrite(':ARM:COUNt', 1)
+            self.cachedWrite(':TRIGger:COUNt', len(voltages))
+        timeout = self.visaobj.timeout
+        self.visaobj.timeout = (self.fetchTimeout + len(voltages)*delay)*1000
+        try:
+            data = self.readData('READ?')
+        finally:
+            self.visaobj.timeout = timeout
+            if dataFormat != self.dataFormat:
+                self.setDataFormat(dataFormat, self.byteOrder)
         return data
 
     def outputOff(self):
@@ -226,6 +431,7 @@ class Keithley2400:
         if self.visaobj.query('SOURce:VOLTage?') != 0:
             self.setVoltage(0)
         self.visaobj.write(':OUTPut:STATe OFF')        
+        self.invalidateCache() # output must be configured again before the next measurement
         self.visaobj.timeout = 2000
         
     def disconnect(self):
@@ -243,4 +449,4 @@ class Keithley2400:
   #      self.outputOff()
   #      self.visaobj.write(':SYSTem:KEY 23') # return to local
    #     self.visaobj.close()
-        
\ No newline at end of file
+        visaPool.release(self.resource)
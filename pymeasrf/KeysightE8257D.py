@@ -5,57 +5,15 @@ ander906@purdue.edu
 HybridMEMS
 '''
 
-import visa
+from pymeasrf.instrument import Instrument
 import numpy as np
 
-class KeysightE8257D:
+class KeysightE8257D(Instrument):
     '''
     A class for controlling the Keysight E8257D PSG Signal Generator
     using VISA commands. This class should also largely work for the 
     E8267D and E8663D signal generators in the same product family.
     '''
-    
-    
-    def __init__(self, resource, label = None):
-        '''
-        Creates a new instrument instance and attempts connection. 
-        
-        Parameters:
-        -----------
-        resource : str
-            A string containing the VISA address of the device.
-        label : str
-            The name of the device that will be used to label data uniquely.
-        
-        Returns:
-        ----------
-        N/A
-        '''
-        self.connect(resource, label) 
-    
-    def connect(self, resource, label = None):
-        '''
-        Connect to the instrument. 
-        
-        Parameters:
-        -----------
-        resource : str
-            A string containing the VISA address of the device.
-        label : str
-            The name of the device that will be used to label data uniquely.
-        Returns:
-        ----------
-        N/A
-        '''
-        rm = visa.ResourceManager()
-        self.label = label
-        
-        # VisaIOError VI_ERROR_RSRC_NFOUND
-        try:
-          self.visaobj = rm.open_resource(resource)
-        except visa.VisaIOError as e:
-          print(e.args)
-          raise SystemExit(1)
 
     def basicOutput(self, freq, power):
         '''
@@ -159,47 +117,3 @@ class KeysightE8257D:
         N/A
         '''
         self.visaobj.assert_trigger()
-          
-    def readError(self):
-        '''
-        Prints the most recent error and clears it from the error register on the instrument. 
-        
-        Parameters:
-        -----------
-        N/A
-        
-        Returns:
-        ----------
-        N/A
-        '''
-        print(self.visaobj.query('SYSTem:ERRor?'))
-        
-    def outputOff(self):
-        '''
-        Turns off output. 
-        
-        Parameters:
-        -----------
-        N/A
-        
-        Returns:
-        ----------
-        N/A
-        '''
-        self.visaobj.write(':OUTPut OFF')        
-        
-    def disconnect(self):
-        '''
-        Turns off output and disconnects from the SMU. 
-        
-        Parameters:
-        -----------
-        N/A
-        
-        Returns:
-        ----------
-        N/A
-        '''
-        self.outputOff()
-        self.visaobj.control_ren(6) # sends GTL (Go To Local) command
-        self.visaobj.close()
@@ -0,0 +1,116 @@
+#asyncDriver.py
+'''
+asyncio counterparts of the instrument drivers.
+
+VISA calls block, so each driver method is run in a worker thread. Every
+instrument gets its own single-thread executor: calls to one instrument stay
+in order, while calls to different instruments (separate GPIB addresses or
+a LAN instrument) run at the same time.
+'''
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+class AsyncInstrument:
+    '''
+    Wraps a driver so that each of its methods returns an awaitable.
+
+        smu = AsyncInstrument(k2400.Keithley2400('GPIB1::24::INSTR', label = 'gate'))
+        await smu.setVoltage(1.0)
+
+    Attributes that are not methods (label, voltages, visaobj, ...) are
+    returned unchanged from the driver.
+
+    Parameters:
+    -----------
+    driver : Instrument
+        The connected driver.
+    executor : concurrent.futures.Executor
+        Executor used to run the driver calls. Defaults to a new single-thread
+        executor owned by this wrapper.
+    '''
+
+    def __init__(self, driver, executor = None):
+        self.driver = driver
+        self.ownExecutor = executor is None
+        if executor is None:
+            name = getattr(driver, 'label', None) or type(driver).__name__
+            executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = str(name))
+        self.executor = executor
+
+    def __getattr__(self, name):
+        attr = getattr(self.driver, name)
+        if not callable(attr):
+            return attr
+        @functools.wraps(attr)
+        async def method(*args, **kwargs):
+            return await self.run(attr, *args, **kwargs)
+        return method
+
+    async def run(self, func, *args, **kwargs):
+        '''
+        Runs any callable on this instrument's executor.
+
+        Parameters:
+        -----------
+        func : callable
+            The function to run, e.g. a lambda using driver.visaobj.
+        *args, **kwargs
+            Arguments passed to func.
+
+        Returns:
+        ----------
+        result
+            The return value of func.
+        '''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    def close(self):
+        '''
+        Shuts down the executor if it is owned by this wrapper. The driver is not disconnected.
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        N/A
+        '''
+        if self.ownExecutor:
+            self.executor.shutdown(wait = True)
+
+
+def wrapAll(drivers):
+    '''
+    Wraps a list of drivers in AsyncInstrument objects.
+
+    Parameters:
+    -----------
+    drivers : list
+        The connected drivers.
+
+    Returns:
+    ----------
+    wrapped : list
+        One AsyncInstrument per driver, in the same order.
+    '''
+    return [AsyncInstrument(d) for d in drivers]
+
+def closeAll(wrapped):
+    '''
+    Closes a list of AsyncInstrument objects.
+
+    Parameters:
+    -----------
+    wrapped : list
+        AsyncInstrument objects returned by wrapAll().
+
+    Returns:
+    ----------
+    N/A
+    '''
+    for w in wrapped:
+        w.close()
@@ -0,0 +1,226 @@
+#biasPlan.py
+'''
+Bias grids for measurements with several SMUs.
+
+A BiasPlan holds the grid of SMU voltage combinations and the order in
+which they are measured. Besides the raster order used so far (first SMU
+fastest, last SMU slowest, every inner sweep starting over), the points can
+be measured in serpentine order, where each inner sweep runs back the way the
+previous one came, or in any custom order. A maximum step size adds ramp
+points between measured points so no SMU jumps by more than maxStep at once.
+Smaller jumps settle faster and cause smaller thermal transients.
+'''
+
+import numpy as np
+
+class BiasPlan:
+    '''
+    Ordered bias points for a list of SMUs.
+
+        plan = BiasPlan.fromSmus(smus, order = 'serpentine', maxStep = 0.5)
+        for currentV, measure in plan.steps():
+            ...
+
+    Parameters:
+    -----------
+    voltages : list
+        One list or array of voltages per SMU, in the order of the SMUs.
+    order : str, callable or array-like
+        'raster' : the first SMU is stepped fastest and the last slowest, each
+                   SMU starting over at its first voltage (default).
+        'serpentine' : as raster, but every other sweep of a faster SMU runs
+                       in reverse, so consecutive points differ by one step of one SMU.
+        callable : called with the raster-ordered points, shape (nPoints, nSmus),
+                   and returns the indices of the points in measurement order.
+        array-like : the raster indices of the points in measurement order.
+    maxStep : float or list
+        Largest voltage change of an SMU (one value per SMU, or one for all)
+        between two set voltages. Larger changes are split into ramp points.
+    start : list
+        Voltages the SMUs are at before the first point, used for the ramp to
+        it. Defaults to 0 V, the level left by smuSetup() and outputOff().
+
+    Raises
+    ------
+    ValueError
+        Unknown order, or an order that is not a permutation of the grid points.
+    '''
+
+    def __init__(self, voltages, order = 'raster', maxStep = None, start = None):
+        self.voltages = [np.atleast_1d(np.asarray(v, dtype = float)) for v in voltages]
+        self.shape = tuple(len(v) for v in self.voltages)
+        self.nSmus = len(self.voltages)
+        self.maxStep = None if maxStep is None else np.broadcast_to(np.asarray(maxStep, dtype = float), (self.nSmus,))
+        self.start = np.zeros(self.nSmus) if start is None else np.asarray(start, dtype = float)
+        # the grid is built slowest SMU first so that C order walks it in raster order
+        grids = np.meshgrid(*self.voltages[::-1], indexing = 'ij')
+        self.grid = np.stack([g.ravel() for g in grids[::-1]], axis = 1) if self.nSmus else np.zeros((1, 0))
+        indices = np.meshgrid(*[np.arange(n) for n in self.shape[::-1]], indexing = 'ij')
+        self.gridIndices = np.stack([i.ravel() for i in indices[::-1]], axis = 1) if self.nSmus else np.zeros((1, 0), dtype = int)
+        self.order = self.ordering(order)
+        self.points = self.grid[self.order]
+        self.indices = self.gridIndices[self.order]
+
+    @classmethod
+    def fromSmus(cls, smus, order = 'raster', maxStep = None, start = None):
+        '''
+        Creates a plan from the voltages of a list of SMUs.
+
+        Parameters:
+        -----------
+        smus : list
+            SMU objects with voltages defined.
+        order, maxStep, start
+            See BiasPlan.
+
+        Returns:
+        ----------
+        plan : BiasPlan
+            The plan.
+        '''
+        return cls([x.voltages for x in smus], order, maxStep, start)
+
+    def ordering(self, order):
+        '''
+        Returns the raster indices of the grid points in measurement order.
+
+        Parameters:
+        -----------
+        order : str, callable or array-like
+            See BiasPlan.
+
+        Returns:
+        ----------
+        indices : np.ndarray
+            A permutation of range(len(grid)).
+        '''
+        n = len(self.grid)
+        if isinstance(order, str):
+            if order == 'raster':
+                return np.arange(n)
+            if order == 'serpentine':
+                return self.serpentine()
+            raise ValueError('Unknown bias order \'{}\'. Use raster, serpentine, a function or a list of indices.'.format(order))
+        indices = np.asarray(order(self.grid.copy()) if callable(order) else order, dtype = int)
+        if sorted(indices.tolist()) != list(range(n)):
+            raise ValueError('A bias order must contain each of the {} grid points exactly once.'.format(n))
+        return indices
+
+    def serpentine(self):
+        '''
+        Returns the raster indices in serpentine (boustrophedon) order.
+        '''
+        # index tuples slowest SMU first, reversing the inner sequence on every other outer step
+        sequence = [()]
+        for n in self.shape:
+            inner = sequence
+            sequence = []
+            for i in range(n):
+                sequence += [(i,) + s for s in (inner if i % 2 == 0 else inner[::-1])]
+        strides = np.cumprod((1,) + self.shape[:-1])
+        return np.array([int(np.dot(s[::-1], strides)) for s in sequence])
+
+    def __len__(self):
+        return len(self.points)
+
+    def __iter__(self):
+        '''
+        Yields the measured points as lists of voltages, one per SMU.
+        '''
+        for p in self.points:
+            yield list(p)
+
+    def ramp(self, previous, target):
+        '''
+        Returns the intermediate voltages needed to go from one point to the next within maxStep.
+
+        Parameters:
+        -----------
+        previous : array-like
+            The voltages set last.
+        target : array-like
+            The next voltages.
+
+        Returns:
+        ----------
+        ramp : np.ndarray
+            Intermediate points, shape (nSteps, nSmus), not including previous and target.
+        '''
+        previous = np.asarray(previous, dtype = float)
+        target = np.asarray(target, dtype = float)
+        if self.maxStep is None:
+            return np.zeros((0, self.nSmus))
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            ratio = np.where(self.maxStep > 0, np.abs(target - previous)/self.maxStep, 0)
+        nSteps = int(np.ceil(np.max(ratio, initial = 0)))
+        if nSteps <= 1:
+            return np.zeros((0, self.nSmus))
+        fractions = np.arange(1, nSteps)/nSteps
+        return previous + fractions[:,None]*(target - previous)
+
+    def steps(self, fromStart = False, skip = ()):
+        '''
+        Yields every voltage set during the plan, including ramp points.
+
+        Parameters:
+        -----------
+        fromStart : bool
+            Ramp to every point from start instead of from the previous point,
+            for measurements that return the SMUs to start after each point.
+        skip : collection of int
+            Positions (in measurement order) of points to leave out, e.g. the points
+            completed before a resumed run. Ramps lead from the last point set.
+
+        Returns:
+        ----------
+        steps : generator of (list, bool)
+            The voltages, one per SMU, and True for measured points or False for ramp points.
+        '''
+        previous = self.start
+        for k, p in enumerate(self.points):
+            if k in skip:
+                continue
+            for r in self.ramp(previous, p):
+                yield list(r), False
+            yield list(p), True
+            previous = self.start if fromStart else p
+
+    def travel(self):
+        '''
+        Returns the total voltage change of each SMU over the plan.
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        travel : np.ndarray
+            Sum of the absolute voltage steps per SMU, in volts.
+        '''
+        path = np.vstack([self.start[None,:], self.points])
+        return np.abs(np.diff(path, axis = 0)).sum(axis = 0)
+
+    def positions(self, indices):
+        '''
+        Returns the positions in measurement order of the points with the given grid indices.
+
+        Parameters:
+        -----------
+        indices : list
+            Grid indices of points, one index per SMU (rows of BiasPlan.indices).
+
+        Returns:
+        ----------
+        positions : set
+            The positions of the points in points.
+        '''
+        wanted = set(tuple(int(i) for i in idx) for idx in indices)
+        return set(k for k, idx in enumerate(self.indices) if tuple(idx.tolist()) in wanted)
+
+    def largestStep(self):
+        '''
+        Returns the largest voltage change of each SMU between two measured points.
+        '''
+        path = np.vstack([self.start[None,:], self.points])
+        return np.abs(np.diff(path, axis = 0)).max(axis = 0)
@@ -0,0 +1,191 @@
+#buffers.py
+'''
+Preallocated NumPy buffers for measurement data.
+'''
+
+import threading
+import numpy as np
+
+class RingBuffer:
+    '''
+    Fixed-size buffer keeping the most recent items, e.g. the last sweeps of a stream.
+
+    Items are stored in one preallocated array, so appending does not
+    allocate memory. Appending and reading are thread safe, so one thread
+    can fill the buffer while another reads or plots it.
+
+    Parameters:
+    -----------
+    capacity : int
+        Number of items kept.
+    shape : tuple
+        Shape of one item.
+    dtype : np.dtype
+        Data type of the items.
+    '''
+
+    def __init__(self, capacity, shape = (), dtype = float):
+        self.data = np.zeros((capacity,) + tuple(shape), dtype = dtype)
+        self.times = np.zeros(capacity)
+        self.capacity = capacity
+        self.count = 0 # total number of items ever appended
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, item, t = 0.0):
+        '''
+        Adds an item, overwriting the oldest one if the buffer is full.
+
+        Parameters:
+        -----------
+        item : array-like
+            The item, with the shape given at creation.
+        t : float
+            Timestamp stored with the item.
+
+        Returns:
+        ----------
+        N/A
+        '''
+        with self.lock:
+            i = self.count % self.capacity
+            self.data[i] = item
+            self.times[i] = t
+            self.count += 1
+
+    def latest(self, n = None):
+        '''
+        Returns a copy of the most recent items, oldest first.
+
+        Parameters:
+        -----------
+        n : int
+            Number of items. All items held are returned if None.
+
+        Returns:
+        ----------
+        times : np.ndarray
+            Timestamps of the items.
+        data : np.ndarray
+            The items, shape (n,) + item shape.
+        '''
+        with self.lock:
+            held = min(self.count, self.capacity)
+            n = held if n is None else min(n, held)
+            idx = (np.arange(self.count - n, self.count)) % self.capacity
+            return self.times[idx].copy(), self.data[idx].copy()
+
+    def clear(self):
+        '''
+        Empties the buffer.
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        N/A
+        '''
+        with self.lock:
+            self.count = 0
+
+
+class SmuDataBuffer:
+    '''
+    Growable columnar buffer for SMU readings (voltage, current, resistance, time, status).
+
+    Readings are stored in one preallocated float array with a row per
+    column. When it is full its capacity is doubled, so appending n readings
+    copies O(n) data in total instead of the whole history on every append.
+    array() and the column accessors return views without copying.
+
+    Parameters:
+    -----------
+    capacity : int
+        Number of readings allocated initially.
+    '''
+
+    columns = ('V', 'I', 'R', 't', 'status')
+
+    def __init__(self, capacity = 256):
+        self.data = np.zeros((len(self.columns), max(int(capacity), 1)))
+        self.n = 0
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, column):
+        '''
+        Returns a view of one column by name ('V', 'I', 'R', 't' or 'status') or index.
+        '''
+        if isinstance(column, str):
+            column = self.columns.index(column)
+        return self.data[column, :self.n]
+
+    @property
+    def capacity(self):
+        return self.data.shape[1]
+
+    @property
+    def nbytes(self):
+        '''
+        Memory allocated by the buffer in bytes.
+        '''
+        return self.data.nbytes
+
+    def reserve(self, capacity):
+        '''
+        Grows the buffer to hold at least capacity readings.
+
+        Parameters:
+        -----------
+        capacity : int
+            Number of readings.
+
+        Returns:
+        ----------
+        N/A
+        '''
+        if capacity > self.capacity:
+            data = np.zeros((len(self.columns), int(capacity)))
+            data[:, :self.n] = self.data[:, :self.n]
+            self.data = data
+
+    def append(self, readings):
+        '''
+        Appends readings.
+
+        Parameters:
+        -----------
+        readings : list or np.ndarray
+            One array per column, as returned by formatData(), or a structured
+            array with the fields V, I, R, t and status (see Keithley2400.readData()).
+
+        Returns:
+        ----------
+        N/A
+        '''
+        if isinstance(readings, np.ndarray) and readings.dtype.names:
+            readings = [readings[name] for name in self.columns]
+        readings = [np.atleast_1d(np.asarray(c, dtype = float)) for c in readings]
+        m = len(readings[0])
+        if self.n + m > self.capacity:
+            self.reserve(max(2*self.capacity, self.n + m))
+        for i, c in enumerate(readings):
+            self.data[i, self.n:self.n + m] = c
+        self.n += m
+
+    def array(self):
+        '''
+        Returns a view of the readings, shape (5, n): one row per column.
+        '''
+        return self.data[:, :self.n]
+
+    def clear(self):
+        '''
+        Removes all readings, keeping the allocated memory.
+        '''
+        self.n = 0
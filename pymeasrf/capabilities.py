@@ -0,0 +1,205 @@
+#capabilities.py
+'''
+Persistent cache of instrument capabilities (limits, catalogs, ranges).
+
+Values that only depend on the instrument model, options and firmware are
+queried once and stored on disk keyed by the instrument's *IDN? response,
+which includes the serial number and firmware revision. Drivers read them
+through Instrument.capability() to validate settings without bus traffic.
+A firmware update gives a new *IDN? string and so a fresh set of values;
+refresh() forgets values explicitly, e.g. after installing an option or
+adding a calset.
+
+The cache file is ~/.pymeasrf_capabilities.json, or the file named by the
+environment variable PYMEASRF_CAPABILITIES. While a session is recorded or
+simulated (see visaPool), the in-memory sessionCapabilities is used instead:
+recordings then contain the capability queries, and replayed answers never
+reach the file.
+'''
+
+import json
+import os
+import threading
+
+class CapabilityCache:
+    '''
+    Capability values per instrument identity, persisted in a JSON file.
+
+    Parameters:
+    -----------
+    filename : str
+        The cache file. Nothing is written to disk if None.
+    '''
+
+    def __init__(self, filename = None):
+        self.filename = filename
+        self.lock = threading.RLock()
+        self.data = {}
+        self.load()
+
+    def load(self):
+        '''
+        (Re)reads the cache file. A missing or unreadable file gives an empty cache.
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        N/A
+        '''
+        with self.lock:
+            self.data = {}
+            if self.filename and os.path.exists(self.filename):
+                try:
+                    with open(self.filename) as f:
+                        self.data = json.load(f)
+                except (OSError, ValueError) as e:
+                    print('Ignoring capability cache {}: {}'.format(self.filename, e))
+
+    def save(self):
+        '''
+        Writes the cache file.
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        N/A
+        '''
+        with self.lock:
+            if not self.filename:
+                return
+            tmp = self.filename + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.data, f, indent = 1, sort_keys = True)
+            os.replace(tmp, self.filename)
+
+    def has(self, identity, name):
+        '''
+        Checks whether a capability is cached for an instrument.
+
+        Parameters:
+        -----------
+        identity : str
+            The *IDN? response of the instrument.
+        name : str
+            Name of the capability.
+
+        Returns:
+        ----------
+        cached : bool
+            True if a value is stored.
+        '''
+        with self.lock:
+            return name in self.data.get(identity, {})
+
+    def get(self, identity, name, default = None):
+        '''
+        Returns a cached capability.
+
+        Parameters:
+        -----------
+        identity : str
+            The *IDN? response of the instrument.
+        name : str
+            Name of the capability.
+        default
+            Returned if the capability is not cached.
+
+        Returns:
+        ----------
+        value
+            The cached value.
+        '''
+        with self.lock:
+            return self.data.get(identity, {}).get(name, default)
+
+    def set(self, identity, name, value):
+        '''
+        Stores a capability and saves the cache file.
+
+        Parameters:
+        -----------
+        identity : str
+            The *IDN? response of the instrument.
+        name : str
+            Name of the capability.
+        value
+            A JSON-serializable value.
+
+        Returns:
+        ----------
+        N/A
+        '''
+        with self.lock:
+            self.data.setdefault(identity, {})[name] = value
+            self.save()
+
+    def refresh(self, identity = None, *names):
+        '''
+        Forgets cached capabilities so they are queried again on next use.
+
+        Parameters:
+        -----------
+        identity : str
+            The *IDN? response of the instrument. All instruments if None.
+        *names : str
+            Capabilities to forget. All capabilities of the instrument if none are given.
+
+        Returns:
+        ----------
+        N/A
+        '''
+        with self.lock:
+            if identity is None:
+                self.data = {}
+            elif not names:
+                self.data.pop(identity, None)
+            else:
+                for n in names:
+                    self.data.get(identity, {}).pop(n, None)
+            self.save()
+
+
+def isValid(value):
+    '''
+    Checks that a queried capability looks like a real answer before it is cached.
+
+    Empty responses and values that are all zero (the default answer of a
+    simulated session to a query it has no recording of) are rejected.
+
+    Parameters:
+    -----------
+    value
+        The queried value: a string, a number or a list/dict of them.
+
+    Returns:
+    ----------
+    valid : bool
+        True if the value may be stored.
+    '''
+    def leaves(v):
+        if isinstance(v, dict):
+            v = list(v.values())
+        if isinstance(v, (list, tuple)):
+            return [x for item in v for x in leaves(item)]
+        return [v]
+    values = leaves(value)
+    if not values or any(v is None or (isinstance(v, str) and not v.strip()) for v in values):
+        return False
+    def isZero(v):
+        try:
+            return float(v) == 0
+        except (TypeError, ValueError):
+            return False
+    return not all(isZero(v) for v in values)
+
+
+capabilities = CapabilityCache(os.environ.get('PYMEASRF_CAPABILITIES',
+                               os.path.join(os.path.expanduser('~'), '.pymeasrf_capabilities.json')))
+# used instead of capabilities while recording or replaying, so nothing recorded or simulated reaches the file
+sessionCapabilities = CapabilityCache(None)
@@ -0,0 +1,451 @@
+#instrument.py
+'''
+Common base class for the instrument drivers in pymeasrf.
+'''
+
+import asyncio
+import time
+import visa
+from pyvisa import constants
+import pymeasrf.visaPool as visaPool
+import pymeasrf.profiling as profiling
+from pymeasrf.capabilities import capabilities, sessionCapabilities, isValid
+
+class Instrument:
+    '''
+    Base class holding the connection handling shared by all drivers.
+
+    The session is taken from the shared pool (see visaPool) and wrapped in a
+    profiling.InstrumentedSession, so every write and query made through
+    visaobj is timed and recorded in profiling.profiler.
+
+    Settings written with cachedWrite() are remembered in stateCache and are
+    not sent again while the instrument already holds them. Call
+    invalidateCache() after anything that changes settings behind the
+    driver's back (front panel use, *RST, a recalled state file).
+
+    Values that do not change for a given instrument and firmware (limits,
+    catalogs) are read with capability() and kept on disk between sessions
+    (see capabilities.py).
+
+    Subclasses override errorQuery, outputOff() and disconnect() where the
+    instrument differs from the defaults.
+    '''
+
+    errorQuery = 'SYSTem:ERRor?'
+
+    def __init__(self, resource, label = None):
+        '''
+        Creates a new instrument instance and attempts connection.
+
+        Parameters:
+        -----------
+        resource : str
+            A string containing the VISA address of the device.
+        label : str
+            The name of the device that will be used to label data uniquely.
+
+        Returns:
+        ----------
+        N/A
+        '''
+        self.checkErrors = False # read error queue after each batch of setup commands
+        self.useCache = True # skip cachedWrite() commands that would not change a setting
+        self.connect(resource, label)
+
+    def connect(self, resource, label = None):
+        '''
+        Connect to the instrument.
+
+        Parameters:
+        -----------
+        resource : str
+            A string containing the VISA address of the device.
+        label : str
+            The name of the device that will be used to label data uniquely.
+        Returns:
+        ----------
+        N/A
+        '''
+        self.resource = resource
+        self.label = label
+
+        # VisaIOError VI_ERROR_RSRC_NFOUND
+        try:
+          session = visaPool.openResource(resource)
+        except visa.VisaIOError as e:
+          print(e.args)
+          raise SystemExit(1)
+        self.visaobj = profiling.InstrumentedSession(session, label or resource)
+        self.stateCache = {} # settings of a newly connected instrument are unknown
+        self.idn = None
+
+    def identity(self):
+        '''
+        Returns the *IDN? response of the instrument, queried once per connection.
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        idn : str
+            Manufacturer, model, serial number and firmware revision.
+        '''
+        if self.idn is None:
+            self.idn = self.visaobj.query('*IDN?').strip()
+        return self.idn
+
+    def capability(self, name, query, refresh = False):
+        '''
+        Returns an instrument capability from the persistent cache, querying it on first use.
+
+        While sessions are recorded or simulated the values are kept in memory
+        only (see capabilities.py). Invalid answers (see capabilities.isValid())
+        are returned but not cached.
+
+        Parameters:
+        -----------
+        name : str
+            Name of the capability, e.g. 'sourcePowerLimits'.
+        query : str or callable
+            SCPI query returning the value, or a function returning a
+            JSON-serializable value (e.g. a list of floats).
+        refresh : bool
+            Query the value again even if it is cached.
+
+        Returns:
+        ----------
+        value
+            The capability value.
+        '''
+        idn = self.identity()
+        pool = visaPool.pool
+        cache = capabilities if pool.simulator is None and pool.transcript is None else sessionCapabilities
+        if refresh or not cache.has(idn, name):
+            value = query() if callable(query) else self.visaobj.query(query).strip()
+            if not isValid(value):
+                print('Warning! {} returned an invalid {} ({}), not caching it.'.format(self.label or self.resource, name, value))
+                return value
+            cache.set(idn, name, value)
+        return cache.get(idn, name)
+
+    def refreshCapabilities(self, *names):
+        '''
+        Forgets cached capabilities of this instrument so they are queried again on next use.
+
+        Parameters:
+        -----------
+        *names : str
+            Capabilities to forget. All are forgotten if none are given.
+
+        Returns:
+        ----------
+        N/A
+        '''
+        self.idn = None
+        capabilities.refresh(self.identity(), *names)
+        sessionCapabilities.refresh(self.identity(), *names)
+
+    def cachedWrite(self, header, value = None, key = None):
+        '''
+        Sends a setting command unless the instrument is known to hold that setting already.
+
+        Parameters:
+        -----------
+        header : str
+            The SCPI command header, e.g. 'SENSe1:SWEep:POINts'.
+        value : str or number
+            The argument of the command. Commands without an argument are sent once
+            and then skipped until they are invalidated.
+        key : str
+            Name under which the setting is cached. Defaults to header; needed when
+            the same header sets different things depending on its arguments.
+
+        Returns:
+        ----------
+        sent : bool
+            True if the command was written, False if it was skipped.
+        '''
+        key = key or header
+        value = None if value is None else str(value)
+        if self.useCache and key in self.stateCache and self.stateCache[key] == value:
+            return False
+        self.visaobj.write(header if value is None else '{} {}'.format(header, value))
+        self.stateCache[key] = value
+        return True
+
+    def isCached(self, key, value = None):
+        '''
+        Checks whether a setting is known to be held by the instrument.
+
+        Parameters:
+        -----------
+        key : str
+            Name of the cached setting (see cachedWrite()).
+        value : str or number
+            The expected value.
+
+        Returns:
+        ----------
+        cached : bool
+            True if the setting was written with this value and not invalidated since.
+        '''
+        value = None if value is None else str(value)
+        return self.useCache and key in self.stateCache and self.stateCache[key] == value
+
+    def invalidateCache(self, *keys):
+        '''
+        Forgets cached settings so that the next cachedWrite() sends them again.
+
+        Parameters:
+        -----------
+        *keys : str
+            Names of the settings to forget. All settings are forgotten if none are given.
+
+        Returns:
+        ----------
+        N/A
+        '''
+        if not keys:
+            self.stateCache.clear()
+        for k in keys:
+            self.stateCache.pop(k, None)
+
+    def readError(self):
+        '''
+        Prints the most recent error and clears it from the error register on the instrument.
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        N/A
+        '''
+        print(self.visaobj.query(self.errorQuery))
+
+    def startOperation(self, command, timeout = 600, description = None):
+        '''
+        Sends an overlapped command followed by *OPC and returns without waiting for it to finish.
+
+        The operation complete bit of the standard event status register is
+        set by the instrument when the command finishes; the returned
+        Operation polls it with *ESR?, so the calling thread is free in the
+        meantime and a hung instrument is detected after timeout seconds
+        instead of blocking on a very long VISA timeout.
+
+        Parameters:
+        -----------
+        command : str
+            The SCPI command to run, e.g. 'SENSe1:SWEep:MODE SINGle'.
+        timeout : float
+            Time in seconds after which the operation is considered stalled.
+        description : str
+            Name of the operation used in messages. Defaults to the command.
+
+        Returns:
+        ----------
+        operation : Operation
+            Handle used to check for or wait for completion.
+        '''
+        self.cachedWrite('*ESE', 1) # operation complete bit only
+        self.visaobj.query('*ESR?') # clears an operation complete left by an earlier command
+        self.visaobj.write('{};*OPC'.format(command))
+        return Operation(self, timeout, description or command)
+
+    def waitForOpc(self, command, timeout = 600, callback = None):
+        '''
+        Sends an overlapped command and waits for it to complete, polling with backoff.
+
+        Parameters:
+        -----------
+        command : str
+            The SCPI command to run.
+        timeout : float
+            Time in seconds after which the operation is considered stalled.
+        callback : callable
+            Called between polls while waiting, e.g. to update plots.
+
+        Returns:
+        ----------
+        elapsed : float
+            Time in seconds the operation took.
+
+        Raises
+        ------
+        visa.VisaIOError
+            The operation did not complete within timeout seconds.
+        '''
+        return self.startOperation(command, timeout).wait(callback)
+
+    def outputOff(self):
+        '''
+        Turns off output.
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        N/A
+        '''
+        self.visaobj.write(':OUTPut OFF')
+
+    def goToLocal(self):
+        '''
+        Returns the instrument to front panel control. Cached settings are
+        forgotten, since they may be changed from the front panel.
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        N/A
+        '''
+        self.visaobj.control_ren(6) # sends GTL (Go To Local) command
+        self.invalidateCache()
+
+    def disconnect(self):
+        '''
+        Turns off output, returns the instrument to local control and releases the session.
+
+        The session is returned to the pool (see visaPool) and stays open for reuse.
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        N/A
+        '''
+        self.outputOff()
+        self.goToLocal()
+        visaPool.release(self.resource)
+
+
+class Operation:
+    '''
+    Handle for an overlapped instrument operation started with Instrument.startOperation().
+
+    Completion is detected by polling the operation complete bit of the
+    standard event status register (*ESR?). The poll interval starts at
+    poll seconds and grows by backoff after every unsuccessful poll up to
+    maxPoll seconds, so short operations are detected quickly and long
+    sweeps are not flooded with queries.
+
+    Parameters:
+    -----------
+    instrument : Instrument
+        The instrument running the operation.
+    timeout : float
+        Time in seconds after which the operation is considered stalled.
+    description : str
+        Name of the operation used in messages.
+    poll : float
+        First poll interval in seconds.
+    maxPoll : float
+        Longest poll interval in seconds.
+    backoff : float
+        Factor by which the poll interval grows.
+    '''
+
+    def __init__(self, instrument, timeout = 600, description = '', poll = 0.01, maxPoll = 0.5, backoff = 1.5):
+        self.instrument = instrument
+        self.timeout = timeout
+        self.description = description
+        self.poll = poll
+        self.maxPoll = maxPoll
+        self.backoff = backoff
+        self.start = time.perf_counter()
+        self.finished = None
+        self.nPolls = 0
+
+    def elapsed(self):
+        '''
+        Returns the time in seconds since the operation was started (or its duration once finished).
+        '''
+        return (self.finished or time.perf_counter()) - self.start
+
+    def done(self):
+        '''
+        Polls the instrument once.
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        done : bool
+            True if the operation has completed.
+
+        Raises
+        ------
+        visa.VisaIOError
+            The operation did not complete within the timeout.
+        '''
+        if self.finished is not None:
+            return True
+        self.nPolls += 1
+        if int(self.instrument.visaobj.query('*ESR?')) & 1:
+            self.finished = time.perf_counter()
+            return True
+        if self.timeout is not None and self.elapsed() > self.timeout:
+            print('{}: \'{}\' did not complete within {} s.'.format(self.instrument.label, self.description, self.timeout))
+            raise visa.VisaIOError(constants.StatusCode.error_timeout)
+        return False
+
+    def intervals(self):
+        '''
+        Generates the poll intervals.
+        '''
+        interval = self.poll
+        while True:
+            yield interval
+            interval = min(interval*self.backoff, self.maxPoll)
+
+    def wait(self, callback = None):
+        '''
+        Blocks until the operation completes.
+
+        Parameters:
+        -----------
+        callback : callable
+            Called with this Operation between polls.
+
+        Returns:
+        ----------
+        elapsed : float
+            Time in seconds the operation took.
+        '''
+        for interval in self.intervals():
+            if self.done():
+                return self.elapsed()
+            if callback is not None:
+                callback(self)
+            time.sleep(interval)
+
+    async def waitAsync(self):
+        '''
+        asyncio version of wait(); other tasks run between polls.
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        elapsed : float
+            Time in seconds the operation took.
+        '''
+        for interval in self.intervals():
+            if self.done():
+                return self.elapsed()
+            await asyncio.sleep(interval)
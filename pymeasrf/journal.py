@@ -0,0 +1,130 @@
+#journal.py
+'''
+Run journals for resuming long measurements.
+
+A RunJournal is a small JSON file holding the state of a measurement in
+progress, e.g. the bias points completed so far. It is rewritten after every
+step through a temporary file, so the file on disk is always a complete
+state even if the program dies while saving. Measurement data are appended
+to CSV files as they are taken (appendCsv()) and read back on resume (loadCsv()).
+'''
+
+import os
+import json
+import numpy as np
+
+class RunJournal:
+    '''
+    JSON state of a measurement, saved after every update.
+
+    Parameters:
+    -----------
+    filename : str
+        The journal file (including path).
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.state = {}
+
+    def load(self):
+        '''
+        Reads the journal file.
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        found : bool
+            True if the file exists and was read into state.
+        '''
+        if not os.path.exists(self.filename):
+            return False
+        with open(self.filename) as f:
+            self.state = json.load(f)
+        return True
+
+    def save(self):
+        '''
+        Writes state to the journal file, replacing the previous one in a single step.
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        N/A
+        '''
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.filename)
+
+    def update(self, **fields):
+        '''
+        Sets fields of state and saves the journal.
+
+        Parameters:
+        -----------
+        **fields
+            The values to store.
+
+        Returns:
+        ----------
+        N/A
+        '''
+        self.state.update(fields)
+        self.save()
+
+    def remove(self):
+        '''
+        Deletes the journal file.
+        '''
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+
+def appendCsv(filename, data):
+    '''
+    Appends readings to a CSV file and flushes it to disk.
+
+    Parameters:
+    -----------
+    filename : str
+        The CSV file (including path), created if missing.
+    data : array-like
+        The readings, one row per column as returned by formatData().
+
+    Returns:
+    ----------
+    N/A
+    '''
+    with open(filename, 'ab') as f:
+        np.savetxt(f, np.transpose(np.atleast_2d(data)), delimiter = ',')
+        f.flush()
+        os.fsync(f.fileno())
+
+def loadCsv(filename, nColumns = 5):
+    '''
+    Reads readings written with appendCsv().
+
+    Parameters:
+    -----------
+    filename : str
+        The CSV file (including path).
+    nColumns : int
+        Number of columns returned if the file is missing or empty.
+
+    Returns:
+    ----------
+    data : np.ndarray
+        The readings, one row per column, shape (nColumns, n).
+    '''
+    if not os.path.exists(filename) or not os.path.getsize(filename):
+        return np.zeros((nColumns, 0))
+    return np.loadtxt(filename, delimiter = ',', ndmin = 2).T
@@ -0,0 +1,131 @@
+#pipeline.py
+'''
+Background processing of measurement results.
+
+A Pipeline is a bounded queue drained by one worker thread. The measurement
+loop (the producer) submits the work that does not need the bias to stay
+put: transferring or saving the PNA data, converting SMU readings and
+writing files. Meanwhile it moves on to set the next bias point. Since
+there is a single worker, jobs finish in the order they were submitted. When
+the queue is full, submit() blocks, so a slow disk or transfer holds the
+sweep back instead of piling up data in memory.
+'''
+
+import threading
+import queue
+
+class Pipeline:
+    '''
+    Runs submitted jobs in order on a worker thread.
+
+        with Pipeline(depth = 2) as pipeline:
+            for ...:
+                pipeline.submit(saveData, data)
+
+    Parameters:
+    -----------
+    depth : int
+        Number of jobs that can wait in the queue before submit() blocks.
+    '''
+
+    def __init__(self, depth = 2):
+        self.queue = queue.Queue(maxsize = max(int(depth), 1))
+        self.error = None
+        self.nDone = 0
+        self.worker = threading.Thread(target = self.run, name = 'pymeasrf pipeline', daemon = True)
+        self.worker.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        self.close(raiseErrors = excType is None)
+        return False
+
+    def run(self):
+        '''
+        Worker loop: runs jobs until close() queues None. After a job fails
+        the remaining jobs are dropped and the error is raised in the producer.
+        '''
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                if self.error is None:
+                    func, args, kwargs = job
+                    func(*args, **kwargs)
+                    self.nDone += 1
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def check(self):
+        '''
+        Raises the exception of a failed job, if any.
+        '''
+        if self.error is not None:
+            raise self.error
+
+    def submit(self, func, *args, **kwargs):
+        '''
+        Queues func(*args, **kwargs) for the worker, waiting while the queue is full.
+
+        Parameters:
+        -----------
+        func : callable
+            The job.
+        *args, **kwargs
+            Its arguments.
+
+        Returns:
+        ----------
+        N/A
+
+        Raises
+        ------
+        Exception
+            The exception of an earlier job that failed.
+        '''
+        self.check()
+        self.queue.put((func, args, kwargs))
+
+    def join(self):
+        '''
+        Waits until every submitted job has finished.
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        N/A
+
+        Raises
+        ------
+        Exception
+            The exception of a job that failed.
+        '''
+        self.queue.join()
+        self.check()
+
+    def close(self, raiseErrors = True):
+        '''
+        Finishes the queued jobs and stops the worker.
+
+        Parameters:
+        -----------
+        raiseErrors : bool
+            Raise the exception of a failed job.
+
+        Returns:
+        ----------
+        N/A
+        '''
+        if self.worker.is_alive():
+            self.queue.put(None)
+            self.worker.join()
+        if raiseErrors:
+            self.check()
@@ -8,20 +8,40 @@ HybridMEMS
 import visa
 import numpy as np
 import time
+import asyncio
+import threading
+import contextlib
+import functools
 from context import pymeasrf
 import pymeasrf.AgilentPNAXUtils as pnaUtils
 import pymeasrf.Keithley2400 as k2400
+import pymeasrf.profiling as profiling
+import pymeasrf.asyncDriver as asyncDriver
+from pymeasrf.biasPlan import BiasPlan
+from pymeasrf.smuGroup import SmuGroup
+from pymeasrf.buffers import SmuDataBuffer
+from pymeasrf.settling import Settler
+from pymeasrf.journal import RunJournal, appendCsv, loadCsv
+from pymeasrf.refine import GridRefiner
+from pymeasrf.pipeline import Pipeline
+from pymeasrf.scheduler import CadenceScheduler
 import matplotlib.pyplot as plt
 import matplotlib as mpl
 
 
-def formatData(data):
+# data elements selected on the SMUs by prepareSmus(), in the column order of SmuDataBuffer
+smuElements = ['VOLTage', 'CURRent', 'RESistance', 'TIME', 'STATus']
+
+def formatData(data, nColumns = len(smuElements)):
+    if isinstance(data, np.ndarray):
+        # binary readout from Keithley2400.readData() - already one field per element
+        return [data[name].astype(float) for name in data.dtype.names]
     data = data.split(',')
-    n = len(data) / 5
-    if n != int(n):
+    n = len(data) // nColumns
+    if n*nColumns != len(data):
         print('Warning! SMU data doesn\'t have expected number of columns.')
-    formatData = [np.zeros(int(n)) for i in range(0,5)]
-    for i,d in enumerate(data): formatData[i % 5][i // 5] = d
+    formatData = [np.zeros(n) for i in range(0,nColumns)]
+    for i,d in enumerate(data[:n*nColumns]): formatData[i % nColumns][i // nColumns] = d
     return formatData
 
 class PNAsmuMeas():
@@ -59,13 +79,13 @@ class SParmMeas(PNAsmuMeas):
     '''
     PNA s-parameter measurement with arbitrary number of nested smu voltage steps.
     
-    Handles any number of SMUs by recursively iterating through objects. 
+    Handles any number of SMUs by walking the grid of their voltages (see biasPlan.BiasPlan). 
     Voltages are entered from the SMU voltage lists into a temporary currentV list, with all SMU voltages being set simultaneously.
     A pause then occurs for the delay period specified with sMeas being called at the conclusion. 
     Data is fetched from the SMUs after each sMeas() and appended to the SMU data array.
     
     SMU data is plotted and saved in localsavedir. 
-    PNA data saved in savedir on PNA.
+    PNA data saved in savedir on PNA, or transferred and saved in localsavedir if fetch is set.
     
     TODO: Implement base class for measurements.
     
@@ -95,6 +115,37 @@ class SParmMeas(PNAsmuMeas):
         Values from 0 to 999 accepted.
     pnaparms : dict
         A dictionary containing test parameters to set on the pna.
+    binary : bool
+        Transfer SMU readings as binary (SREal) blocks instead of ASCII text.
+    profile : bool
+        Save a per-bias-point profile of SCPI command latencies (see profiling.py)
+        in localsavedir and print the slowest commands after measure().
+    fetch : bool
+        Transfer the S-parameters to the PC as binary data and save them in localsavedir
+        as .npz files (see AgilentPNAx.fetchSnp()) instead of saving snp files on the PNA.
+    order : str, callable or array-like
+        Order of the bias points, e.g. 'serpentine' (see biasPlan.BiasPlan).
+        Defaults to 'raster', the last SMU stepped slowest and the first fastest.
+    maxStep : float or list
+        Largest voltage step of an SMU between set voltages; larger changes are ramped.
+    settle : str
+        'relative' or 'exponential' to poll the SMU currents after setting a bias point
+        and sweep as soon as they have settled (see settling.Settler), with delay as the
+        longest wait. The buffered SMU measurement starts once settled.
+        None (default) always waits the full delay.
+    settleInterval : float
+        Time in seconds between current readings while settling.
+    settleTolerance : float
+        Relative current tolerance for settling.
+    journal : bool
+        Keep a run journal in localsavedir and append the SMU data to the csv files
+        after every bias point, so an interrupted measure() can be resumed with
+        measure(resume = True) (see startJournal()).
+    pipelineDepth : int
+        Transfer or save the PNA data and process the SMU readings of each bias point
+        on a worker thread while the next bias point is set and settles, with up to
+        pipelineDepth points waiting (see measurePoint()). 0 (default) handles every
+        point before setting the next.
         
     Returns:
     ----------
@@ -102,7 +153,10 @@ class SParmMeas(PNAsmuMeas):
     '''
 
     def __init__(self, smus, pna, sPorts, savedir, localsavedir, testname, delay = 0,
-                 postMeasDelay = 0, smuMeasInter = 1.0, power = None, pnaparms = None, trueMode = False, phaseOffset = 0): 
+                 postMeasDelay = 0, smuMeasInter = 1.0, power = None, pnaparms = None, trueMode = False, phaseOffset = 0,
+                 binary = False, profile = False, fetch = False, order = 'raster', maxStep = None,
+                 settle = None, settleInterval = 0.2, settleTolerance = 1e-3, journal = False,
+                 pipelineDepth = 0): 
         PNAsmuMeas.__init__(self,smus,pna,sPorts,savedir,localsavedir,testname)
         self.delay = delay
         self.postMeasDelay = postMeasDelay
@@ -111,8 +165,420 @@ class SParmMeas(PNAsmuMeas):
         self.trueMode = trueMode
         self.power = power
         self.phaseOffset = phaseOffset
+        self.binary = binary
+        self.profile = profile
+        self.fetch = fetch
+        self.order = order
+        self.maxStep = maxStep
+        self.settle = settle
+        self.settleInterval = settleInterval
+        self.settleTolerance = settleTolerance
+        self.settleTimes = [] # s, time waited at each bias point of the last measure() with settle
+        self.journal = journal
+        self.pipelineDepth = pipelineDepth
+        self.pnaLock = threading.Lock() # held by whichever thread is using the PNA in a pipelined measurement
+        self.overhead = 0 # s per bias point beyond delays and sweep, measured by measure()
+        
+    def estimateTime(self):
+        '''
+        Predicts the duration of measure().
+        
+        The expected PNA sweep time (see AgilentPNAx.expectedSweepTime()) is added to
+        the delays and to the per-point overhead measured in the previous run.
+        Sets up the PNA measurement if it is not set up yet.
+        
+        Parameters
+        -----------
+        N/A
         
-    def measure(self, smuX = None, smuY = None, smuZ = None):
+        Returns
+        -----------
+        perPoint : float
+            Expected time per bias point in seconds.
+        total : float
+            Expected time for all bias points in seconds.
+        '''
+        measurement = self.pna.prepareMeasurement(self.sPorts, self.power, self.pnaparms, self.trueMode, self.phaseOffset)
+        if not measurement.isSetUp():
+            measurement.setup()
+        perPoint = self.expectedDelay() + self.postMeasDelay + self.pna.expectedSweepTime() + self.overhead
+        return perPoint, perPoint*self.nBiasPoints()
+    
+    def nBiasPoints(self):
+        '''
+        Returns the number of bias points measured by measure().
+        '''
+        return len(self.biasPlan()) if self.smus else 1
+    
+    def startEta(self):
+        '''
+        Prints the expected duration of the measurement and returns an EtaEstimator for it.
+        '''
+        perPoint, total = self.estimateTime()
+        print('Measuring {} bias points, estimated duration {}.'.format(self.nBiasPoints(), profiling.formatDuration(total)))
+        return profiling.EtaEstimator(self.nBiasPoints(), perPoint)
+    
+    def updateOverhead(self, eta):
+        '''
+        Stores the measured per-point overhead for the next estimateTime().
+        '''
+        if eta.nDone and eta.perIteration() is not None:
+            self.overhead = max(0, eta.perIteration() - self.expectedDelay() - self.postMeasDelay - self.pna.expectedSweepTime())
+    
+    def expectedDelay(self):
+        '''
+        Returns the expected wait per bias point: the mean settle time of the last
+        measurement if settle is set and one has run, otherwise delay.
+        '''
+        if self.settle and self.settleTimes:
+            return float(np.mean(self.settleTimes))
+        return self.delay
+    
+    def settler(self, group = None):
+        '''
+        Returns a Settler for the SMUs if settle is set, otherwise None.
+        
+        Parameters
+        -----------
+        group : SmuGroup
+            Group used to read the SMUs concurrently.
+        
+        Returns
+        -----------
+        settler : Settler or None
+            Waits at most delay seconds for the SMU currents to settle.
+        '''
+        if not self.settle:
+            return None
+        return Settler(self.smus, self.delay, self.settle, self.settleInterval, self.settleTolerance, group = group)
+    
+    def saveSettleTimes(self, settler):
+        '''
+        Stores the settle times of settler and saves them in localsavedir.
+        '''
+        self.settleTimes = settler.settleTimes
+        filename = '{}\\{}_settle.csv'.format(self.localsavedir,self.testname)
+        print('Settled in {:.2f} s on average (at most {} s). Saving settle times in {}'.format(self.expectedDelay(), self.delay, filename))
+        settler.save(filename)
+        
+    def prepareSmus(self):
+        '''
+        Checks that every SMU has voltages defined, selects the reading format and resets the SMU timers.
+        
+        Parameters
+        -----------
+        N/A
+        
+        Returns
+        -----------
+        smuData : list
+            One empty SmuDataBuffer per SMU, sized for one reading per bias point.
+        
+        Raises
+        ------
+        ValueError
+            An SMU has no voltages defined.
+        '''
+        smuData = [None]*len(self.smus)
+        for i,x in enumerate(self.smus):
+            if x.voltages.all() == None:
+                raise ValueError('No voltages defined for SMU \'{}\''.format(x.label))
+            x.setElements(smuElements)
+            x.setDataFormat('SREal' if self.binary else 'ASCii')
+            x.resetTime()
+            smuData[i] = SmuDataBuffer(len(self.biasPlan()))
+        return smuData
+    
+    def biasPlan(self):
+        '''
+        Returns the BiasPlan of the SMU voltages with the selected order and maxStep.
+        
+        Parameters
+        -----------
+        N/A
+        
+        Returns
+        -----------
+        plan : BiasPlan
+            The bias points in measurement order.
+        '''
+        return BiasPlan.fromSmus(self.smus, self.order, self.maxStep)
+    
+    def biasPoints(self):
+        '''
+        Generates the SMU voltage combinations in measurement order (see biasPlan()).
+        
+        Parameters
+        -----------
+        N/A
+        
+        Returns
+        -----------
+        currentV : generator of lists
+            One voltage per SMU, in the order of self.smus.
+        '''
+        return iter(self.biasPlan())
+    
+    def smuFile(self, smu):
+        '''
+        Returns the csv file in localsavedir holding the data of an SMU.
+        '''
+        return '{}\\{}_{}.csv'.format(self.localsavedir,self.testname,smu.label)
+    
+    def startJournal(self, plan, smuData, resume = False):
+        '''
+        Opens the run journal of measure() in localsavedir.
+        
+        The journal holds the bias plan, the grid indices (BiasPlan.indices) of the
+        completed bias points, the number of SMU readings saved for them and the
+        test number counter q. On resume the saved SMU readings are loaded into
+        smuData and q is restored, so file names continue where they stopped.
+        
+        Parameters
+        -----------
+        plan : BiasPlan
+            The bias plan of the measurement.
+        smuData : list
+            The empty SmuDataBuffer objects returned by prepareSmus().
+        resume : bool
+            Continue the run recorded in an existing journal. A new run is
+            started if there is none.
+        
+        Returns
+        -----------
+        journal : RunJournal
+            The journal, to be passed to recordPoint().
+        skip : set
+            Positions in plan of the bias points already measured.
+        
+        Raises
+        ------
+        ValueError
+            The journal was written for a different bias plan.
+        '''
+        journal = RunJournal('{}\\{}_journal.json'.format(self.localsavedir,self.testname))
+        if resume and journal.load():
+            if journal.state['points'] != plan.points.tolist():
+                raise ValueError('Journal {} was written for a different bias plan.'.format(journal.filename))
+            for i,x in enumerate(self.smus):
+                smuData[i].append(loadCsv(self.smuFile(x))[:, :journal.state['rows'][i]])
+            self.q = journal.state['q']
+            skip = plan.positions(journal.state['completed'])
+            print('Resuming {} after {} of {} bias points.'.format(self.testname, len(skip), len(plan)))
+            return journal, skip
+        for x in self.smus:
+            open(self.smuFile(x), 'w').close()
+        journal.update(testname = self.testname, points = plan.points.tolist(), completed = [],
+                       rows = [0]*len(self.smus), q = self.q)
+        return journal, set()
+    
+    def recordPoint(self, journal, index, smuData, newData):
+        '''
+        Appends the SMU readings of a completed bias point to the csv files and records it in the journal.
+        
+        Parameters
+        -----------
+        journal : RunJournal
+            The journal returned by startJournal().
+        index : np.ndarray
+            Grid indices of the bias point (row of BiasPlan.indices).
+        smuData : list
+            The SmuDataBuffer objects, with the readings of the point appended.
+        newData : list
+            The readings of the point, one formatData() result per SMU.
+        
+        Returns
+        -----------
+        N/A
+        '''
+        for x,d in zip(self.smus,newData):
+            appendCsv(self.smuFile(x), d)
+        journal.state['completed'].append([int(i) for i in index])
+        journal.update(rows = [len(d) for d in smuData], q = self.q)
+    
+    def fetchSmuData(self, smu):
+        '''
+        Stops the SMU measurement started with startMeas() and reads the buffered data.
+        
+        Completion of the abort is polled (see Instrument.waitForOpc()), so a hung
+        SMU is reported after smu.fetchTimeout seconds.
+        
+        Parameters
+        -----------
+        smu : Keithley2400
+            One of self.smus.
+        
+        Returns
+        -----------
+        data : str or numpy structured array
+            The SMU readings, see Keithley2400.readData().
+        '''
+        return smu.stopMeas()
+    
+    def saveSmuData(self, smuData, smuX = None, smuY = None, smuZ = None):
+        '''
+        Turns off the SMUs, then saves and plots the SMU data in localsavedir.
+        
+        Parameters
+        -----------
+        smuData : list
+            The SmuDataBuffer objects returned by prepareSmus() with the measured data appended.
+        smuX : int
+            Position of x-axis SMU (voltage data) in list passed at creation of measurement.
+        smuY : int
+            Position of y-axis SMU (current data) in list passed at creation of measurement.
+        smuZ : int
+            Position of z-axis (color) SMU (voltage data) in list passed at creation of measurement.
+        
+        Returns
+        -----------
+        N/A
+        '''
+        if (smuX != None and smuY != None):
+            fig = plt.figure()
+            ax = fig.add_subplot(111)
+            if smuZ != None:
+                colormap = mpl.cm.get_cmap('jet',len(smuData[smuZ]['V']))
+                ax.scatter(smuData[smuX]['V'],smuData[smuY]['I']*1E6, c = smuData[smuZ]['V'], cmap = colormap)
+#                    cbar = plt.colorbar(ax)
+#                    cbar.set_label('{} Voltage (V)'.format(self.smus[smuZ].label))
+            else:
+                ax.plot(smuData[smuX]['V'],smuData[smuY]['I']*1E6)
+            ax.set_xlabel('{} Voltage (V)'.format(self.smus[smuX].label))
+            ax.set_ylabel('{} Current (uA)'.format(self.smus[smuY].label))
+            plt.savefig('{}\\{}_xy'.format(self.localsavedir,self.testname))
+            
+        for i,x in enumerate(self.smus): 
+            x.outputOff()
+            smuData1 = smuData[i].array()
+            filename = self.smuFile(x)
+            print('Saving {} data on local PC in {}'.format(x.label,filename))
+            np.savetxt(filename,np.transpose(smuData1),delimiter=',')
+          
+            # plot data
+            fig = plt.figure()
+            fig.suptitle(x.label)
+            ax = fig.add_subplot(211)
+            ax.plot(smuData1[3],smuData1[1]*1E6,'.',markersize=10)
+            ax.set_ylabel('Current (uA)')
+            ax1 = fig.add_subplot(212)
+            ax1.plot(smuData1[3],smuData1[0],'.',markersize=10)
+            ax1.set_xlabel('Time (s)')
+            ax1.set_ylabel('Voltage (V)')
+        
+    def measurePoint(self, group, settler, currentV, done, pipeline = None):
+        '''
+        Sets one bias point, waits for it to settle, sweeps the PNA and reads the SMUs.
+        
+        With a pipeline, only the sweep and the SMU readout happen here; transferring
+        or saving the PNA data, converting the SMU readings and done() run on the
+        pipeline's worker (see finishPoint()) while the next bias point is set.
+        
+        Parameters
+        -----------
+        group : SmuGroup
+            The group of self.smus.
+        settler : Settler
+            Waits for the SMU currents to settle, or None to wait delay seconds.
+        currentV : list
+            One voltage per SMU.
+        done : function
+            Called as done(sweep, newData) with the PNA data ((freq, s) if fetch is set,
+            otherwise None) and the readings of each SMU as returned by formatData().
+        pipeline : Pipeline
+            Worker for the data handling, or None to handle the data before returning.
+        
+        Returns
+        -----------
+        N/A
+        '''
+        with profiling.profiler.sweep('{}_{}'.format(self.testname,self.q)):
+            print('Setting SMU voltages. ',end='')
+            testname2 = self.testname + '_{}'.format(self.q)
+            self.q += 1
+            for i,v in enumerate(currentV):
+                print('{} {} V'.format(self.smus[i].label,v), end='  ')
+                testname2 = testname2 + '_{}{}V'.format(self.smus[i].label,str(v).replace('.','_'))
+            print()
+            # all SMUs are set and started at the same time
+            group.setVoltages(currentV, startMeas = settler is None, tmeas = self.smuMeasInter)
+            print(group.settleReport())
+            if settler is not None:
+                print("\nWaiting up to {} sec for SMU currents to settle".format(str(self.delay)))
+                settler.wait()
+                print(settler.report())
+                group.map(lambda x : x.startMeas(tmeas = self.smuMeasInter))
+            elif self.delay:
+                print("\nWaiting for {} sec to allow system to equilibriate".format(str(self.delay)))
+                for i in range(self.delay):
+                    time.sleep(1)
+                    if i%10 == 0:
+                        print(str(i) + "/" + str(self.delay))
+        
+            if pipeline is None:
+                sweep = self.pna.sMeas(self.sPorts, self.savedir, self.localsavedir, testname2, self.power,
+                                       self.pnaparms, bal = self.trueMode, phase = self.phaseOffset,
+                                       fetch = self.fetch)
+                done(sweep, [formatData(data) for data in group.map(self.fetchSmuData)])
+            else:
+                # the PNA is locked from the trigger until the worker has read or saved the sweep
+                with self.pnaLock:
+                    measurement = self.pna.prepareMeasurement(self.sPorts, self.power, self.pnaparms, self.trueMode, self.phaseOffset)
+                    measurement.trigger()
+                pipeline.submit(self.finishPoint, measurement, testname2, group.map(self.fetchSmuData), done,
+                                profiling.profiler.currentSweep)
+            if self.postMeasDelay: group.setVoltages([0]*len(self.smus))
+        
+            if self.postMeasDelay:
+                print("\nWaiting for {} sec before the next measurement".format(str(self.postMeasDelay)))
+                for i in range(self.postMeasDelay):
+                    time.sleep(1)
+                    if i%10 == 0:
+                        print(str(i) + "/" + str(self.postMeasDelay))
+    
+    def finishPoint(self, measurement, testname, smuData, done, label = None):
+        '''
+        Pipeline job of measurePoint(): transfers or saves the sweep, converts the SMU readings and calls done().
+        
+        Parameters
+        -----------
+        measurement : PnaMeasurement
+            The measurement that was triggered.
+        testname : str
+            Name of the snp or npz file.
+        smuData : list
+            The raw readings of each SMU (see fetchSmuData()).
+        done : function
+            See measurePoint().
+        label : str
+            Sweep label under which the transfer is profiled (see profiling.CommandProfiler.sweep()),
+            the label of the bias point in measurePoint().
+        
+        Returns
+        -----------
+        N/A
+        '''
+        with profiling.profiler.sweep(label):
+            sweep = None
+            with self.pnaLock:
+                if self.fetch:
+                    sweep = self.pna.fetchSnp(self.sPorts, measurement.channel)
+                else:
+                    measurement.save(self.savedir, '{}.s{}p'.format(testname,len(self.sPorts.split(','))))
+                self.pna.outputOff()
+            if self.fetch and self.localsavedir is not None:
+                filename = '{}\\{}.npz'.format(self.localsavedir,testname)
+                print('Saving snp data on local PC in {}'.format(filename))
+                pnaUtils.saveSnp(filename, sweep[0], sweep[1], self.sPorts)
+            done(sweep, [formatData(data) for data in smuData])
+    
+    def startPipeline(self):
+        '''
+        Returns a Pipeline of depth pipelineDepth for measurePoint(), or a null context if pipelineDepth is 0.
+        '''
+        return Pipeline(self.pipelineDepth) if self.pipelineDepth else contextlib.nullcontext()
+
+    def measure(self, smuX = None, smuY = None, smuZ = None, resume = False):
         '''
         Uses SMUs as V source and measures time, V force, and I sense. 
         Will plot V vs I for two SMUs, given smuX and smuY
@@ -127,108 +593,234 @@ class SParmMeas(PNAsmuMeas):
             Position of y-axis SMU (current data) in list passed at creation of measurement.
         smuZ : int
             Position of z-axis (color) SMU (voltage data) in list passed at creation of measurement.
+        resume : bool
+            Skip the bias points completed in the run journal of testname and
+            continue from there (see startJournal()). Implies journal.
             
         Returns
         -----------
         N/A
         '''        
+        eta = self.startEta()
         if self.smus:
-            smuData = [None]*len(self.smus)
-            for i,x in enumerate(self.smus):
-                if x.voltages.all() == None:
-                    raise ValueError('No voltages defined for SMU \'{}\''.format(x.label))
-                x.visaobj.write(':FORMat:ELEMents VOLTage, CURRent, RESistance, TIME, STATus')
-                x.resetTime()
-                smuData[i] = [np.zeros(1) for i in range(0,5)]
-            currentV = [None for i in range(0,len(self.smus))]
+            smuData = self.prepareSmus()
             
             self.q = 1 # counter for test number - ensures all snp names unique
-            def setVoltageLoop(l = len(self.smus)):
-                
-                if l >= 1:
-                    for i in self.smus[l-1].voltages:
-#                        print('{} {}'.format(self.smus[l-1].label,i))
-                        currentV[l-1] = i
-                        setVoltageLoop(l-1)
-                else:
-                    print('Setting SMU voltages. ',end='')
-                    testname2 = self.testname + '_{}'.format(self.q)
-                    self.q += 1
-                    for i,v in enumerate(currentV):
-                        print('{} {} V'.format(self.smus[i].label,v), end='  ')
-                        self.smus[i].setVoltage(v)
-                        self.smus[i].startMeas(tmeas = self.smuMeasInter)
-                        testname2 = testname2 + '_{}{}V'.format(self.smus[i].label,str(v).replace('.','_'))
-                    print()
-                    if self.delay:
-                        print("\nWaiting for {} sec to allow system to equilibriate".format(str(self.delay)))
-                        for i in range(self.delay):
-                            time.sleep(1)
-                            if i%10 == 0:
-                                print(str(i) + "/" + str(self.delay))
-                  
-                    self.pna.sMeas(self.sPorts, self.savedir, self.localsavedir, testname2, self.power,
-                                   self.pnaparms, bal = self.trueMode, phase = self.phaseOffset)
-                    for i,x in enumerate(self.smus):
-                        x.visaobj.timeout = 1200000
-                        data = x.stopMeas()
-                        x.visaobj.timeout = 2000000
-                        smuData[i] = np.append(smuData[i],formatData(data),1)
-                        if self.postMeasDelay: x.setVoltage(0)
-                    
-                    if self.postMeasDelay:
-                        print("\nWaiting for {} sec before the next measurement".format(str(self.postMeasDelay)))
-                        for i in range(self.postMeasDelay):
-                            time.sleep(1)
-                            if i%10 == 0:
-                                print(str(i) + "/" + str(self.postMeasDelay))
-                  
-         
-            setVoltageLoop()
+            plan = self.biasPlan()
+            journal, skip = self.startJournal(plan, smuData, resume) if self.journal or resume else (None, set())
+            eta.nTotal -= len(skip)
+            pending = iter([k for k in range(len(plan)) if k not in skip])
+            
+            def done(sweep, newData):
+                for i,d in enumerate(newData):
+                    smuData[i].append(d)
+                if journal is not None:
+                    self.recordPoint(journal, plan.indices[next(pending)], smuData, newData)
+                eta.done()
+                print(eta.report())
+            
+            with SmuGroup(self.smus) as group, self.startPipeline() as pipeline:
+                settler = self.settler(group)
+                for currentV, measured in plan.steps(fromStart = bool(self.postMeasDelay), skip = skip):
+                    if not measured:
+                        print('Ramping SMU voltages. ' + '  '.join('{} {:.4g} V'.format(x.label,v) for x,v in zip(self.smus,currentV)))
+                        group.setVoltages(currentV)
+                        continue
+                    self.measurePoint(group, settler, currentV, done, pipeline)
+                print('Largest SMU settle skew: {:.1f} ms.'.format(1e3*max(group.skews, default = 0)))
+            if settler is not None:
+                self.saveSettleTimes(settler)
         else:
-            self.pna.sMeas(self.sPorts, self.savedir, self.localsavedir, self.testname, self.power, self.pnaparms, bal = self.trueMode)
+            self.pna.sMeas(self.sPorts, self.savedir, self.localsavedir, self.testname, self.power, self.pnaparms, bal = self.trueMode, fetch = self.fetch)
+            eta.done()
+        self.updateOverhead(eta)
         
         plt.close('all') 
 
         
         if self.smus:
-            if (smuX != None and smuY != None):
-                fig = plt.figure()
-                ax = fig.add_subplot(111)
-                if smuZ != None:
-                    colormap = mpl.cm.get_cmap('jet',len(smuData[smuZ][:][:,1:][0]))
-                    ax.scatter(smuData[smuX][:][:,1:][0],smuData[smuY][:][:,1:][1]*1E6, c = smuData[smuZ][:][:,1:][0], cmap = colormap)
-#                    cbar = plt.colorbar(ax)
-#                    cbar.set_label('{} Voltage (V)'.format(self.smus[smuZ].label))
-                else:
-                    ax.plot(smuData[smuX][:][:,1:][0],smuData[smuY][:][:,1:][1]*1E6)
-                ax.set_xlabel('{} Voltage (V)'.format(self.smus[smuX].label))
-                ax.set_ylabel('{} Current (uA)'.format(self.smus[smuY].label))
-                plt.savefig('{}\\{}_xy'.format(self.localsavedir,self.testname))
-                
-            for i,x in enumerate(self.smus): 
-                x.outputOff()
-                smuData1 = smuData[i][:][:,1:]
-                filename = '{}\\{}_{}.csv'.format(self.localsavedir,self.testname,x.label)
-                print('Saving {} data on local PC in {}'.format(x.label,filename))
-                np.savetxt(filename,np.transpose(smuData1),delimiter=',')
-              
-                # plot data
-                fig = plt.figure()
-                fig.suptitle(x.label)
-                ax = fig.add_subplot(211)
-                ax.plot(smuData1[3],smuData1[1]*1E6,'.',markersize=10)
-                ax.set_ylabel('Current (uA)')
-                ax1 = fig.add_subplot(212)
-                ax1.plot(smuData1[3],smuData1[0],'.',markersize=10)
-                ax1.set_xlabel('Time (s)')
-                ax1.set_ylabel('Voltage (V)')
+            self.saveSmuData(smuData, smuX, smuY, smuZ)
+        
+        if self.profile:
+            profiling.profiler.printSummary()
+            profiling.profiler.exportProfile('{}\\{}_profile.json'.format(self.localsavedir,self.testname))
+            
+    def measureAdaptive(self, fom, coarseStep = 4, tolerance = 0.05, budget = None, smuX = None, smuY = None, smuZ = None):
+        '''
+        Measures a subset of the bias grid, refined where a figure of merit changes quickly.
+        
+        A coarse grid is measured first, then points are added between neighbouring
+        measured points whose figure of merit differs by more than the tolerance
+        (see refine.GridRefiner), until none do or budget sweeps have been made.
+        The bias points and their figures of merit are saved in localsavedir as
+        <testname>_refine.csv, the SMU data as in measure().
+        
+        Parameters
+        -----------
+        fom : function
+            fom(sweep, readings) of the PNA sweep ((freq, s) with fetch set, otherwise
+            None) and the SMU readings at the point, e.g. refine.admittance(10e9)
+            for |Y21 - Y12| at 10 GHz or refine.smuCurrent(1) for the current of the second SMU.
+        coarseStep : int
+            Spacing, in grid points, of the initial grid.
+        tolerance : float
+            Change of the figure of merit between neighbours, as a fraction of its range, above which is refined.
+        budget : int
+            Most PNA sweeps. Unlimited if None.
+        smuX, smuY, smuZ : int
+            See measure().
+            
+        Returns
+        -----------
+        values : dict
+            Figure of merit of every measured point by grid index tuple (see BiasPlan.gridIndices).
+        '''
+        plan = self.biasPlan()
+        refiner = GridRefiner(plan.shape, coarseStep, tolerance, budget)
+        smuData = self.prepareSmus()
+        self.q = 1 # counter for test number - ensures all snp names unique
+        points = []
+        previous = plan.start
+        
+        def done(index, currentV, sweep, newData):
+            for i,d in enumerate(newData):
+                smuData[i].append(d)
+            refiner.add(index, fom(sweep, newData))
+            points.append(currentV + [refiner.values[index]])
+        
+        with SmuGroup(self.smus) as group, self.startPipeline() as pipeline:
+            settler = self.settler(group)
+            batch = refiner.coarse()
+            while batch:
+                print('Measuring {} bias points ({} measured, {} in the grid).'.format(len(batch), len(refiner.values), len(plan)))
+                for index in batch:
+                    currentV = [float(v[k]) for v,k in zip(plan.voltages,index)]
+                    for r in plan.ramp(previous, currentV):
+                        group.setVoltages(list(r))
+                    self.measurePoint(group, settler, currentV, functools.partial(done, index, currentV), pipeline)
+                    previous = plan.start if self.postMeasDelay else currentV
+                if pipeline is not None:
+                    pipeline.join() # the figures of merit of the whole batch are needed to refine
+                batch = refiner.next()
+        print('Measured {} of {} bias points, {}.'.format(len(refiner.values), len(plan),
+              'converged' if refiner.converged() else 'budget used up'))
+        if settler is not None:
+            self.saveSettleTimes(settler)
+        filename = '{}\\{}_refine.csv'.format(self.localsavedir,self.testname)
+        np.savetxt(filename, points, delimiter = ',',
+                   header = ','.join(['{} (V)'.format(x.label) for x in self.smus] + ['fom']), comments = '')
+        
+        plt.close('all')
+        self.saveSmuData(smuData, smuX, smuY, smuZ)
+        
+        if self.profile:
+            profiling.profiler.printSummary()
+            profiling.profiler.exportProfile('{}\\{}_profile.json'.format(self.localsavedir,self.testname))
+        return dict(refiner.values)
+    
+    async def measureAsync(self, smuX = None, smuY = None, smuZ = None):
+        '''
+        asyncio version of measure(). Bias points and file names are the same,
+        but at each bias point all SMUs are set and started concurrently, and
+        their data are read back concurrently after the PNA sweep.
+        
+        Run with asyncio.run(meas.measureAsync()).
+        
+        Parameters
+        -----------
+        
+        smuX : int
+            Position of x-axis SMU (voltage data) in list passed at creation of measurement.
+        smuY : int
+            Position of y-axis SMU (current data) in list passed at creation of measurement.
+        smuZ : int
+            Position of z-axis (color) SMU (voltage data) in list passed at creation of measurement.
+            
+        Returns
+        -----------
+        N/A
+        '''
+        eta = self.startEta()
+        pna = asyncDriver.AsyncInstrument(self.pna)
+        smus = asyncDriver.wrapAll(self.smus) if self.smus else []
+        
+        settler = self.settler()
+        
+        async def startSmu(smu, v):
+            await smu.setVoltage(v)
+            if settler is None:
+                await smu.startMeas(tmeas = self.smuMeasInter)
+        
+        try:
+            if self.smus:
+                smuData = self.prepareSmus()
+                self.q = 1 # counter for test number - ensures all snp names unique
+                for currentV, measured in self.biasPlan().steps(fromStart = bool(self.postMeasDelay)):
+                    if not measured:
+                        await asyncio.gather(*[x.setVoltage(v) for x,v in zip(smus,currentV)])
+                        continue
+                    testname2 = self.testname + '_{}'.format(self.q)
+                    for x,v in zip(self.smus,currentV):
+                        testname2 = testname2 + '_{}{}V'.format(x.label,str(v).replace('.','_'))
+                    with profiling.profiler.sweep('{}_{}'.format(self.testname,self.q)):
+                        self.q += 1
+                        print('Setting SMU voltages. ' + '  '.join('{} {} V'.format(x.label,v)
+                              for x,v in zip(self.smus,currentV)))
+                        await asyncio.gather(*[startSmu(x,v) for x,v in zip(smus,currentV)])
+                        if settler is not None:
+                            print("\nWaiting up to {} sec for SMU currents to settle".format(str(self.delay)))
+                            await asyncio.get_running_loop().run_in_executor(None, settler.wait)
+                            print(settler.report())
+                            await asyncio.gather(*[x.startMeas(tmeas = self.smuMeasInter) for x in smus])
+                        elif self.delay:
+                            print("\nWaiting for {} sec to allow system to equilibriate".format(str(self.delay)))
+                            await asyncio.sleep(self.delay)
+                        
+                        await pna.sMeas(self.sPorts, self.savedir, self.localsavedir, testname2, self.power,
+                                        self.pnaparms, bal = self.trueMode, phase = self.phaseOffset,
+                                        fetch = self.fetch)
+                        data = await asyncio.gather(*[x.run(self.fetchSmuData, x.driver) for x in smus])
+                        for i,d in enumerate(data):
+                            smuData[i].append(formatData(d))
+                        
+                        if self.postMeasDelay:
+                            await asyncio.gather(*[x.setVoltage(0) for x in smus])
+                            print("\nWaiting for {} sec before the next measurement".format(str(self.postMeasDelay)))
+                            await asyncio.sleep(self.postMeasDelay)
+                        eta.done()
+                        print(eta.report())
+                if settler is not None:
+                    self.saveSettleTimes(settler)
+            else:
+                await pna.sMeas(self.sPorts, self.savedir, self.localsavedir, self.testname, self.power, self.pnaparms, bal = self.trueMode, fetch = self.fetch)
+                eta.done()
+        finally:
+            pna.close()
+            asyncDriver.closeAll(smus)
+        self.updateOverhead(eta)
+        
+        plt.close('all') 
+        
+        if self.smus:
+            self.saveSmuData(smuData, smuX, smuY, smuZ)
+        
+        if self.profile:
+            profiling.profiler.printSummary()
+            profiling.profiler.exportProfile('{}\\{}_profile.json'.format(self.localsavedir,self.testname))
             
-    def timeIntervalMeasure(self, measTimeInterval, numIntervals):
+    def timeIntervalMeasure(self, measTimeInterval, numIntervals, resume = False, overrun = 'skip', background = False):
         '''
         Carries out s-Parameter measurements (with arbitrary number of SMU bias
         points) at a set time interval.
         
+        Measurements start on a fixed cadence of the monotonic clock (see
+        scheduler.CadenceScheduler), so their duration does not shift the schedule.
+        The scheduler is kept in self.scheduler, with the start jitter of every measurement.
+        
+        With journal (or resume) set, the completed intervals and the test name of
+        the running one are kept in a journal in localsavedir, and every interval
+        journals its bias points (see measure()).
+        
         Parameters
         -----------
         
@@ -238,33 +830,74 @@ class SParmMeas(PNAsmuMeas):
         numIntervals : int
             Number of times to repeat the measurement.
             
+        resume : bool
+            Continue an interrupted run: skip the completed intervals and resume the
+            measurement of the interrupted one from its last completed bias point.
+            
+        overrun : str
+            What to do when a measurement takes longer than measTimeInterval:
+            'skip' drops the missed start times and waits for the next one,
+            'catchUp' starts the missed measurements at once until back on schedule.
+            
+        background : bool
+            Run the schedule in a daemon thread and return at once. Use
+            self.scheduler.join() to wait for it and self.scheduler.stop() to end it early.
+            
         Returns
         -----------
-        N/A
+        scheduler : CadenceScheduler
+            The scheduler of the measurements.
         '''
         testname = self.testname # record starting testname
-        meashr = measTimeInterval // 3600
-        measmin = (measTimeInterval % 3600) // 60
-        meassec = (measTimeInterval % 3600) % 60
+        journal = None
+        first, current = 0, None
+        if self.journal or resume:
+            journal = RunJournal('{}\\{}_intervals.json'.format(self.localsavedir,testname))
+            if resume and journal.load():
+                first, current = journal.state['completed'], journal.state['current']
+                print('Resuming after {} of {} measurements.'.format(first,numIntervals))
+            else:
+                journal.update(completed = 0, current = None)
         
-        totalTime = numIntervals*measTimeInterval
-        totalhr = totalTime // 3600
-        totalmin = (totalTime % 3600) // 60
-        totalsec = (totalTime % 3600) % 60
+        measureTime = self.estimateTime()[1]
+        self.scheduler = CadenceScheduler(measTimeInterval, numIntervals - first, overrun)
+        intervals = profiling.EtaEstimator(numIntervals - first, measTimeInterval)
+        if measureTime > measTimeInterval:
+            print('Warning! A measurement takes about {}, longer than the interval.'.format(profiling.formatDuration(measureTime)))
         
-        endTime = time.localtime(time.time()+totalTime)
+        endTime = time.localtime(self.scheduler.endTime(measureTime))
         print('Starting time: {}.'.format(time.asctime()))
-        print('Performing {} measurements over {} hours, {} minutes, and {} seconds.'.format(numIntervals,totalhr,totalmin,totalsec))
+        print('Performing {} measurements every {}.'.format(numIntervals - first,profiling.formatDuration(measTimeInterval)))
         print('Estimated completion after: {}.'.format(time.asctime(endTime)))
-        for i in range(0,numIntervals):
+        
+        def interval(k):
+            nonlocal current
+            i = first + k
             print('Starting measurement {}: {}.'.format(i+1,time.asctime()))
-            self.testname = '{}_{}__{}'.format(i+1,time.strftime('%d_%b_%Y__%H_%M_%S'),testname)
-            self.measure()
+            if current is not None:
+                self.testname, current = current, None # interrupted measurement
+            else:
+                self.testname = '{}_{}__{}'.format(i+1,time.strftime('%d_%b_%Y__%H_%M_%S'),testname)
+                if journal is not None: journal.update(current = self.testname)
+            # a new testname has no journal yet, so resume starts it from the first bias point
+            self.measure(resume = journal is not None)
+            if journal is not None: journal.update(completed = i+1, current = None)
             print('Measurement {} complete: {}.'.format(i+1,time.asctime()))
-            print('Waiting for {} hours, {} minutes, and {} seconds.'.format(meashr,measmin,meassec))
-            for j in range(measTimeInterval):
-               time.sleep(1)
-        self.testname = testname # return testname to original value
+            intervals.done(k + 1 - intervals.nDone) # skipped deadlines count as done
+            print(intervals.report())
+        
+        def finished():
+            self.testname = testname # return testname to original value
+            print(self.scheduler.report())
+        
+        if background:
+            self.scheduler.startThread(interval, finished)
+        else:
+            try:
+                self.scheduler.run(interval)
+            finally:
+                finished()
+        return self.scheduler
         
 def main():
     '''
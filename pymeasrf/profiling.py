@@ -0,0 +1,442 @@
+#profiling.py
+'''
+Per-command latency instrumentation for instrument sessions.
+
+Every transaction made through an InstrumentedSession is recorded by a
+CommandProfiler: the command header, duration, bytes written and read, and
+whether the transaction timed out. Durations are accumulated in logarithmic
+histograms per instrument and command, so memory use does not grow with the
+number of transactions. Records can be grouped by sweep (e.g. one bias point
+of an SParmMeas run) and exported as a profile.
+'''
+
+import contextlib
+import json
+import threading
+import time
+import numpy as np
+import visa
+from pyvisa import constants
+
+def commandHeader(command):
+    '''
+    Reduces a SCPI message to the header(s) used to group its statistics.
+
+    Parameters:
+    -----------
+    command : str
+        The SCPI message.
+
+    Returns:
+    ----------
+    header : str
+        The command header without arguments. Compound messages are reduced
+        to their first header followed by the number of additional commands.
+    '''
+    parts = [c for c in command.strip().split(';') if c]
+    if not parts:
+        return ''
+    header = parts[0].split(' ')[0]
+    if len(parts) > 1:
+        header += ' (+{})'.format(len(parts)-1)
+    return header
+
+
+class CommandProfiler:
+    '''
+    Accumulates per-command timing statistics and latency histograms.
+
+    Parameters:
+    -----------
+    bins : array-like
+        Histogram bin edges in seconds. Defaults to 4 bins per decade from 10 us to 1000 s.
+    '''
+
+    def __init__(self, bins = None):
+        self.bins = np.logspace(-5, 3, 33) if bins is None else np.asarray(bins)
+        self.lock = threading.Lock()
+        self.local = threading.local() # sweep label of each thread
+        self.enabled = True
+        self.clear()
+
+    @property
+    def currentSweep(self):
+        '''
+        The sweep label of the calling thread (see sweep()), None outside a sweep.
+        '''
+        return getattr(self.local, 'sweep', None)
+
+    @currentSweep.setter
+    def currentSweep(self, label):
+        self.local.sweep = label
+
+    def clear(self):
+        '''
+        Discards all recorded statistics.
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        N/A
+        '''
+        with self.lock:
+            self.stats = {}
+            self.sweeps = []
+
+    @contextlib.contextmanager
+    def sweep(self, label):
+        '''
+        Context manager that tags all transactions made inside it with a sweep label.
+
+        The label applies to the calling thread only, so a worker thread
+        handling one bias point can use its own label while the measurement
+        thread is in the next one.
+
+        Parameters:
+        -----------
+        label : str
+            Name of the sweep, e.g. the testname of a bias point.
+
+        Returns:
+        ----------
+        N/A
+        '''
+        previous = self.currentSweep
+        self.currentSweep = label
+        with self.lock:
+            if label is not None and label not in self.sweeps:
+                self.sweeps.append(label)
+        try:
+            yield self
+        finally:
+            self.currentSweep = previous
+
+    def record(self, instrument, command, duration, bytesOut = 0, bytesIn = 0, timedOut = False):
+        '''
+        Adds one transaction to the statistics.
+
+        Parameters:
+        -----------
+        instrument : str
+            Label or resource of the instrument.
+        command : str
+            The SCPI message sent.
+        duration : float
+            Transaction time in seconds.
+        bytesOut : int
+            Bytes written to the instrument.
+        bytesIn : int
+            Bytes read from the instrument.
+        timedOut : bool
+            The transaction ended in a timeout.
+
+        Returns:
+        ----------
+        N/A
+        '''
+        if not self.enabled:
+            return
+        key = (self.currentSweep, instrument, commandHeader(command))
+        with self.lock:
+            s = self.stats.get(key)
+            if s is None:
+                s = {'count' : 0, 'total' : 0.0, 'max' : 0.0, 'bytesOut' : 0, 'bytesIn' : 0,
+                     'timeouts' : 0, 'hist' : np.zeros(len(self.bins)+1, dtype = np.int64)}
+                self.stats[key] = s
+            s['count'] += 1
+            s['total'] += duration
+            s['max'] = max(s['max'], duration)
+            s['bytesOut'] += bytesOut
+            s['bytesIn'] += bytesIn
+            s['timeouts'] += int(timedOut)
+            s['hist'][np.searchsorted(self.bins, duration)] += 1
+
+    def summary(self, sweep = None):
+        '''
+        Returns per-command statistics, slowest (by total time) first.
+
+        Parameters:
+        -----------
+        sweep : str
+            Only include transactions from this sweep. All sweeps are merged if None.
+
+        Returns:
+        ----------
+        rows : list
+            One dict per instrument and command with count, total, mean and max
+            time (s), bytesOut, bytesIn, timeouts and the latency histogram counts.
+        '''
+        merged = {}
+        with self.lock:
+            for (sw, instrument, header), s in self.stats.items():
+                if sweep is not None and sw != sweep:
+                    continue
+                m = merged.setdefault((instrument, header), {'instrument' : instrument, 'command' : header,
+                                      'count' : 0, 'total' : 0.0, 'max' : 0.0, 'bytesOut' : 0, 'bytesIn' : 0,
+                                      'timeouts' : 0, 'hist' : np.zeros(len(self.bins)+1, dtype = np.int64)})
+                for k in ['count', 'total', 'bytesOut', 'bytesIn', 'timeouts', 'hist']:
+                    m[k] = m[k] + s[k]
+                m['max'] = max(m['max'], s['max'])
+        rows = sorted(merged.values(), key = lambda r: r['total'], reverse = True)
+        for r in rows:
+            r['mean'] = r['total'] / r['count']
+        return rows
+
+    def profile(self, sweep = None):
+        '''
+        Returns a JSON-serializable profile of one sweep (or of all sweeps).
+
+        Parameters:
+        -----------
+        sweep : str
+            The sweep to export. All sweeps are merged if None.
+
+        Returns:
+        ----------
+        profile : dict
+            The histogram bin edges and the per-command summary rows.
+        '''
+        rows = self.summary(sweep)
+        for r in rows:
+            r['hist'] = r['hist'].tolist()
+        return {'sweep' : sweep, 'binEdges' : self.bins.tolist(), 'commands' : rows}
+
+    def exportProfile(self, filename, perSweep = True):
+        '''
+        Writes the recorded statistics to a JSON file.
+
+        Parameters:
+        -----------
+        filename : str
+            The output file (including path).
+        perSweep : bool
+            Write one profile per sweep in addition to the merged profile.
+
+        Returns:
+        ----------
+        N/A
+        '''
+        data = {'all' : self.profile()}
+        if perSweep:
+            data['sweeps'] = [self.profile(sw) for sw in self.sweeps]
+        with open(filename, 'w') as f:
+            json.dump(data, f, indent = 1)
+
+    def printSummary(self, n = 10, sweep = None):
+        '''
+        Prints the n slowest commands by total time.
+
+        Parameters:
+        -----------
+        n : int
+            Number of commands to print.
+        sweep : str
+            Only include transactions from this sweep.
+
+        Returns:
+        ----------
+        N/A
+        '''
+        print('{:<12} {:<40} {:>7} {:>10} {:>10} {:>10} {:>4}'.format(
+              'Instrument','Command','Count','Total (s)','Mean (ms)','Max (ms)','TMO'))
+        for r in self.summary(sweep)[:n]:
+            print('{:<12} {:<40} {:>7} {:>10.3f} {:>10.2f} {:>10.2f} {:>4}'.format(
+                  str(r['instrument'])[:12], r['command'][:40], r['count'], r['total'],
+                  r['mean']*1E3, r['max']*1E3, r['timeouts']))
+
+
+profiler = CommandProfiler()
+
+
+class InstrumentedSession:
+    '''
+    Wraps a VISA session (or ScpiSocket/ScpiBatch) and records every transaction in a CommandProfiler.
+
+    Attributes that are not transactions (timeout, terminations, ...) are
+    read from and written to the wrapped session.
+
+    Parameters:
+    -----------
+    session : pyvisa Resource
+        The session to wrap.
+    name : str
+        Name of the instrument used in the statistics.
+    recorder : CommandProfiler
+        The profiler to record into. Defaults to the shared module profiler.
+    '''
+
+    _own = ['session', 'name', 'profiler']
+
+    def __init__(self, session, name, recorder = None):
+        object.__setattr__(self, 'session', session)
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'profiler', recorder if recorder is not None else profiler)
+
+    def __getattr__(self, attr):
+        return getattr(self.session, attr)
+
+    def __setattr__(self, attr, value):
+        if attr in self._own:
+            object.__setattr__(self, attr, value)
+        else:
+            setattr(self.session, attr, value)
+
+    def _timed(self, command, func, *args, **kwargs):
+        t0 = time.perf_counter()
+        timedOut = False
+        result = None
+        try:
+            result = func(*args, **kwargs)
+            return result
+        except visa.VisaIOError as e:
+            timedOut = e.error_code == constants.StatusCode.error_timeout
+            raise
+        finally:
+            self.profiler.record(self.name, command, time.perf_counter() - t0,
+                                 len(command) + 1, responseSize(result), timedOut)
+
+    def write(self, message, *args, **kwargs):
+        '''
+        Timed session.write().
+        '''
+        return self._timed(message, self.session.write, message, *args, **kwargs)
+
+    def query(self, message, *args, **kwargs):
+        '''
+        Timed session.query().
+        '''
+        return self._timed(message, self.session.query, message, *args, **kwargs)
+
+    def read(self, *args, **kwargs):
+        '''
+        Timed session.read().
+        '''
+        return self._timed('<read>', self.session.read, *args, **kwargs)
+
+    def read_raw(self, *args, **kwargs):
+        '''
+        Timed session.read_raw().
+        '''
+        return self._timed('<read_raw>', self.session.read_raw, *args, **kwargs)
+
+    def query_binary_values(self, message, *args, **kwargs):
+        '''
+        Timed session.query_binary_values().
+        '''
+        return self._timed(message, self.session.query_binary_values, message, *args, **kwargs)
+
+    def queryMany(self, messages):
+        '''
+        Timed pipelined queries; falls back to one query per message.
+        '''
+        if hasattr(self.session, 'queryMany'):
+            return self._timed(';'.join(messages), self.session.queryMany, messages)
+        return [self.query(m) for m in messages]
+
+    def assert_trigger(self):
+        '''
+        Timed session.assert_trigger().
+        '''
+        return self._timed('<trigger>', self.session.assert_trigger)
+
+
+def responseSize(response):
+    '''
+    Approximate size in bytes of a transaction result.
+    '''
+    if isinstance(response, (str, bytes, bytearray)):
+        return len(response)
+    if isinstance(response, np.ndarray):
+        return response.nbytes
+    if isinstance(response, (list, tuple)):
+        return sum(responseSize(r) if isinstance(r, (str, bytes)) else 8 for r in response)
+    return 0
+
+
+def formatDuration(seconds):
+    '''
+    Formats a duration as hours, minutes and seconds.
+    '''
+    seconds = int(round(seconds))
+    return '{} hours, {} minutes, and {} seconds'.format(seconds // 3600, (seconds % 3600) // 60, seconds % 60)
+
+
+class EtaEstimator:
+    '''
+    Predicts the completion time of a run made of similar iterations (e.g. the bias points of a sweep).
+
+    Before the first iteration completes the prediction uses the expected
+    iteration time (e.g. from the PNA sweep time and the configured delays).
+    After that it uses an exponentially weighted average of the measured
+    iteration times, so per-iteration overheads are included automatically.
+
+    Parameters:
+    -----------
+    nTotal : int
+        Number of iterations in the run.
+    predicted : float
+        Expected time of one iteration in seconds, if known.
+    weight : float
+        Weight of the latest iteration in the running average.
+    '''
+
+    def __init__(self, nTotal, predicted = None, weight = 0.3):
+        self.nTotal = nTotal
+        self.predicted = predicted
+        self.weight = weight
+        self.nDone = 0
+        self.average = None
+        self.start = time.time()
+        self.last = self.start
+
+    def done(self, n = 1):
+        '''
+        Records the completion of n iterations since the last call.
+
+        Parameters:
+        -----------
+        n : int
+            Number of iterations completed.
+
+        Returns:
+        ----------
+        N/A
+        '''
+        now = time.time()
+        t = (now - self.last) / n
+        self.last = now
+        self.nDone += n
+        self.average = t if self.average is None else self.weight*t + (1 - self.weight)*self.average
+
+    def perIteration(self):
+        '''
+        Returns the expected time of one iteration in seconds (None if unknown).
+        '''
+        return self.average if self.average is not None else self.predicted
+
+    def remaining(self):
+        '''
+        Returns the expected remaining time in seconds (None if unknown).
+        '''
+        per = self.perIteration()
+        return None if per is None else max(self.nTotal - self.nDone, 0) * per
+
+    def eta(self):
+        '''
+        Returns the expected completion time as seconds since the epoch (None if unknown).
+        '''
+        remaining = self.remaining()
+        return None if remaining is None else time.time() + remaining
+
+    def report(self):
+        '''
+        Returns a one line progress report.
+        '''
+        if self.remaining() is None:
+            return '{}/{} complete.'.format(self.nDone, self.nTotal)
+        return '{}/{} complete, {:.1f} s each. {} remaining, estimated completion: {}.'.format(
+               self.nDone, self.nTotal, self.perIteration(), formatDuration(self.remaining()),
+               time.asctime(time.localtime(self.eta())))
@@ -0,0 +1,197 @@
+#refine.py
+'''
+Adaptive refinement of bias grids.
+
+Measuring every point of a grid of SMU voltages costs one PNA sweep per
+point, and the number of points grows with the product of the voltage list
+lengths. A GridRefiner starts from a coarse subset of the grid and then only
+adds points between neighbouring measured points whose figure of merit
+differs by more than a tolerance, until nothing is left to refine or the
+sweep budget is used up.
+
+Figures of merit are functions fom(sweep, readings) of the PNA sweep, (freq, s)
+as returned by AgilentPNAx.sMeas() with fetch set, and the SMU readings at the
+point (one formatData() result per SMU). smuCurrent() and admittance() build
+common ones.
+'''
+
+import numpy as np
+
+class GridRefiner:
+    '''
+    Chooses which points of a bias grid to measure.
+
+        refiner = GridRefiner(plan.shape, coarseStep = 4, tolerance = 0.05, budget = 60)
+        batch = refiner.coarse()
+        while batch:
+            for index in batch:
+                refiner.add(index, fom(...))
+            batch = refiner.next()
+
+    Parameters:
+    -----------
+    shape : tuple
+        Number of voltages of each SMU (BiasPlan.shape).
+    coarseStep : int
+        Spacing, in grid points, of the initial coarse grid. The first and last
+        voltage of each SMU are always included.
+    tolerance : float
+        Largest change of the figure of merit between neighbouring measured points,
+        as a fraction of its range over all measured points, that is not refined.
+    budget : int
+        Most points measured in total. Unlimited if None.
+    '''
+
+    def __init__(self, shape, coarseStep = 4, tolerance = 0.05, budget = None):
+        self.shape = tuple(shape)
+        self.coarseStep = max(int(coarseStep), 1)
+        self.tolerance = tolerance
+        self.budget = budget
+        self.values = {} # grid index tuple -> figure of merit
+
+    def coarse(self):
+        '''
+        Returns the grid indices of the coarse grid in raster order (first SMU fastest).
+        '''
+        axes = [np.unique(np.r_[np.arange(0, n, self.coarseStep), n - 1]) for n in self.shape]
+        points = [tuple(int(i) for i in p) for p in np.stack(np.meshgrid(*axes, indexing = 'ij'), axis = -1).reshape(-1, len(self.shape))]
+        return self.limit(sorted(points, key = lambda p : p[::-1]))
+
+    def add(self, index, value):
+        '''
+        Records the figure of merit of a measured point.
+
+        Parameters:
+        -----------
+        index : tuple
+            Grid indices of the point, one per SMU.
+        value : float
+            The figure of merit.
+
+        Returns:
+        ----------
+        N/A
+        '''
+        self.values[tuple(int(i) for i in index)] = float(value)
+
+    def remaining(self):
+        '''
+        Returns the number of points left in the budget (None if unlimited).
+        '''
+        return None if self.budget is None else max(self.budget - len(self.values), 0)
+
+    def limit(self, points):
+        '''
+        Truncates a list of points to the remaining budget.
+        '''
+        n = self.remaining()
+        return points if n is None else points[:n]
+
+    def candidates(self):
+        '''
+        Finds the points that split neighbouring measured points with too different figures of merit.
+
+        Neighbours are consecutive measured points along one SMU's axis with all
+        other indices equal. The midpoint between them is a candidate if they
+        are not adjacent in the grid and their figures of merit differ by more
+        than tolerance times the range of all measured values.
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        candidates : list
+            Grid index tuples, largest change first.
+        '''
+        if len(self.values) < 2:
+            return []
+        values = np.array(list(self.values.values()))
+        span = np.ptp(values)
+        if span == 0 or not np.isfinite(span):
+            return []
+        priority = {}
+        for axis in range(len(self.shape)):
+            lines = {}
+            for p in self.values:
+                lines.setdefault(p[:axis] + p[axis+1:], []).append(p[axis])
+            for rest, coords in lines.items():
+                coords.sort()
+                for a, b in zip(coords[:-1], coords[1:]):
+                    if b - a < 2:
+                        continue
+                    pa = rest[:axis] + (a,) + rest[axis:]
+                    pb = rest[:axis] + (b,) + rest[axis:]
+                    change = abs(self.values[pa] - self.values[pb])/span
+                    if change > self.tolerance:
+                        mid = rest[:axis] + ((a + b)//2,) + rest[axis:]
+                        priority[mid] = max(priority.get(mid, 0), change)
+        return sorted(priority, key = lambda p : -priority[p])
+
+    def next(self):
+        '''
+        Returns the next batch of points to measure, in raster order. Empty when
+        the grid has converged or the budget is used up.
+        '''
+        return sorted(self.limit(self.candidates()), key = lambda p : p[::-1])
+
+    def converged(self):
+        '''
+        Returns True if no measured neighbours differ by more than the tolerance.
+        '''
+        return not self.candidates()
+
+
+def smuCurrent(smu):
+    '''
+    Figure of merit: mean current of one SMU at the bias point.
+
+    Parameters:
+    -----------
+    smu : int
+        Position of the SMU in the measurement's list of SMUs.
+
+    Returns:
+    ----------
+    fom : function
+        fom(sweep, readings) returning the current in amps.
+    '''
+    def fom(sweep, readings):
+        return float(np.mean(readings[smu][1]))
+    return fom
+
+def admittance(frequency, i = 1, j = 0, z0 = 50):
+    '''
+    Figure of merit: |Yij - Yji| at one frequency, e.g. |Y21 - Y12| of a transistor.
+
+    Needs the S-parameters on the PC (fetch set on the measurement).
+
+    Parameters:
+    -----------
+    frequency : float
+        Frequency in Hz; the nearest measured frequency is used.
+    i, j : int
+        Positions of the two ports in sPorts, starting at 0.
+    z0 : float
+        Reference impedance in ohms.
+
+    Returns:
+    ----------
+    fom : function
+        fom(sweep, readings) returning |Yij - Yji| in siemens.
+
+    Raises
+    ------
+    ValueError
+        The sweep was not transferred to the PC.
+    '''
+    def fom(sweep, readings):
+        if sweep is None:
+            raise ValueError('The admittance figure of merit needs the S-parameters, set fetch = True.')
+        freq, s = sweep
+        k = int(np.argmin(np.abs(freq - frequency)))
+        unity = np.eye(s.shape[1])
+        y = (unity - s[k]) @ np.linalg.inv(unity + s[k])/z0
+        return float(abs(y[i,j] - y[j,i]))
+    return fom
@@ -0,0 +1,187 @@
+#scheduler.py
+'''
+Fixed-cadence scheduling of repeated measurements.
+
+Sleeping for the interval after each measurement makes the real period
+interval + measurement time, so the schedule drifts. A CadenceScheduler
+instead starts run k at the deadline start + k*interval of the monotonic
+clock, which neither the duration of the runs nor changes of the wall clock
+shift. The lateness of every start (the jitter) is recorded. A run that
+overruns the next deadline is handled by the policy:
+
+    'skip' : missed deadlines are dropped and the next run waits for the
+             next deadline still ahead, so runs stay on the cadence grid.
+    'catchUp' : missed runs start immediately one after the other until the
+             schedule is met again, so every run happens.
+'''
+
+import time
+import threading
+import numpy as np
+
+class CadenceScheduler:
+    '''
+    Calls a function at fixed intervals of a monotonic clock.
+
+        scheduler = CadenceScheduler(900, 144)
+        scheduler.run(lambda k : meas.measure())
+
+    Parameters:
+    -----------
+    interval : float
+        Time in seconds between the deadlines of consecutive runs.
+    count : int
+        Number of deadlines. With policy 'skip' fewer runs happen if runs overrun.
+    policy : str
+        'skip' or 'catchUp', see module description.
+    clock : callable
+        Monotonic time source in seconds.
+
+    Raises
+    ------
+    ValueError
+        Unknown policy.
+    '''
+
+    policies = ['skip', 'catchUp']
+
+    def __init__(self, interval, count, policy = 'skip', clock = time.monotonic):
+        if policy not in self.policies:
+            raise ValueError('Unknown overrun policy \'{}\'. Use one of {}.'.format(policy, self.policies))
+        self.interval = interval
+        self.count = count
+        self.policy = policy
+        self.clock = clock
+        self.start = None # clock time of the first deadline
+        self.runs = [] # deadline number of every run
+        self.jitter = [] # s, start of every run after its deadline
+        self.skipped = [] # deadline numbers dropped by the 'skip' policy
+        self.stopEvent = threading.Event()
+        self.thread = None
+        self.error = None
+
+    def deadline(self, k):
+        '''
+        Returns the clock time at which run k is due.
+        '''
+        return self.start + k*self.interval
+
+    def endTime(self, runTime = 0):
+        '''
+        Returns the wall-clock time (time.time()) at which the schedule is expected to finish.
+
+        Parameters:
+        -----------
+        runTime : float
+            Expected duration of one run in seconds.
+
+        Returns:
+        ----------
+        end : float
+            Seconds since the epoch.
+        '''
+        start = self.clock() if self.start is None else self.start
+        return time.time() + start - self.clock() + (self.count - 1)*self.interval + runTime
+
+    def run(self, func):
+        '''
+        Runs func(k) at every deadline k, blocking until the schedule ends or stop() is called.
+
+        Parameters:
+        -----------
+        func : callable
+            Called with the deadline number, from 0 to count - 1.
+
+        Returns:
+        ----------
+        N/A
+        '''
+        self.start = self.clock()
+        k = 0
+        while k < self.count and not self.stopEvent.is_set():
+            remaining = self.deadline(k) - self.clock()
+            if remaining > 0 and self.stopEvent.wait(remaining):
+                break
+            self.runs.append(k)
+            self.jitter.append(self.clock() - self.deadline(k))
+            func(k)
+            k += 1
+            if self.policy == 'skip' and self.clock() > self.deadline(k):
+                ahead = min(int((self.clock() - self.start)//self.interval) + 1, self.count)
+                self.skipped += list(range(k, ahead))
+                k = ahead
+
+    def startThread(self, func, finished = None):
+        '''
+        Runs the schedule (see run()) in a daemon thread and returns immediately.
+
+        Parameters:
+        -----------
+        func : callable
+            See run().
+        finished : callable
+            Called without arguments in the thread when the schedule ends, also after an error.
+
+        Returns:
+        ----------
+        thread : threading.Thread
+            The thread; see join() and stop().
+        '''
+        def target():
+            try:
+                self.run(func)
+            except Exception as e:
+                self.error = e
+                print('Scheduled run failed: {}'.format(e))
+            finally:
+                if finished is not None:
+                    finished()
+        self.thread = threading.Thread(target = target, name = 'pymeasrf cadence', daemon = True)
+        self.thread.start()
+        return self.thread
+
+    def join(self, timeout = None):
+        '''
+        Waits for the thread started with startThread() and raises its exception, if any.
+
+        Parameters:
+        -----------
+        timeout : float
+            Longest wait in seconds. Waits until the schedule ends if None.
+
+        Returns:
+        ----------
+        running : bool
+            True if the schedule is still running after timeout.
+        '''
+        if self.thread is not None:
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                return True
+        if self.error is not None:
+            raise self.error
+        return False
+
+    def stop(self):
+        '''
+        Ends the schedule after the current run. The wait for the next deadline ends at once.
+        '''
+        self.stopEvent.set()
+
+    def report(self):
+        '''
+        Summarizes the schedule so far.
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        report : str
+            Number of runs and skipped deadlines, and the mean and largest start jitter.
+        '''
+        if not self.jitter:
+            return 'No runs yet.'
+        return '{} runs, {} deadlines skipped. Start jitter: mean {:.1f} ms, max {:.1f} ms.'.format(
+               len(self.runs), len(self.skipped), 1e3*np.mean(self.jitter), 1e3*np.max(self.jitter))
@@ -0,0 +1,246 @@
+#scpiBatch.py
+'''
+Coalesces consecutive SCPI writes into semicolon separated compound messages.
+
+Each VISA write is one bus transaction. Setup methods that send a dozen
+settings one after another spend most of their time in per-transaction
+overhead, so ScpiBatch collects the writes and sends them together.
+'''
+
+import warnings
+
+class ScpiBatch:
+    '''
+    Context manager that batches the SCPI writes of a driver.
+
+    While the batch is active the driver's visaobj is replaced by the batch,
+    so any driver method called inside the block is batched as well. Writes
+    are queued and joined into compound messages; a query flushes the queue
+    first so command order is preserved. Attributes that are not part of the
+    batch (timeout, read_termination, ...) are passed through to the session.
+
+    Each command is made absolute (prefixed with ':') so that it does not
+    inherit the header path of the previous command in the compound message.
+
+        with ScpiBatch(pna) as b:
+            b.write('SENSe1:SWEep:POINts 201')
+            b.write('SENSe1:BANDwidth 1000')
+
+    Batches may be nested; inner batches share the queue of the outermost one.
+    If the block raises, the queued commands are discarded (see discard()).
+
+    Parameters:
+    -----------
+    target : driver or session
+        A driver with a visaobj attribute, or a VISA session.
+    checkErrors : bool
+        Read the instrument error queue once when the batch exits and issue a
+        warning for every error found. Defaults to the driver's checkErrors
+        attribute, or False.
+    maxLength : int
+        Maximum length in characters of one compound message.
+    errorQuery : str
+        Query used to read the error queue.
+    '''
+
+    _own = ['target', 'session', 'driver', 'queue', 'checkErrors', 'maxLength',
+            'errorQuery', 'nested', 'nCommands', 'nMessages', 'errors']
+
+    def __init__(self, target, checkErrors = None, maxLength = 1024, errorQuery = 'SYSTem:ERRor?'):
+        if hasattr(target, 'visaobj'):
+            driver = target
+            session = target.visaobj
+        else:
+            driver = None
+            session = target
+        if checkErrors is None:
+            checkErrors = getattr(driver, 'checkErrors', False)
+        object.__setattr__(self, 'target', target)
+        object.__setattr__(self, 'driver', driver)
+        object.__setattr__(self, 'session', session)
+        object.__setattr__(self, 'nested', isinstance(session, ScpiBatch))
+        object.__setattr__(self, 'queue', [])
+        object.__setattr__(self, 'checkErrors', checkErrors)
+        object.__setattr__(self, 'maxLength', maxLength)
+        object.__setattr__(self, 'errorQuery', errorQuery)
+        object.__setattr__(self, 'nCommands', 0)
+        object.__setattr__(self, 'nMessages', 0)
+        object.__setattr__(self, 'errors', [])
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def __setattr__(self, name, value):
+        if name in self._own:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.session, name, value)
+
+    def __enter__(self):
+        if self.nested:
+            return self.session
+        if self.driver is not None:
+            self.driver.visaobj = self
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        if self.nested:
+            return False
+        try:
+            if excType is None:
+                try:
+                    self.flush()
+                except Exception:
+                    self.discard()
+                    raise
+                if self.checkErrors:
+                    self.checkErrorQueue()
+            else:
+                self.discard()
+        finally:
+            if self.driver is not None:
+                self.driver.visaobj = self.session
+        return False
+
+    def write(self, command):
+        '''
+        Queues a command. Queries are not queued: pending commands are flushed and the query is written on its own.
+
+        Parameters:
+        -----------
+        command : str
+            The SCPI command.
+
+        Returns:
+        ----------
+        N/A
+        '''
+        if '?' in command:
+            self.flush()
+            self.session.write(command)
+            return
+        command = command.strip()
+        if not command.startswith((':', '*')):
+            command = ':' + command
+        self.queue.append(command)
+        self.nCommands += 1
+
+    def query(self, command, *args, **kwargs):
+        '''
+        Flushes pending commands and performs a query.
+
+        Parameters:
+        -----------
+        command : str
+            The SCPI query.
+
+        Returns:
+        ----------
+        response : str
+            The instrument response.
+        '''
+        self.flush()
+        return self.session.query(command, *args, **kwargs)
+
+    def queryMany(self, commands):
+        '''
+        Flushes pending commands and performs several queries.
+        
+        Sessions that support pipelining (ScpiSocket) send all queries before
+        reading the responses; other sessions query one after another.
+
+        Parameters:
+        -----------
+        commands : list
+            The SCPI queries.
+
+        Returns:
+        ----------
+        responses : list
+            The responses, in the order of the queries.
+        '''
+        self.flush()
+        if hasattr(self.session, 'queryMany'):
+            return self.session.queryMany(commands)
+        return [self.session.query(c) for c in commands]
+
+    def read(self, *args, **kwargs):
+        '''
+        Flushes pending commands and reads a response from the session.
+        '''
+        self.flush()
+        return self.session.read(*args, **kwargs)
+
+    def query_binary_values(self, command, *args, **kwargs):
+        '''
+        Flushes pending commands and performs a binary block query.
+        '''
+        self.flush()
+        return self.session.query_binary_values(command, *args, **kwargs)
+
+    def flush(self):
+        '''
+        Sends all queued commands as the smallest number of compound messages allowed by maxLength.
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        N/A
+        '''
+        message = ''
+        for command in self.queue:
+            if message and len(message) + len(command) + 1 > self.maxLength:
+                self.session.write(message)
+                self.nMessages += 1
+                message = ''
+            message = command if not message else message + ';' + command
+        if message:
+            self.session.write(message)
+            self.nMessages += 1
+        self.queue.clear()
+
+    def discard(self):
+        '''
+        Drops the queued commands without sending them.
+
+        The driver's cached settings (see Instrument.cachedWrite()) are forgotten,
+        since some of them were recorded for commands that never reached the instrument.
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        N/A
+        '''
+        if self.queue and hasattr(self.driver, 'invalidateCache'):
+            self.driver.invalidateCache()
+        self.queue.clear()
+
+    def checkErrorQueue(self, maxErrors = 20):
+        '''
+        Reads the instrument error queue until it is empty and warns for each error.
+
+        Parameters:
+        -----------
+        maxErrors : int
+            Maximum number of errors to read.
+
+        Returns:
+        ----------
+        errors : list
+            The error strings read from the instrument.
+        '''
+        errors = []
+        for i in range(maxErrors):
+            err = self.session.query(self.errorQuery).strip()
+            if err.startswith(('+0', '0')):
+                break
+            errors.append(err)
+            warnings.warn('Instrument error during SCPI batch: {}'.format(err))
+        self.errors.extend(errors)
+        return errors
@@ -0,0 +1,322 @@
+#scpiSocket.py
+'''
+Raw TCP socket transport for SCPI instruments (TCPIP::host::port::SOCKET resources).
+
+Instruments such as the PNA-X accept SCPI on a raw socket (port 5025). Each
+message must end with a single linefeed and each response ends with one,
+so with correct termination and response framing no delay between write
+and read is needed. ScpiSocket implements the subset of the pyvisa
+resource interface used by the drivers and can pipeline queries: several
+queries are sent in one packet and their responses are read in order.
+
+Binary responses must be definite length blocks (#<n><length><data>). A raw
+socket has no END indicator, so the end of an indefinite length block (#0)
+cannot be told from a linefeed byte inside the binary data; such blocks are
+rejected.
+'''
+
+import re
+import socket
+import numpy as np
+import visa
+from pyvisa import constants
+
+socketRegex = re.compile(r'TCPIP\d*::([^:]+)::(\d+)::SOCKET', re.IGNORECASE)
+
+def parseSocketResource(resource):
+    '''
+    Extracts the host and port from a VISA SOCKET resource string.
+
+    Parameters:
+    -----------
+    resource : str
+        A VISA address such as 'TCPIP0::192.168.1.1::5025::SOCKET'.
+
+    Returns:
+    ----------
+    address : tuple or None
+        (host, port), or None if the resource is not a SOCKET resource.
+    '''
+    m = socketRegex.fullmatch(resource.strip())
+    if m is None:
+        return None
+    return m.group(1), int(m.group(2))
+
+
+class ScpiSocket:
+    '''
+    A SCPI session over a raw TCP socket with pyvisa-compatible methods.
+
+    Parameters:
+    -----------
+    host : str
+        Hostname or IP address of the instrument.
+    port : int
+        SCPI socket port. 5025 on Keysight instruments.
+    timeout : int
+        I/O timeout in milliseconds.
+    resource : str
+        The VISA resource string the session was opened for.
+    '''
+
+    def __init__(self, host, port = 5025, timeout = 2000, resource = None):
+        self.host = host
+        self.port = port
+        self.resource_name = resource or 'TCPIP0::{}::{}::SOCKET'.format(host,port)
+        self.read_termination = '\n'
+        self.write_termination = '\n'
+        self.query_delay = 0
+        self.encoding = 'ascii'
+        self.chunk_size = 65536
+        self._buffer = bytearray()
+        self._sock = socket.create_connection((host, port), timeout = timeout/1000)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.timeout = timeout
+
+    @classmethod
+    def fromResource(cls, resource, **kwargs):
+        '''
+        Opens a socket session for a VISA SOCKET resource string.
+
+        Parameters:
+        -----------
+        resource : str
+            A VISA address such as 'TCPIP0::192.168.1.1::5025::SOCKET'.
+
+        Returns:
+        ----------
+        session : ScpiSocket
+            The open session.
+
+        Raises
+        ------
+        ValueError
+            The resource is not a SOCKET resource.
+        visa.VisaIOError
+            The instrument could not be reached.
+        '''
+        address = parseSocketResource(resource)
+        if address is None:
+            raise ValueError('\'{}\' is not a SOCKET resource.'.format(resource))
+        try:
+            return cls(address[0], address[1], resource = resource, **kwargs)
+        except OSError:
+            raise visa.VisaIOError(constants.StatusCode.error_resource_not_found)
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self._timeout = value
+        self._sock.settimeout(None if value is None else value/1000)
+
+    @property
+    def session(self):
+        # mirrors pyvisa: accessing the session of a closed resource raises
+        if self._sock is None:
+            raise visa.InvalidSession()
+        return self._sock.fileno()
+
+    def close(self):
+        '''
+        Closes the socket.
+        '''
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def clear(self):
+        '''
+        Discards any unread response data.
+        '''
+        self._buffer.clear()
+        self._sock.setblocking(False)
+        try:
+            while self._sock.recv(self.chunk_size):
+                pass
+        except (BlockingIOError, socket.error):
+            pass
+        finally:
+            self.timeout = self._timeout
+
+    def write_raw(self, message):
+        '''
+        Sends bytes to the instrument without adding a termination.
+        '''
+        try:
+            self._sock.sendall(message)
+        except socket.timeout:
+            raise visa.VisaIOError(constants.StatusCode.error_timeout)
+        return len(message)
+
+    def write(self, message):
+        '''
+        Sends a message, adding the write termination if it is missing.
+
+        Parameters:
+        -----------
+        message : str
+            The SCPI command.
+
+        Returns:
+        ----------
+        count : int
+            Number of bytes written.
+        '''
+        if not message.endswith(self.write_termination):
+            message += self.write_termination
+        return self.write_raw(message.encode(self.encoding))
+
+    def _fill(self):
+        try:
+            chunk = self._sock.recv(self.chunk_size)
+        except socket.timeout:
+            raise visa.VisaIOError(constants.StatusCode.error_timeout)
+        if not chunk:
+            raise visa.VisaIOError(constants.StatusCode.error_connection_lost)
+        self._buffer.extend(chunk)
+
+    def _readExactly(self, size):
+        while len(self._buffer) < size:
+            self._fill()
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def _readLine(self):
+        term = self.read_termination.encode(self.encoding)
+        while True:
+            i = self._buffer.find(term)
+            if i >= 0:
+                data = bytes(self._buffer[:i])
+                del self._buffer[:i+len(term)]
+                return data
+            self._fill()
+
+    def read_raw(self, size = None):
+        '''
+        Reads one terminated response (or exactly size bytes) as bytes, without the termination.
+        '''
+        if size is not None:
+            return self._readExactly(size)
+        return self._readLine()
+
+    def read(self):
+        '''
+        Reads one response.
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        response : str
+            The response with the read termination removed.
+        '''
+        return self._readLine().decode(self.encoding)
+
+    def query(self, message, delay = None):
+        '''
+        Writes a query and reads the response.
+
+        Parameters:
+        -----------
+        message : str
+            The SCPI query.
+        delay : float
+            Ignored; kept for compatibility with pyvisa.
+
+        Returns:
+        ----------
+        response : str
+            The instrument response.
+        '''
+        self.write(message)
+        return self.read()
+
+    def queryMany(self, messages):
+        '''
+        Pipelines several queries: all are sent in one packet before any response is read.
+
+        Parameters:
+        -----------
+        messages : list
+            The SCPI queries. Each must produce exactly one response.
+
+        Returns:
+        ----------
+        responses : list
+            The responses, in the order of the queries.
+        '''
+        term = self.write_termination
+        payload = ''.join(m if m.endswith(term) else m + term for m in messages)
+        self.write_raw(payload.encode(self.encoding))
+        return [self.read() for m in messages]
+
+    def read_binary_values(self, datatype = 'f', is_big_endian = False, container = list,
+                           header_fmt = 'ieee', expect_termination = True):
+        '''
+        Reads an IEEE 488.2 definite length binary block.
+
+        Parameters:
+        -----------
+        datatype : str
+            struct format character of the values ('f' float32, 'd' float64, ...).
+        is_big_endian : bool
+            Byte order of the values.
+        container : callable
+            Type of the returned sequence (e.g. list or np.array).
+        expect_termination : bool
+            Read and discard the termination that follows the block.
+
+        Returns:
+        ----------
+        values : sequence
+            The decoded values.
+
+        Raises
+        ------
+        ValueError
+            The instrument sent an indefinite length block (#0), see module description.
+        '''
+        # discard anything preceding the block header
+        while b'#' not in self._buffer:
+            self._buffer.clear()
+            self._fill()
+        del self._buffer[:self._buffer.find(b'#')]
+        nDigits = int(self._readExactly(2)[1:])
+        if nDigits == 0:
+            # the rest of the block is unread, drop it so the next response starts clean
+            self.clear()
+            raise ValueError('Indefinite length binary blocks (#0) cannot be framed on a raw socket. '
+                             'Use a definite length format or a VISA session.')
+        length = int(self._readExactly(nDigits))
+        block = self._readExactly(length)
+        if expect_termination:
+            self._readLine()
+        dtype = np.dtype(datatype).newbyteorder('>' if is_big_endian else '<')
+        values = np.frombuffer(block, dtype = dtype).astype(np.dtype(datatype))
+        return container(values)
+
+    def query_binary_values(self, message, datatype = 'f', is_big_endian = False, container = list,
+                            delay = None, header_fmt = 'ieee', expect_termination = True):
+        '''
+        Writes a query and reads a binary block response. See read_binary_values().
+        '''
+        self.write(message)
+        return self.read_binary_values(datatype, is_big_endian, container, header_fmt, expect_termination)
+
+    def assert_trigger(self):
+        '''
+        Sends a software trigger (*TRG).
+        '''
+        self.write('*TRG')
+
+    def control_ren(self, mode):
+        '''
+        Remote enable has no meaning on a raw socket; kept for compatibility with GPIB/VXI-11 sessions.
+        '''
+        pass
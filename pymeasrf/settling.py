@@ -0,0 +1,161 @@
+#settling.py
+'''
+Adaptive settling after a bias change.
+
+Instead of always waiting the worst-case delay, a Settler polls the SMU
+currents and returns as soon as they have settled. Two criteria are available:
+
+    'relative' : the change between consecutive readings is below
+                 rtol*|I| + atol for every SMU, twice in a row.
+    'exponential' : an exponential I(t) = Iinf + A*exp(-t/tau) is fitted to
+                 the last three readings; the SMU is settled when the remaining
+                 distance to Iinf is below rtol*|Iinf| + atol.
+
+The configured delay stays the upper bound: the wait ends after maxDelay
+seconds whether or not the currents have settled.
+'''
+
+import time
+import numpy as np
+
+class Settler:
+    '''
+    Waits for SMU currents to settle.
+
+    Parameters:
+    -----------
+    smus : list
+        The SMUs to poll (see Keithley2400.readCurrent()).
+    maxDelay : float
+        Longest wait in seconds.
+    method : str
+        'relative' or 'exponential', see module description.
+    interval : float
+        Time in seconds between polls.
+    rtol : float
+        Relative tolerance of the current.
+    atol : float
+        Absolute tolerance of the current in amps, for currents close to zero.
+    group : SmuGroup
+        Group used to read the SMUs concurrently. The SMUs are read one after
+        the other if None.
+
+    Raises
+    ------
+    ValueError
+        Unknown method.
+    '''
+
+    methods = ['relative', 'exponential']
+
+    def __init__(self, smus, maxDelay, method = 'relative', interval = 0.2, rtol = 1e-3, atol = 1e-9, group = None):
+        if method not in self.methods:
+            raise ValueError('Unknown settling method \'{}\'. Use one of {}.'.format(method, self.methods))
+        self.smus = smus
+        self.maxDelay = maxDelay
+        self.method = method
+        self.interval = interval
+        self.rtol = rtol
+        self.atol = atol
+        self.group = group
+        self.settleTimes = [] # s, for every wait()
+        self.settled = [] # False where a wait() ran into maxDelay
+
+    def readCurrents(self):
+        '''
+        Returns one current reading per SMU in amps.
+        '''
+        if self.group is not None:
+            return np.array(self.group.map(lambda smu : smu.readCurrent()))
+        return np.array([smu.readCurrent() for smu in self.smus])
+
+    def isSettled(self, times, currents):
+        '''
+        Applies the settling criterion to the readings taken so far.
+
+        Parameters:
+        -----------
+        times : list
+            Times of the readings in seconds.
+        currents : list
+            Readings, one array with a current per SMU for each time.
+
+        Returns:
+        ----------
+        settled : bool
+            True if every SMU has settled.
+        '''
+        if len(currents) < 3:
+            return False
+        x0, x1, x2 = np.asarray(currents[-3:])
+        if self.method == 'relative':
+            tol = self.rtol*np.abs(x2) + self.atol
+            return bool(np.all(np.abs(x2 - x1) <= tol) and np.all(np.abs(x1 - x0) <= tol))
+        # exponential: the step ratio of equally spaced readings is exp(-dt/tau)
+        d1, d2 = x1 - x0, x2 - x1
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            # equal readings followed by a step say nothing about the decay
+            r = np.where(d1 != 0, d2/d1, np.inf)
+            decaying = (r >= 0) & (r < 1)
+            remaining = np.where(decaying, np.abs(d2*r/(1 - r)), np.inf)
+            final = x2 + np.where(decaying, d2*r/(1 - r), 0)
+        # readings that do not change are settled too
+        remaining = np.where(np.abs(d2) <= self.atol, 0, remaining)
+        return bool(np.all(remaining <= self.rtol*np.abs(final) + self.atol))
+
+    def wait(self):
+        '''
+        Polls the SMUs until their currents settle or maxDelay has passed.
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        elapsed : float
+            Time waited in seconds.
+        '''
+        t0 = time.perf_counter()
+        times, currents = [], []
+        settled = False
+        while True:
+            currents.append(self.readCurrents())
+            times.append(time.perf_counter() - t0)
+            if self.isSettled(times, currents):
+                settled = True
+                break
+            remaining = self.maxDelay - (time.perf_counter() - t0)
+            if remaining <= 0:
+                break
+            time.sleep(min(self.interval, remaining))
+        elapsed = time.perf_counter() - t0
+        self.settleTimes.append(elapsed)
+        self.settled.append(settled)
+        return elapsed
+
+    def report(self):
+        '''
+        Describes the last wait().
+        '''
+        if not self.settleTimes:
+            return 'No settling recorded.'
+        if self.settled[-1]:
+            return 'Settled after {:.2f} s.'.format(self.settleTimes[-1])
+        return 'Not settled within {} s.'.format(self.maxDelay)
+
+    def save(self, filename):
+        '''
+        Saves the settle time of every wait() in a csv file.
+
+        Parameters:
+        -----------
+        filename : str
+            The output file (including path).
+
+        Returns:
+        ----------
+        N/A
+        '''
+        np.savetxt(filename, np.transpose([np.arange(1, len(self.settleTimes) + 1), self.settleTimes, self.settled]),
+                   delimiter = ',', header = 'point,settle time (s),settled', comments = '')
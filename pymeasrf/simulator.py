@@ -0,0 +1,402 @@
+#simulator.py
+'''
+Record/replay simulation of instrument sessions.
+
+A RecordingSession wraps a real session and appends every transaction
+(command, response and duration) to a Transcript, which can be saved as
+JSON. A SimulatedSession plays a transcript back without any hardware: each
+query returns the response recorded for the same command, and each
+transaction takes the recorded time (or a configured latency).
+
+Both are installed through the shared session pool, so the drivers run
+against them unchanged:
+
+    visaPool.pool.startRecording()
+    ... run a measurement on the real instruments ...
+    visaPool.pool.stopRecording('sweep.json')
+
+    visaPool.pool.simulate(simulator.Transcript.load('sweep.json'))
+    ... run the same measurement on any PC ...
+
+Setting the environment variable PYMEASRF_REPLAY to a transcript file
+replays it for every session opened in that process.
+'''
+
+import base64
+import json
+import threading
+import time
+import numpy as np
+import visa
+from pyvisa import constants
+from pymeasrf.profiling import commandHeader
+
+class Transcript:
+    '''
+    The recorded transactions of one or more instruments, keyed by resource string.
+
+    Each transaction is a dict with the operation ('write', 'query', 'read',
+    'read_raw', 'query_binary_values' or 'trigger'), the command, the response,
+    the duration in seconds and, if the transaction failed, the error code.
+    '''
+
+    def __init__(self, resources = None):
+        self.resources = resources if resources is not None else {}
+        self.lock = threading.Lock()
+
+    def add(self, resource, op, command, response = None, duration = 0.0, error = None):
+        '''
+        Appends one transaction.
+
+        Parameters:
+        -----------
+        resource : str
+            The VISA address of the instrument.
+        op : str
+            The session method used.
+        command : str
+            The SCPI message sent ('' for reads).
+        response : str, bytes or array-like
+            The value returned by the session.
+        duration : float
+            Transaction time in seconds.
+        error : int
+            VISA status code if the transaction raised a VisaIOError.
+
+        Returns:
+        ----------
+        N/A
+        '''
+        entry = {'op' : op, 'command' : command, 'duration' : duration}
+        if isinstance(response, (bytes, bytearray)):
+            entry['raw'] = base64.b64encode(bytes(response)).decode('ascii')
+        elif response is not None and not isinstance(response, str):
+            entry['values'] = np.asarray(response).tolist()
+        elif response is not None:
+            entry['response'] = response
+        if error is not None:
+            entry['error'] = int(error)
+        with self.lock:
+            self.resources.setdefault(resource, []).append(entry)
+
+    def save(self, filename):
+        '''
+        Writes the transcript to a JSON file.
+
+        Parameters:
+        -----------
+        filename : str
+            The output file (including path).
+
+        Returns:
+        ----------
+        N/A
+        '''
+        with self.lock:
+            with open(filename, 'w') as f:
+                json.dump({'version' : 1, 'resources' : self.resources}, f, indent = 1)
+
+    @classmethod
+    def load(cls, filename):
+        '''
+        Reads a transcript written by save().
+
+        Parameters:
+        -----------
+        filename : str
+            The transcript file (including path).
+
+        Returns:
+        ----------
+        transcript : Transcript
+            The loaded transcript.
+        '''
+        with open(filename) as f:
+            return cls(json.load(f)['resources'])
+
+
+class RecordingSession:
+    '''
+    Wraps a real session and records every transaction in a Transcript.
+
+    Attributes that are not transactions (timeout, terminations, ...) are
+    read from and written to the wrapped session.
+
+    Parameters:
+    -----------
+    session : pyvisa Resource
+        The session to record.
+    resource : str
+        The VISA address the session was opened for.
+    transcript : Transcript
+        Where the transactions are recorded.
+    '''
+
+    _own = ['session', 'resource', 'transcript']
+
+    def __init__(self, session, resource, transcript):
+        object.__setattr__(self, 'session', session)
+        object.__setattr__(self, 'resource', resource)
+        object.__setattr__(self, 'transcript', transcript)
+
+    def __getattr__(self, attr):
+        return getattr(self.session, attr)
+
+    def __setattr__(self, attr, value):
+        if attr in self._own:
+            object.__setattr__(self, attr, value)
+        else:
+            setattr(self.session, attr, value)
+
+    def _record(self, op, command, func, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except visa.VisaIOError as e:
+            self.transcript.add(self.resource, op, command, None, time.perf_counter() - t0, e.error_code)
+            raise
+        self.transcript.add(self.resource, op, command, None if op == 'write' else result,
+                            time.perf_counter() - t0)
+        return result
+
+    def write(self, message, *args, **kwargs):
+        '''
+        Recorded session.write().
+        '''
+        return self._record('write', message, self.session.write, message, *args, **kwargs)
+
+    def query(self, message, *args, **kwargs):
+        '''
+        Recorded session.query().
+        '''
+        return self._record('query', message, self.session.query, message, *args, **kwargs)
+
+    def read(self, *args, **kwargs):
+        '''
+        Recorded session.read().
+        '''
+        return self._record('read', '', self.session.read, *args, **kwargs)
+
+    def read_raw(self, *args, **kwargs):
+        '''
+        Recorded session.read_raw().
+        '''
+        return self._record('read_raw', '', self.session.read_raw, *args, **kwargs)
+
+    def query_binary_values(self, message, *args, **kwargs):
+        '''
+        Recorded session.query_binary_values().
+        '''
+        return self._record('query_binary_values', message, self.session.query_binary_values,
+                            message, *args, **kwargs)
+
+    def queryMany(self, messages):
+        '''
+        Recorded queries; stored one per message so replay does not depend on the transport.
+        '''
+        return [self.query(m) for m in messages]
+
+    def assert_trigger(self):
+        '''
+        Recorded session.assert_trigger().
+        '''
+        return self._record('trigger', '*TRG', self.session.assert_trigger)
+
+
+class SimulatedSession:
+    '''
+    A session that replays the transcript of one instrument.
+
+    Responses are looked up by operation and exact command. When a command
+    was recorded several times its responses are returned in recorded order,
+    starting over after the last one. Commands that were never recorded are
+    accepted; queries among them return the response in defaults, or '0'.
+
+    Parameters:
+    -----------
+    resource : str
+        The VISA address being simulated.
+    transactions : list
+        The transactions recorded for this resource (see Transcript).
+    latency : None, float or dict
+        None : each transaction takes its recorded duration (default).
+        float : every transaction takes this many seconds.
+        dict : seconds per command header (see profiling.commandHeader());
+               headers not in the dict use their recorded duration.
+    timeScale : float
+        Factor applied to all recorded durations, e.g. 0 to replay as fast as possible.
+    strict : bool
+        Raise a VISA timeout for queries that are not in the transcript,
+        as an instrument that does not answer would.
+    '''
+
+    defaults = {'*OPC?' : '1', '*IDN?' : 'pymeasrf,SimulatedSession,0,0',
+                '*ESR?' : '1', 'SYSTem:ERRor?' : '+0,"No error"', 'SYSTem:ERRor:NEXT?' : '0,"No error"'}
+
+    def __init__(self, resource, transactions = None, latency = None, timeScale = 1.0, strict = False):
+        self.resource_name = resource
+        self.latency = latency
+        self.timeScale = timeScale
+        self.strict = strict
+        self.timeout = 2000
+        self.read_termination = '\n'
+        self.write_termination = '\n'
+        self.query_delay = 0
+        self.closed = False
+        self.entries = {}
+        self.cursors = {}
+        self.headerDurations = {}
+        self.pending = []
+        for t in transactions or []:
+            self.entries.setdefault((t['op'], t['command']), []).append(t)
+            self.headerDurations.setdefault(commandHeader(t['command']), []).append(t['duration'])
+        self.headerDurations = {h : float(np.mean(d)) for h,d in self.headerDurations.items()}
+
+    @property
+    def session(self):
+        # mirrors pyvisa: accessing the session of a closed resource raises
+        if self.closed:
+            raise visa.InvalidSession()
+        return id(self)
+
+    def close(self):
+        '''
+        Closes the simulated session.
+        '''
+        self.closed = True
+
+    def _next(self, op, command):
+        key = (op, command)
+        entries = self.entries.get(key)
+        if not entries:
+            return None
+        i = self.cursors.get(key, 0)
+        self.cursors[key] = (i + 1) % len(entries)
+        return entries[i]
+
+    def _wait(self, command, entry):
+        if isinstance(self.latency, dict) and commandHeader(command) in self.latency:
+            delay = self.latency[commandHeader(command)]
+        elif isinstance(self.latency, (int, float)):
+            delay = self.latency
+        elif entry is not None:
+            delay = entry['duration'] * self.timeScale
+        else:
+            delay = self.headerDurations.get(commandHeader(command), 0.0) * self.timeScale
+        if delay > 0:
+            time.sleep(delay)
+
+    def _transact(self, op, command):
+        entry = self._next(op, command)
+        self._wait(command, entry)
+        if entry is not None and 'error' in entry:
+            raise visa.VisaIOError(entry['error'])
+        return entry
+
+    def write(self, message, *args, **kwargs):
+        '''
+        Accepts a command after the simulated latency.
+        '''
+        self._transact('write', message)
+        return len(message) + len(self.write_termination)
+
+    def query(self, message, *args, **kwargs):
+        '''
+        Returns the recorded response to a query.
+        '''
+        entry = self._transact('query', message)
+        if entry is not None:
+            return entry.get('response', '')
+        if self.strict:
+            raise visa.VisaIOError(constants.StatusCode.error_timeout)
+        return self.defaults.get(message.strip(), '0')
+
+    def queryMany(self, messages):
+        '''
+        Returns the recorded responses to several queries.
+        '''
+        return [self.query(m) for m in messages]
+
+    def read(self, *args, **kwargs):
+        '''
+        Returns the next recorded read.
+        '''
+        entry = self._transact('read', '')
+        if entry is None:
+            raise visa.VisaIOError(constants.StatusCode.error_timeout)
+        return entry.get('response', '')
+
+    def read_raw(self, *args, **kwargs):
+        '''
+        Returns the next recorded raw read as bytes.
+        '''
+        entry = self._transact('read_raw', '')
+        if entry is None:
+            raise visa.VisaIOError(constants.StatusCode.error_timeout)
+        return base64.b64decode(entry.get('raw', ''))
+
+    def query_binary_values(self, message, datatype = 'f', is_big_endian = False, container = list, *args, **kwargs):
+        '''
+        Returns the recorded values of a binary block query.
+        '''
+        entry = self._transact('query_binary_values', message)
+        if entry is None:
+            if self.strict:
+                raise visa.VisaIOError(constants.StatusCode.error_timeout)
+            return container(np.zeros(0, dtype = datatype))
+        return container(np.asarray(entry.get('values', []), dtype = datatype))
+
+    def assert_trigger(self):
+        '''
+        Accepts a software trigger.
+        '''
+        self._transact('trigger', '*TRG')
+
+    def clear(self):
+        '''
+        Nothing to clear in a simulated session.
+        '''
+        pass
+
+    def control_ren(self, mode):
+        '''
+        Remote enable has no meaning in a simulated session.
+        '''
+        pass
+
+
+class Simulator:
+    '''
+    Opens SimulatedSession objects for the resources in a transcript.
+
+    Parameters:
+    -----------
+    transcript : Transcript
+        The recorded sessions to replay.
+    latency, timeScale, strict
+        Passed to every SimulatedSession (see SimulatedSession).
+    '''
+
+    def __init__(self, transcript, latency = None, timeScale = 1.0, strict = False):
+        self.transcript = transcript
+        self.latency = latency
+        self.timeScale = timeScale
+        self.strict = strict
+
+    def openResource(self, resource, **kwargs):
+        '''
+        Returns a new simulated session for the given resource.
+
+        Parameters:
+        -----------
+        resource : str
+            A string containing the VISA address of the device. Resources that
+            are not in the transcript are simulated with default responses.
+
+        Returns:
+        ----------
+        session : SimulatedSession
+            The simulated session.
+        '''
+        return SimulatedSession(resource, self.transcript.resources.get(resource, []),
+                                self.latency, self.timeScale, self.strict)
@@ -0,0 +1,159 @@
+#smuGroup.py
+'''
+Concurrent control of several SMUs.
+
+Setting a bias point one SMU after the other costs the sum of all their
+round trips and *OPC? waits. An SmuGroup sends the settings to every SMU at
+the same time, each from its own worker thread (calls to different GPIB
+addresses or buses overlap), and waits for all of them together. The time at
+which each SMU was set is recorded, so the spread between
+the first and the last SMU (the settle skew) can be reported per bias point.
+'''
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+class SmuGroup:
+    '''
+    A group of SMUs programmed and read concurrently.
+
+        with SmuGroup(smus) as group:
+            group.setVoltages([0.8, 0.17, 0])
+            print(group.settleReport())
+
+    Parameters:
+    -----------
+    smus : list
+        The connected SMU objects.
+    '''
+
+    def __init__(self, smus):
+        self.smus = list(smus)
+        self.executors = [ThreadPoolExecutor(max_workers = 1, thread_name_prefix = str(x.label or x.resource))
+                          for x in self.smus]
+        self.settleTimes = None # s, per SMU, of the last setVoltages()
+        self.skews = [] # s, settle skew of every setVoltages()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        self.close()
+        return False
+
+    def map(self, func, *args):
+        '''
+        Calls func(smu, ...) for every SMU at the same time and waits for all of them.
+
+        Parameters:
+        -----------
+        func : callable
+            Function taking the SMU as first argument.
+        *args : list
+            One list per further argument, with one value per SMU.
+
+        Returns:
+        ----------
+        results : list
+            The return values, in the order of the SMUs.
+
+        Raises
+        ------
+        Exception
+            The first exception raised by func, after all calls have finished.
+        '''
+        futures = [e.submit(func, x, *a) for e, x, *a in zip(self.executors, self.smus, *args)]
+        errors = [f.exception() for f in futures]
+        for e in errors:
+            if e is not None:
+                raise e
+        return [f.result() for f in futures]
+
+    def setVoltages(self, voltages, startMeas = False, tmeas = 1):
+        '''
+        Sets every SMU to its voltage concurrently and returns when all have been set.
+
+        Keithley2400.setVoltage() already waits for *OPC? after a CONFigure, so
+        no further round trip is made per SMU.
+
+        Parameters:
+        -----------
+        voltages : list
+            One voltage per SMU.
+        startMeas : bool
+            Start a buffered measurement on each SMU after its voltage is set (see Keithley2400.startMeas()).
+        tmeas : float
+            Time in seconds between buffered readings if startMeas is set.
+
+        Returns:
+        ----------
+        settleTimes : np.ndarray
+            Time in seconds from the start of the call until each SMU was set.
+        '''
+        t0 = time.perf_counter()
+        def setVoltage(smu, v):
+            smu.setVoltage(v)
+            settled = time.perf_counter() - t0
+            if startMeas:
+                smu.startMeas(tmeas = tmeas)
+            return settled
+        self.settleTimes = np.array(self.map(setVoltage, voltages))
+        self.skews.append(self.skew())
+        return self.settleTimes
+
+    def stopMeas(self):
+        '''
+        Stops the buffered measurements of all SMUs concurrently and reads their data.
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        data : list
+            The readings of each SMU, see Keithley2400.stopMeas().
+        '''
+        return self.map(lambda smu : smu.stopMeas())
+
+    def skew(self):
+        '''
+        Returns the time in seconds between the first and the last SMU settling in the last setVoltages().
+        '''
+        if self.settleTimes is None or not len(self.settleTimes):
+            return 0.0
+        return float(np.max(self.settleTimes) - np.min(self.settleTimes))
+
+    def settleReport(self):
+        '''
+        Describes the settling of the last setVoltages().
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        report : str
+            Total settle time, skew and the settle time of each SMU in ms.
+        '''
+        if self.settleTimes is None:
+            return 'No voltages set.'
+        times = '  '.join('{} {:.1f}'.format(x.label, 1e3*t) for x, t in zip(self.smus, self.settleTimes))
+        return 'SMUs settled in {:.1f} ms, skew {:.1f} ms ({} ms).'.format(1e3*np.max(self.settleTimes), 1e3*self.skew(), times)
+
+    def close(self):
+        '''
+        Shuts down the worker threads. The SMUs stay connected.
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        N/A
+        '''
+        for e in self.executors:
+            e.shutdown(wait = True)
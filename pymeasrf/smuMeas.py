@@ -8,19 +8,32 @@ HybridMEMS
 import visa
 import numpy as np
 import time
+import asyncio
 from context import pymeasrf
 import pymeasrf.AgilentPNAXUtils as pnaUtils
 import pymeasrf.Keithley2400 as k2400
+import pymeasrf.profiling as profiling
+import pymeasrf.asyncDriver as asyncDriver
+from pymeasrf.biasPlan import BiasPlan
+from pymeasrf.smuGroup import SmuGroup
+from pymeasrf.buffers import SmuDataBuffer
+from pymeasrf.settling import Settler
 import matplotlib.pyplot as plt
 import matplotlib as mpl
     
-def formatData(data):
+# data elements selected on the SMUs by prepareSmus(), in the column order of SmuDataBuffer
+smuElements = ['VOLTage', 'CURRent', 'RESistance', 'TIME', 'STATus']
+
+def formatData(data, nColumns = len(smuElements)):
+    if isinstance(data, np.ndarray):
+        # binary readout from Keithley2400.readData() - already one field per element
+        return [data[name].astype(float) for name in data.dtype.names]
     data = data.split(',')
-    n = len(data) / 5
-    if n != int(n):
+    n = len(data) // nColumns
+    if n*nColumns != len(data):
         print('Warning! SMU data doesn\'t have expected number of columns.')
-    formatData = [np.zeros(int(n)) for i in range(0,5)]
-    for i,d in enumerate(data): formatData[i % 5][i // 5] = d
+    formatData = [np.zeros(n) for i in range(0,nColumns)]
+    for i,d in enumerate(data[:n*nColumns]): formatData[i % nColumns][i // nColumns] = d
     return formatData
     
 class SMUmeas():
@@ -34,8 +47,32 @@ class SMUmeas():
         The local directory where SMU data will be saved.
     testname : string
         Identifier for the test that will be used in saved filenames.
+    binary : bool
+        Transfer SMU readings as binary (SREal) blocks instead of ASCII text.
+    profile : bool
+        Save a per-bias-point profile of SCPI command latencies (see profiling.py)
+        in localsavedir and print the slowest commands after measure().
+    listSweep : bool
+        Sweep the first SMU through its voltages from the SMU's own source list
+        (see measureList()) instead of setting each voltage from Python.
+        The list is run as given: settle, measTime and maxStep do not apply to it.
+    order : str, callable or array-like
+        Order of the bias points, e.g. 'serpentine' (see biasPlan.BiasPlan).
+        Defaults to 'raster', the last SMU stepped slowest and the first fastest.
+    maxStep : float or list
+        Largest voltage step of an SMU between set voltages; larger changes are ramped.
+    settle : str
+        'relative' or 'exponential' to poll the SMU currents after setting a bias point
+        and measure as soon as they have settled (see settling.Settler), with delay as
+        the longest wait. None (default) always waits the full delay. Not used by measureList().
+    settleInterval : float
+        Time in seconds between current readings while settling.
+    settleTolerance : float
+        Relative current tolerance for settling.
     '''
-    def __init__(self, smus, localsavedir, testname, delay = 0, measTime = 0, postMeasDelay = 0, smuMeasInter = 1):               
+    def __init__(self, smus, localsavedir, testname, delay = 0, measTime = 0, postMeasDelay = 0, smuMeasInter = 1,
+                 binary = False, profile = False, listSweep = False, order = 'raster', maxStep = None,
+                 settle = None, settleInterval = 0.2, settleTolerance = 1e-3):               
         self.smus = smus
         self.localsavedir = localsavedir
         self.testname = testname
@@ -43,104 +80,167 @@ class SMUmeas():
         self.measTime = measTime
         self.postMeasDelay = postMeasDelay
         self.smuMeasInter = smuMeasInter
+        self.binary = binary
+        self.profile = profile
+        self.listSweep = listSweep
+        self.order = order
+        self.maxStep = maxStep
+        self.settle = settle
+        self.settleInterval = settleInterval
+        self.settleTolerance = settleTolerance
+        self.settleTimes = [] # s, time waited at each bias point of the last measure() with settle
         
     
-    def formatData(data):
-        data = data.split(',')
-        n = len(data) / 5
-        if n != int(n):
-            print('Warning! SMU data doesn\'t have expected number of columns.')
-        formatData = [np.zeros(int(n)) for i in range(0,5)]
-        for i,d in enumerate(data): formatData[i % 5][i // 5] = d
-        return formatData
+    def prepareSmus(self):
+        '''
+        Checks that every SMU has voltages defined, selects the reading format and resets the SMU timers.
+        
+        Parameters
+        -----------
+        N/A
+        
+        Returns
+        -----------
+        smuData : list
+            One empty SmuDataBuffer per SMU, sized for one reading per bias point.
+        
+        Raises
+        ------
+        ValueError
+            An SMU has no voltages defined.
+        '''
+        smuData = [None]*len(self.smus)
+        for i,x in enumerate(self.smus):
+          if x.voltages.all() == None:
+            raise ValueError('No voltages defined for SMU \'{}\''.format(x.label))
+          x.setElements(smuElements)
+          x.setDataFormat('SREal' if self.binary else 'ASCii')
+          x.resetTime()
+          smuData[i] = SmuDataBuffer(len(self.biasPlan()))
+        return smuData
     
-    def measure(self, smuX = None, smuY = None, smuZ = None):
+    def biasPlan(self, smus = None):
         '''
-        Uses SMUs as V source and measures time, V force, and I sense. 
-        Will plot V vs I for two SMUs, given smuX and smuY
+        Returns the BiasPlan of the SMU voltages with the selected order and maxStep.
+        
+        Parameters
+        -----------
+        smus : list
+            The SMUs to plan for. Defaults to self.smus.
+        
+        Returns
+        -----------
+        plan : BiasPlan
+            The bias points in measurement order.
+        '''
+        smus = self.smus if smus is None else smus
+        maxStep = self.maxStep
+        if smus is not self.smus and np.ndim(maxStep):
+            maxStep = [maxStep[self.smus.index(x)] for x in smus]
+        return BiasPlan.fromSmus(smus, self.order, maxStep)
+    
+    def biasPoints(self):
+        '''
+        Generates the SMU voltage combinations in measurement order (see biasPlan()).
+        
+        Parameters
+        -----------
+        N/A
+        
+        Returns
+        -----------
+        currentV : generator of lists
+            One voltage per SMU, in the order of self.smus.
+        '''
+        return iter(self.biasPlan())
+    
+    def settler(self, group = None):
+        '''
+        Returns a Settler for the SMUs if settle is set, otherwise None.
+        
+        Parameters
+        -----------
+        group : SmuGroup
+            Group used to read the SMUs concurrently.
+        
+        Returns
+        -----------
+        settler : Settler or None
+            Waits at most delay seconds for the SMU currents to settle.
+        '''
+        if not self.settle:
+            return None
+        return Settler(self.smus, self.delay, self.settle, self.settleInterval, self.settleTolerance, group = group)
+    
+    def saveSettleTimes(self, settler):
+        '''
+        Stores the settle times of settler and saves them in localsavedir.
+        '''
+        self.settleTimes = settler.settleTimes
+        filename = '{}\\{}_settle.csv'.format(self.localsavedir,self.testname)
+        print('Settled in {:.2f} s on average (at most {} s). Saving settle times in {}'.format(
+              np.mean(self.settleTimes) if self.settleTimes else 0, self.delay, filename))
+        settler.save(filename)
+    
+    def measureSmu(self, smu):
+        '''
+        Takes the readings of one SMU at the current bias point.
+        
+        Readings are buffered for measTime seconds if it is longer than smuMeasInter,
+        otherwise a single reading is taken.
         
         Parameters
         -----------
+        smu : Keithley2400
+            One of self.smus.
         
+        Returns
+        -----------
+        data : str or numpy structured array
+            The SMU readings, see Keithley2400.readData().
+        '''
+        smu.visaobj.timeout = 120000
+        if self.measTime > self.smuMeasInter:
+            print("\nMeasuring for {} sec.".format(str(self.measTime)))
+            smu.startMeas(tmeas = self.smuMeasInter)
+            for r in range(self.measTime):
+                time.sleep(1)
+            data = smu.stopMeas()
+        else:
+            data = smu.meas()
+        if self.postMeasDelay: smu.setVoltage(0)
+        smu.visaobj.timeout = 2000
+        return data
+    
+    def saveSmuData(self, smuData, smuX = None, smuY = None, smuZ = None):
+        '''
+        Turns off the SMUs, then saves and plots the SMU data in localsavedir.
+        
+        Parameters
+        -----------
+        smuData : list
+            The SmuDataBuffer objects returned by prepareSmus() with the measured data appended.
         smuX : int
             Position of x-axis (voltage) SMU in list passed at creation of SMUmeas.
-            
         smuY : int
             Position of y-axis (current) SMU in list passed at creation of SMUmeas.
-            
         smuZ : int
             Position of z-axis (color) SMU (voltage data) in list passed at creation of measurement.
-            
+        
         Returns
         -----------
         N/A
         '''
-        smuData = [None]*len(self.smus)
-        for i,x in enumerate(self.smus):
-          if x.voltages.all() == None:
-            raise ValueError('No voltages defined for SMU \'{}\''.format(x.label))
-          x.visaobj.write(':FORMat:ELEMents VOLTage, CURRent, RESistance, TIME, STATus')
-          x.resetTime()
-          smuData[i] = [np.zeros(1) for i in range(0,5)]
-        currentV = [None for i in range(0,len(self.smus))]
-            
-        def setVoltageLoop(l = len(self.smus)):
-          
-            if l >= 1:
-                for i in self.smus[l-1].voltages:
-#                    print('{} {}'.format(self.smus[l-1].label,i))
-                    currentV[l-1] = i
-                    setVoltageLoop(l-1)
-            else:
-              print('Setting SMU voltages. ',end='')
-              testname2 = self.testname
-              for i,v in enumerate(currentV):
-                print('{} {} V'.format(self.smus[i].label,v), end='  ')
-                self.smus[i].setVoltage(v)
-                testname2 = testname2 + '_{}{}V'.format(self.smus[i].label,str(v).replace('.','_'))
-              print('') # prints newline character after SMU voltages are listed
-              if self.delay:
-                  print("\nWaiting for {} sec to allow system to equilibriate".format(str(self.delay)))
-                  for i in range(self.delay):
-                      time.sleep(1)
-                      if i%10 == 0:
-                          print(str(i) + "/" + str(self.delay))
-              
-              
-              for i,x in enumerate(self.smus):
-                  x.visaobj.timeout = 120000
-                  if self.measTime > self.smuMeasInter:
-                      print("\nMeasuring for {} sec.".format(str(self.measTime)))
-                      x.startMeas(tmeas = self.smuMeasInter)
-                      for r in range(self.measTime):
-                          time.sleep(1)
-                      data = x.stopMeas()
-                  else:
-                      data = x.meas()
-                  if self.postMeasDelay: x.setVoltage(0)
-                  x.visaobj.timeout = 2000
-                  smuData[i] = np.append(smuData[i],formatData(data),1)
-              
-              if self.postMeasDelay:
-                  
-                  print("\nWaiting for {} sec before the next measurement".format(str(self.postMeasDelay)))
-                  for i in range(self.postMeasDelay):
-                      time.sleep(1)
-                      if i%10 == 0:
-                          print(str(i) + "/" + str(self.postMeasDelay))                
-                
-        setVoltageLoop()
-        plt.close('all')  
         if (smuX != None and smuY != None):
             fig = plt.figure()
             ax = fig.add_subplot(111)
             if smuZ != None:
-                colormap = mpl.cm.get_cmap('jet',len(smuData[smuZ][:][:,1:][0]))
-                ax.scatter(smuData[smuX][:][:,1:][0],smuData[smuY][:][:,1:][1]*1E6, c = smuData[smuZ][:][:,1:][0])
+                colormap = mpl.cm.get_cmap('jet',len(smuData[smuZ]['V']))
+                ax.scatter(smuData[smuX]['V'],smuData[smuY]['I']*1E6, c = smuData[smuZ]['V'])
 #                cbar = fig.colorbar(ax)
 #                cbar.set_label('{} Voltage (V)'.format(self.smus[smuZ].label))
             else:
-                ax.plot(smuData[smuX][:][:,1:][0],smuData[smuY][:][:,1:][1])
+                ax.plot(smuData[smuX]['V'],smuData[smuY]['I'])
             ax.set_xlabel('{} Voltage (V)'.format(self.smus[smuX].label))
             ax.set_ylabel('{} Current (uA)'.format(self.smus[smuY].label))
             ax.set_title(self.testname)
@@ -148,7 +248,7 @@ class SMUmeas():
                 
         for i,x in enumerate(self.smus): 
             x.outputOff()
-            smuData1 = smuData[i][:][:,1:]
+            smuData1 = smuData[i].array()
             filename = '{}\\{}_{}.csv'.format(self.localsavedir,self.testname,x.label)
             print('Saving {} data on local PC in {}'.format(x.label,filename))
             np.savetxt(filename,np.transpose(smuData1),delimiter=',')
@@ -163,6 +263,195 @@ class SMUmeas():
             ax1.plot(smuData1[3],smuData1[0],'.',markersize=10)
             ax1.set_xlabel('Time (s)')
             ax1.set_ylabel('Voltage (V)')
+        
+    def measure(self, smuX = None, smuY = None, smuZ = None):
+        '''
+        Uses SMUs as V source and measures time, V force, and I sense. 
+        Will plot V vs I for two SMUs, given smuX and smuY
+        
+        Parameters
+        -----------
+        
+        smuX : int
+            Position of x-axis (voltage) SMU in list passed at creation of SMUmeas.
+            
+        smuY : int
+            Position of y-axis (current) SMU in list passed at creation of SMUmeas.
+            
+        smuZ : int
+            Position of z-axis (color) SMU (voltage data) in list passed at creation of measurement.
+            
+        Returns
+        -----------
+        N/A
+        '''
+        if self.listSweep:
+            return self.measureList(smuX, smuY, smuZ)
+        smuData = self.prepareSmus()
+            
+        with SmuGroup(self.smus) as group:
+            settler = self.settler(group)
+            for currentV, measured in self.biasPlan().steps(fromStart = bool(self.postMeasDelay)):
+                if not measured:
+                    print('Ramping SMU voltages. ' + '  '.join('{} {:.4g} V'.format(x.label,v) for x,v in zip(self.smus,currentV)))
+                    group.setVoltages(currentV)
+                    continue
+                testname2 = self.testname
+                for i,v in enumerate(currentV):
+                  testname2 = testname2 + '_{}{}V'.format(self.smus[i].label,str(v).replace('.','_'))
+                with profiling.profiler.sweep(testname2):
+                    print('Setting SMU voltages. ',end='')
+                    for i,v in enumerate(currentV):
+                      print('{} {} V'.format(self.smus[i].label,v), end='  ')
+                    print('') # prints newline character after SMU voltages are listed
+                    group.setVoltages(currentV)
+                    print(group.settleReport())
+                    if settler is not None:
+                        print("\nWaiting up to {} sec for SMU currents to settle".format(str(self.delay)))
+                        settler.wait()
+                        print(settler.report())
+                    elif self.delay:
+                        print("\nWaiting for {} sec to allow system to equilibriate".format(str(self.delay)))
+                        for i in range(self.delay):
+                            time.sleep(1)
+                            if i%10 == 0:
+                                print(str(i) + "/" + str(self.delay))
+                
+                    # the SMUs are read concurrently
+                    for i,data in enumerate(group.map(self.measureSmu)):
+                        smuData[i].append(formatData(data))
+                
+                    if self.postMeasDelay:
+                    
+                        print("\nWaiting for {} sec before the next measurement".format(str(self.postMeasDelay)))
+                        for i in range(self.postMeasDelay):
+                            time.sleep(1)
+                            if i%10 == 0:
+                                print(str(i) + "/" + str(self.postMeasDelay))                
+            print('Largest SMU settle skew: {:.1f} ms.'.format(1e3*max(group.skews, default = 0)))
+        if settler is not None:
+            self.saveSettleTimes(settler)
+        plt.close('all')  
+        self.saveSmuData(smuData, smuX, smuY, smuZ)
+        
+        if self.profile:
+            profiling.profiler.printSummary()
+            profiling.profiler.exportProfile('{}\\{}_profile.json'.format(self.localsavedir,self.testname))
+            
+    def measureList(self, smuX = None, smuY = None, smuZ = None):
+        '''
+        Measures with the first SMU running its voltages as a hardware list sweep
+        (see Keithley2400.listSweep()), which is read back in one binary transfer.
+        
+        The other SMUs are stepped from Python as in measure(), slowest last,
+        and read once per list sweep. delay is applied by the first SMU as the
+        source delay of every list point; measTime and smuMeasInter are not used.
+        
+        Parameters
+        -----------
+        smuX, smuY, smuZ : int
+            See measure().
+            
+        Returns
+        -----------
+        N/A
+        '''
+        smuData = self.prepareSmus()
+        listSmu, others = self.smus[0], self.smus[1:]
+        for outerV, measured in self.biasPlan(others).steps(fromStart = bool(self.postMeasDelay)):
+            if not measured:
+                for x,v in zip(others,outerV):
+                    x.setVoltage(v)
+                continue
+            testname2 = self.testname
+            for x,v in zip(others,outerV):
+                testname2 = testname2 + '_{}{}V'.format(x.label,str(v).replace('.','_'))
+            with profiling.profiler.sweep(testname2):
+                if others:
+                    print('Setting SMU voltages. ' + '  '.join('{} {} V'.format(x.label,v) for x,v in zip(others,outerV)))
+                for x,v in zip(others,outerV):
+                    x.setVoltage(v)
+                print('Sweeping {} through {} voltages.'.format(listSmu.label,len(listSmu.voltages)))
+                data = listSmu.listSweep(listSmu.voltages, self.delay)
+                smuData[0].append(formatData(data))
+                for i,x in enumerate(others):
+                    smuData[i+1].append(formatData(x.meas()))
+                if self.postMeasDelay:
+                    # steps(fromStart = True) ramps every SMU up from 0 V again
+                    for x in self.smus:
+                        x.setVoltage(0)
+                    print("\nWaiting for {} sec before the next measurement".format(str(self.postMeasDelay)))
+                    time.sleep(self.postMeasDelay)
+        
+        plt.close('all')  
+        self.saveSmuData(smuData, smuX, smuY, smuZ)
+        
+        if self.profile:
+            profiling.profiler.printSummary()
+            profiling.profiler.exportProfile('{}\\{}_profile.json'.format(self.localsavedir,self.testname))
+            
+    async def measureAsync(self, smuX = None, smuY = None, smuZ = None):
+        '''
+        asyncio version of measure(). Bias points and file names are the same,
+        but at each bias point the SMUs are set concurrently and measured concurrently.
+        
+        Run with asyncio.run(meas.measureAsync()).
+        
+        Parameters
+        -----------
+        
+        smuX : int
+            Position of x-axis (voltage) SMU in list passed at creation of SMUmeas.
+        smuY : int
+            Position of y-axis (current) SMU in list passed at creation of SMUmeas.
+        smuZ : int
+            Position of z-axis (color) SMU (voltage data) in list passed at creation of measurement.
+            
+        Returns
+        -----------
+        N/A
+        '''
+        smuData = self.prepareSmus()
+        smus = asyncDriver.wrapAll(self.smus)
+        settler = self.settler()
+        try:
+            for currentV, measured in self.biasPlan().steps(fromStart = bool(self.postMeasDelay)):
+                if not measured:
+                    await asyncio.gather(*[x.setVoltage(v) for x,v in zip(smus,currentV)])
+                    continue
+                testname2 = self.testname
+                for x,v in zip(self.smus,currentV):
+                    testname2 = testname2 + '_{}{}V'.format(x.label,str(v).replace('.','_'))
+                with profiling.profiler.sweep(testname2):
+                    print('Setting SMU voltages. ' + '  '.join('{} {} V'.format(x.label,v)
+                          for x,v in zip(self.smus,currentV)))
+                    await asyncio.gather(*[x.setVoltage(v) for x,v in zip(smus,currentV)])
+                    if settler is not None:
+                        print("\nWaiting up to {} sec for SMU currents to settle".format(str(self.delay)))
+                        await asyncio.get_running_loop().run_in_executor(None, settler.wait)
+                        print(settler.report())
+                    elif self.delay:
+                        print("\nWaiting for {} sec to allow system to equilibriate".format(str(self.delay)))
+                        await asyncio.sleep(self.delay)
+                    
+                    data = await asyncio.gather(*[x.run(self.measureSmu, x.driver) for x in smus])
+                    for i,d in enumerate(data):
+                        smuData[i].append(formatData(d))
+                    
+                    if self.postMeasDelay:
+                        print("\nWaiting for {} sec before the next measurement".format(str(self.postMeasDelay)))
+                        await asyncio.sleep(self.postMeasDelay)
+        finally:
+            asyncDriver.closeAll(smus)
+        if settler is not None:
+            self.saveSettleTimes(settler)
+        
+        plt.close('all')  
+        self.saveSmuData(smuData, smuX, smuY, smuZ)
+        
+        if self.profile:
+            profiling.profiler.printSummary()
+            profiling.profiler.exportProfile('{}\\{}_profile.json'.format(self.localsavedir,self.testname))
             
 def main():
     biases1 = np.linspace(-5, 5, 25)
@@ -190,6 +479,8 @@ def main():
         x.smuSetup(maxVoltage, compliance)
         x.visaobj.write(':SYSTem:BEEPer:STATe 0')
     test = SMUmeas(smus, localsavedir, testname, delay=delayTime, measTime=0, postMeasDelay=0)
+    # sweeps the first SMU from its own source list (see SMUmeas.measureList())
+#    test = SMUmeas(smus, localsavedir, testname, delay=delayTime, measTime=0, postMeasDelay=0, listSweep=True)
     
     test.measure()
     for x in smus:
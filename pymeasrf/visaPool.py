@@ -0,0 +1,388 @@
+#visaPool.py
+'''
+Process-wide pool of VISA sessions shared by all instrument drivers.
+
+A single ResourceManager is created on first use and open sessions are kept
+by resource string. Reconnecting to an instrument, or building a new
+measurement object around it, reuses the session that is already open instead
+of initializing the VISA backend and reopening the resource.
+
+The pool can also record the sessions it hands out, or replace them with
+simulated sessions replaying a recording (see simulator.py).
+'''
+
+import atexit
+import os
+import threading
+import time
+import visa
+from pymeasrf.scpiSocket import ScpiSocket, parseSocketResource
+from pymeasrf.simulator import Transcript, RecordingSession, Simulator
+
+class VisaSessionPool:
+    '''
+    Hands out reusable VISA sessions keyed by resource string.
+
+    Sessions stay open ("warm") after a driver releases them and are only
+    closed by close() or closeAll(), which is registered to run at interpreter exit.
+    Time spent creating the ResourceManager, opening sessions and handing
+    out already open sessions is recorded and available through report().
+
+    Parameters:
+    -----------
+    backend : str
+        Optional VISA library passed to visa.ResourceManager (e.g. '@py').
+        The default VISA library is used if None.
+    rawSockets : bool
+        Open TCPIP SOCKET resources with the built-in ScpiSocket transport
+        instead of the VISA library.
+    '''
+
+    # session attributes restored when a pooled session is handed out again
+    sessionDefaults = ['timeout', 'read_termination', 'write_termination', 'query_delay']
+
+    def __init__(self, backend = None, rawSockets = True):
+        self.backend = backend
+        self.rawSockets = rawSockets
+        self.rm = None
+        self.sessions = {}
+        self.defaults = {}
+        self.users = {}
+        self.simulator = None
+        self.transcript = None
+        self.lock = threading.RLock()
+        self.resetStats()
+
+    def resetStats(self):
+        '''
+        Clears the accumulated open/reuse statistics.
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        N/A
+        '''
+        self.stats = {'rmInits' : 0, 'rmInitTime' : 0.0,
+                      'opens' : 0, 'openTime' : 0.0,
+                      'reuses' : 0, 'reuseTime' : 0.0,
+                      'closes' : 0}
+
+    def resourceManager(self):
+        '''
+        Returns the shared ResourceManager, creating it on first use.
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        rm : visa.ResourceManager
+            The process-wide resource manager.
+        '''
+        with self.lock:
+            if self.rm is None:
+                t0 = time.perf_counter()
+                if self.backend:
+                    self.rm = visa.ResourceManager(self.backend)
+                else:
+                    self.rm = visa.ResourceManager()
+                self.stats['rmInits'] += 1
+                self.stats['rmInitTime'] += time.perf_counter() - t0
+            return self.rm
+
+    def openResource(self, resource, **kwargs):
+        '''
+        Returns an open session for the given resource, reusing a pooled session if possible.
+
+        Parameters:
+        -----------
+        resource : str
+            A string containing the VISA address of the device.
+        **kwargs
+            Additional keyword arguments passed to open_resource() when a new
+            session has to be opened.
+
+        Returns:
+        ----------
+        session : pyvisa Resource
+            The open session. A SimulatedSession while simulate() is active, and
+            wrapped in a RecordingSession while startRecording() is active.
+
+        Raises
+        ------
+        visa.VisaIOError
+            The resource could not be opened.
+        '''
+        with self.lock:
+            t0 = time.perf_counter()
+            session = self.sessions.get(resource)
+            if session is not None and self.isOpen(session):
+                self.restoreDefaults(resource, session)
+                self.stats['reuses'] += 1
+                self.stats['reuseTime'] += time.perf_counter() - t0
+            else:
+                if self.simulator is not None:
+                    session = self.simulator.openResource(resource, **kwargs)
+                elif self.rawSockets and parseSocketResource(resource):
+                    session = ScpiSocket.fromResource(resource, **kwargs)
+                else:
+                    session = self.resourceManager().open_resource(resource, **kwargs)
+                self.sessions[resource] = session
+                self.defaults[resource] = {a : getattr(session, a)
+                                           for a in self.sessionDefaults if hasattr(session, a)}
+                self.stats['opens'] += 1
+                self.stats['openTime'] += time.perf_counter() - t0
+            self.users[resource] = self.users.get(resource, 0) + 1
+            if self.transcript is not None:
+                return RecordingSession(session, resource, self.transcript)
+            return session
+
+    def release(self, resource):
+        '''
+        Marks a session as no longer used by a driver. The session is kept open for reuse.
+
+        Parameters:
+        -----------
+        resource : str
+            A string containing the VISA address of the device.
+
+        Returns:
+        ----------
+        N/A
+        '''
+        with self.lock:
+            if self.users.get(resource, 0) > 0:
+                self.users[resource] -= 1
+
+    def close(self, resource):
+        '''
+        Closes the pooled session for the given resource.
+
+        Parameters:
+        -----------
+        resource : str
+            A string containing the VISA address of the device.
+
+        Returns:
+        ----------
+        N/A
+        '''
+        with self.lock:
+            session = self.sessions.pop(resource, None)
+            self.defaults.pop(resource, None)
+            self.users.pop(resource, None)
+            if session is not None and self.isOpen(session):
+                session.close()
+                self.stats['closes'] += 1
+
+    def closeAll(self):
+        '''
+        Closes every pooled session and the shared ResourceManager.
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        N/A
+        '''
+        with self.lock:
+            for resource in list(self.sessions):
+                try:
+                    self.close(resource)
+                except visa.VisaIOError as e:
+                    print(e.args)
+            if self.rm is not None:
+                self.rm.close()
+                self.rm = None
+
+    def startRecording(self, transcript = None):
+        '''
+        Records every transaction of the sessions handed out from now on.
+
+        Drivers connected before recording started are not recorded.
+
+        Parameters:
+        -----------
+        transcript : Transcript
+            Transcript to append to. A new one is created if None.
+
+        Returns:
+        ----------
+        transcript : Transcript
+            The transcript being recorded.
+        '''
+        with self.lock:
+            self.transcript = transcript if transcript is not None else Transcript()
+            return self.transcript
+
+    def stopRecording(self, filename = None):
+        '''
+        Stops recording and optionally saves the transcript.
+
+        Parameters:
+        -----------
+        filename : str
+            JSON file to save the transcript in. Not saved if None.
+
+        Returns:
+        ----------
+        transcript : Transcript
+            The recorded transcript.
+        '''
+        with self.lock:
+            transcript = self.transcript
+            self.transcript = None
+        if transcript is not None and filename:
+            transcript.save(filename)
+        return transcript
+
+    def simulate(self, transcript, latency = None, timeScale = 1.0, strict = False):
+        '''
+        Replaces all sessions with simulated sessions replaying a transcript.
+
+        Open sessions are closed, so drivers must be (re)connected afterwards.
+
+        Parameters:
+        -----------
+        transcript : Transcript or str
+            The transcript, or the name of a transcript file.
+        latency : None, float or dict
+            Transaction latency, see simulator.SimulatedSession.
+        timeScale : float
+            Factor applied to the recorded durations.
+        strict : bool
+            Time out on queries that are not in the transcript.
+
+        Returns:
+        ----------
+        N/A
+        '''
+        if isinstance(transcript, str):
+            transcript = Transcript.load(transcript)
+        with self.lock:
+            self.closeAll()
+            self.simulator = Simulator(transcript, latency, timeScale, strict)
+
+    def stopSimulation(self):
+        '''
+        Closes the simulated sessions; sessions opened afterwards are real again.
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        N/A
+        '''
+        with self.lock:
+            self.closeAll()
+            self.simulator = None
+
+    def isOpen(self, session):
+        '''
+        Checks whether a session is still valid (i.e. has not been closed elsewhere).
+
+        Parameters:
+        -----------
+        session : pyvisa Resource
+            The session to check.
+
+        Returns:
+        ----------
+        isOpen : bool
+            True if the session can still be used.
+        '''
+        try:
+            session.session
+        except Exception:
+            return False
+        return True
+
+    def restoreDefaults(self, resource, session):
+        '''
+        Resets timeouts and terminations changed by a previous user of the session.
+
+        Parameters:
+        -----------
+        resource : str
+            A string containing the VISA address of the device.
+        session : pyvisa Resource
+            The pooled session.
+
+        Returns:
+        ----------
+        N/A
+        '''
+        for attr, value in self.defaults.get(resource, {}).items():
+            if getattr(session, attr) != value:
+                setattr(session, attr, value)
+
+    def report(self):
+        '''
+        Returns the pool statistics.
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        stats : dict
+            Counts and total times (in seconds) for ResourceManager creation,
+            session opens and session reuses, plus the number of sessions
+            currently held open and in use.
+        '''
+        with self.lock:
+            stats = dict(self.stats)
+            stats['openSessions'] = len(self.sessions)
+            stats['inUse'] = sum(1 for n in self.users.values() if n > 0)
+            return stats
+
+    def printReport(self):
+        '''
+        Prints the pool statistics.
+
+        Parameters:
+        -----------
+        N/A
+
+        Returns:
+        ----------
+        N/A
+        '''
+        s = self.report()
+        print('VISA pool: {} open sessions ({} in use).'.format(s['openSessions'],s['inUse']))
+        print('  ResourceManager init: {} in {:.3f} s'.format(s['rmInits'],s['rmInitTime']))
+        print('  Session opens: {} in {:.3f} s'.format(s['opens'],s['openTime']))
+        print('  Session reuses: {} in {:.3f} s'.format(s['reuses'],s['reuseTime']))
+
+
+pool = VisaSessionPool()
+atexit.register(pool.closeAll)
+
+# run unchanged measurement scripts against a recording, or record them
+if os.environ.get('PYMEASRF_REPLAY'):
+    pool.simulate(os.environ['PYMEASRF_REPLAY'])
+elif os.environ.get('PYMEASRF_RECORD'):
+    pool.startRecording()
+    atexit.register(pool.stopRecording, os.environ['PYMEASRF_RECORD'])
+
+def openResource(resource, **kwargs):
+    '''
+    Opens (or reuses) a session for the given resource from the shared pool.
+    See VisaSessionPool.openResource().
+    '''
+    return pool.openResource(resource, **kwargs)
+
+def release(resource):
+    '''
+    Returns a session to the shared pool. See VisaSessionPool.release().
+    '''
+    pool.release(resource)